@@ -3,8 +3,12 @@ from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 from .services import get_ai_service
 from .models import Conversation, Message
+from django.conf import settings
+from . import singleflight, tokens, usage
 from asgiref.sync import sync_to_async
+from contextlib import aclosing
 import logging
+import time
 
 logger = logging.getLogger(__name__)
 
@@ -15,6 +19,8 @@ class ChatConsumer(AsyncWebsocketConsumer):
         """处理连接 - 加入对话组"""
         self.conversation_id = self.scope['url_route']['kwargs']['conversation_id']
         self.room_group_name = f'chat_{self.conversation_id}'
+        # 对话所属用户的ID，用于用量记录和额度检查，第一次收到消息时查询
+        self.user_id = None
         
         # 加入房间组
         await self.channel_layer.group_add(
@@ -55,6 +61,23 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 }))
                 return
                 
+            if tokens.estimate_tokens(message) + tokens.MESSAGE_OVERHEAD > settings.AI_CONTEXT_TOKEN_BUDGET:
+                await self.send(text_data=json.dumps({
+                    'type': 'error',
+                    'message': '消息过长，请缩短后再发送'
+                }))
+                return
+                
+            # 检查对话所属用户当天的AI用量额度
+            if self.user_id is None:
+                self.user_id = await self.get_conversation_user_id()
+            if await sync_to_async(usage.quota_exceeded)(self.user_id):
+                await self.send(text_data=json.dumps({
+                    'type': 'error',
+                    'message': '今日AI使用额度已用完，请明天再试'
+                }))
+                return
+                
             # 告知用户我们正在处理
             await self.send(text_data=json.dumps({
                 'type': 'status',
@@ -80,21 +103,36 @@ class ChatConsumer(AsyncWebsocketConsumer):
             # 获取对话历史
             formatted_messages = await self.get_conversation_history()
             
-            # 获取AI服务和响应
+            # 获取AI服务，以流式方式获取响应并逐块发送给当前连接；
+            # 同时进行中的相同请求（包括 SSE 接口的请求）共享一次模型服务调用
             ai_service = await sync_to_async(get_ai_service)(service_type=service_type, use_case=use_case)
-            response = await sync_to_async(ai_service.get_response)(formatted_messages, use_case=use_case)
-            
-            # 根据服务类型提取AI响应
-            if service_type == 'ollama':
-                ai_message = response.get('message', {}).get('content', '')
-            else:  # DeepSeek使用类似OpenAI的响应格式
-                ai_message = response.get('choices', [{}])[0].get('message', {}).get('content', '')
+            key = singleflight.flight_key(ai_service, formatted_messages, use_case)
+            producer = lambda: ai_service.aget_streaming_response(formatted_messages, use_case=use_case)
+            parts = []
+            reported = None
+            started = time.monotonic()
+            first_token_at = None
+            async with aclosing(singleflight.stream(key, producer)) as chunks:
+                async for chunk in chunks:
+                    if chunk.usage is not None:
+                        reported = chunk.usage
+                    if chunk.content:
+                        if first_token_at is None:
+                            first_token_at = time.monotonic()
+                        parts.append(chunk.content)
+                        await self.send(text_data=json.dumps({
+                            'type': 'chunk',
+                            'chunk': chunk.content
+                        }))
+            ai_message = ''.join(parts)
             
             if not ai_message:
                 raise ValueError("无法从AI响应中提取消息内容")
             
-            # 保存AI响应
-            ai_response = await self.save_message('assistant', ai_message)
+            # 保存AI响应及其用量，并累计到用户当天的用量
+            ai_response = await self.save_message('assistant', ai_message,
+                                                  reply_usage=(reported, started, first_token_at))
+            await sync_to_async(usage.record)(self.user_id, ai_response)
             
             # 广播AI消息到组
             await self.channel_layer.group_send(
@@ -128,22 +166,38 @@ class ChatConsumer(AsyncWebsocketConsumer):
         }))
     
     @database_sync_to_async
-    def save_message(self, role, content):
-        """将消息保存到数据库"""
+    def save_message(self, role, content, reply_usage=None):
+        """将消息保存到数据库
+        
+        参数:
+            reply_usage: AI回复的 (用量, 请求开始时间, 第一个 token 的时间)，见 usage.set_message_usage
+        """
         conversation = Conversation.objects.get(id=self.conversation_id)
-        message = Message.objects.create(
+        # 对话的更新时间和消息统计由 Message 的信号维护
+        message = Message(
             conversation=conversation,
             role=role,
             content=content
         )
-        # 更新对话的updated_at时间戳
-        conversation.save()
+        if reply_usage is not None:
+            usage.set_message_usage(message, *reply_usage)
+        else:
+            message.token_count = tokens.estimate_tokens(content)
+        message.save()
         return message
     
+    @database_sync_to_async
+    def get_conversation_user_id(self):
+        """获取对话所属用户的ID"""
+        return Conversation.objects.values_list('user_id', flat=True).get(id=self.conversation_id)
+    
     @database_sync_to_async
     def get_conversation_history(self):
-        """获取AI上下文的对话历史"""
-        conversation = Conversation.objects.get(id=self.conversation_id)
-        # 限制为最后20条消息，避免上下文问题
-        messages = Message.objects.filter(conversation=conversation).order_by('timestamp')[:20]
-        return [{"role": msg.role, "content": msg.content} for msg in messages]
+        """获取AI上下文的对话历史：最近20条消息中按 token 预算从最新的消息向前保留"""
+        recent = list(
+            Message.objects.filter(conversation_id=self.conversation_id)
+            .only('id', 'role', 'content', 'token_count')
+            .order_by('-id')[:20]
+        )[::-1]
+        history, _ = tokens.trim_history(recent, settings.AI_CONTEXT_TOKEN_BUDGET)
+        return [{"role": msg.role, "content": msg.content} for msg in history]
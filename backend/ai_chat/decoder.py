@@ -0,0 +1,177 @@
+"""模型服务流式响应的增量解码
+
+DeepSeek（OpenAI 兼容）的流式响应是 SSE，每个事件一行 ``data: {...}``，以 ``data: [DONE]`` 结束；
+Ollama 的流式响应是 NDJSON，每行一个 JSON 对象，最后一行 ``"done": true``。
+
+``StreamDecoder`` 直接处理网络读到的原始字节块：字节追加到可复用的缓冲区，只对完整的行做解析，
+跨块的行（包括被截断的多字节 UTF-8 字符）留在缓冲区等待下一块。不解析整个 JSON 对象，只用正则
+取出 ``"content"`` 字段的字符串，含转义字符时才交给 JSON 解析器（安装了 orjson 时使用 orjson）。
+两种格式都产出统一的 ``StreamChunk``，最后一块为 ``StreamChunk('', True, usage)``。
+
+模型服务报告的用量（DeepSeek 在 ``[DONE]`` 之前的 ``usage`` 事件，Ollama 在最后一行的
+``prompt_eval_count``/``eval_count``）统一为 ``Usage``，随最后一块返回；没有报告时为 None。
+"""
+import json
+import re
+from collections import namedtuple
+
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
+SSE = 'sse'
+NDJSON = 'ndjson'
+
+# content: 本块的文本；done: 是否是结束标记（结束标记的 content 为空）；usage: 结束标记携带的用量
+StreamChunk = namedtuple('StreamChunk', ['content', 'done', 'usage'], defaults=(None,))
+
+# 一次请求的 token 用量；cached_tokens 是 prompt_tokens 中命中服务端缓存的部分
+Usage = namedtuple('Usage', ['prompt_tokens', 'completion_tokens', 'cached_tokens'])
+
+# "content" 字段的字符串值（展开循环写法，避免逐字符回溯；前面必须紧跟引号，不会匹配 "reasoning_content"）；
+# 值为 null 时分组为空。正则以字面量开头，扫描时可以快速跳过无关字节
+_CONTENT_RE = re.compile(rb'"content"\s*:\s*(?:"([^"\\\n]*(?:\\.[^"\\\n]*)*)"|null)')
+# 结束标记。SSE 的 [DONE] 必须在行首，但行首断言会让正则失去字面量前缀优化，匹配后再检查
+_DONE_RES = {
+    SSE: re.compile(rb'data:[ \t]*\[DONE\]'),
+    NDJSON: re.compile(rb'"done"\s*:\s*true'),
+}
+# 包含用量的行。OpenAI 兼容的服务可能在每个事件中都带 "usage": null，只匹配对象值
+_USAGE_RES = {
+    SSE: re.compile(rb'"usage"\s*:\s*\{'),
+    NDJSON: re.compile(rb'"eval_count"\s*:'),
+}
+
+
+def usage_from_payload(framing, payload):
+    """从模型服务的响应对象中取出用量，没有报告用量时返回 None
+
+    SSE 对应 OpenAI 兼容格式（DeepSeek），同样适用于它的非流式响应；NDJSON 对应 Ollama 格式。
+    """
+    if framing == SSE:
+        usage = payload.get('usage')
+        if not usage:
+            return None
+        details = usage.get('prompt_tokens_details') or {}
+        return Usage(
+            usage.get('prompt_tokens') or 0,
+            usage.get('completion_tokens') or 0,
+            usage.get('prompt_cache_hit_tokens') or details.get('cached_tokens') or 0,
+        )
+    if 'eval_count' not in payload and 'prompt_eval_count' not in payload:
+        return None
+    return Usage(payload.get('prompt_eval_count') or 0, payload.get('eval_count') or 0, 0)
+
+class StreamDecoder:
+    """增量解码 SSE 或 NDJSON 字节流
+
+    每次 ``feed`` 先查找结束标记，再用一个正则扫描缓冲区中结束标记之前的所有完整行，逐个取出
+    ``"content"`` 字符串，每个 token 只有一次 Python 层的处理。用法::
+
+        decoder = StreamDecoder(SSE)
+        for data in response.iter_content(chunk_size=None):
+            for chunk in decoder.feed(data):
+                ...
+        for chunk in decoder.close():
+            ...
+    """
+
+    def __init__(self, framing):
+        if framing not in _DONE_RES:
+            raise ValueError(f'不支持的流格式: {framing}')
+        self.framing = framing
+        self.done = False
+        self.usage = None
+        self._done_re = _DONE_RES[framing]
+        self._buffer = bytearray()
+
+    def feed(self, data):
+        """追加一块字节，返回其中完整行解码出的 StreamChunk 列表"""
+        buffer = self._buffer
+        start = len(buffer)
+        buffer += data
+        # 新数据里没有换行时不必扫描整个缓冲区
+        end = buffer.rfind(b'\n', start)
+        if end < 0:
+            return []
+        chunks = self._scan(end)
+        del buffer[:end + 1]
+        return chunks
+
+    def close(self):
+        """处理没有以换行结尾的最后一行"""
+        chunks = self._scan(len(self._buffer))
+        self._buffer.clear()
+        return chunks
+
+    def _scan(self, end):
+        if self.done:
+            return []
+        buffer = self._buffer
+        if self.usage is None:
+            self._find_usage(end)
+        done = self._find_done(end)
+        if done >= 0:
+            end = done
+        # 没有转义字符时直接按 UTF-8 解码，否则交给 JSON 解析器处理转义
+        chunks = [
+            StreamChunk(_loads(b'"' + raw + b'"') if b'\\' in raw else raw.decode('utf-8'), False)
+            for raw in _CONTENT_RE.findall(buffer, 0, end) if raw
+        ]
+        if done >= 0:
+            self.done = True
+            chunks.append(StreamChunk('', True, self.usage))
+        return chunks
+
+    def _find_usage(self, end):
+        """解析包含用量的行（每次请求只有一行，完整解析它的 JSON）"""
+        buffer = self._buffer
+        match = _USAGE_RES[self.framing].search(buffer, 0, end)
+        if match is None:
+            return
+        start = buffer.rfind(b'\n', 0, match.start()) + 1
+        stop = buffer.find(b'\n', match.end(), end)
+        line = bytes(buffer[start:stop if stop >= 0 else end]).strip()
+        if line.startswith(b'data:'):
+            line = line[5:]
+        try:
+            self.usage = usage_from_payload(self.framing, _loads(line))
+        except (ValueError, AttributeError):
+            pass
+
+    def _find_done(self, end):
+        """返回结束标记在缓冲区中的位置，没有时返回 -1"""
+        buffer = self._buffer
+        position = 0
+        while True:
+            match = self._done_re.search(buffer, position, end)
+            if match is None:
+                return -1
+            start = match.start()
+            # JSON 字符串中不会有未转义的换行，位于行首的才是真正的结束标记
+            if self.framing == NDJSON or start == 0 or buffer[start - 1] == 0x0a:
+                return start
+            position = match.end()
+
+def decode_stream(framing, byte_chunks):
+    """解码同步的字节块迭代器，逐个产出 StreamChunk，遇到结束标记后停止"""
+    decoder = StreamDecoder(framing)
+    for data in byte_chunks:
+        yield from decoder.feed(data)
+        if decoder.done:
+            return
+    yield from decoder.close()
+
+
+async def adecode_stream(framing, byte_chunks):
+    """解码异步的字节块迭代器，逐个产出 StreamChunk，遇到结束标记后停止"""
+    decoder = StreamDecoder(framing)
+    async for data in byte_chunks:
+        for chunk in decoder.feed(data):
+            yield chunk
+        if decoder.done:
+            return
+    for chunk in decoder.close():
+        yield chunk
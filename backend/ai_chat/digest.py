@@ -0,0 +1,157 @@
+"""学生体测档案摘要
+
+AI助手的系统提示词需要学生的实际体测情况。身高、体重等数据在 TestResult 上而不是 Student 上，
+每次对话都重新统计需要四五次查询，因此为每个学生编译一段紧凑的文本摘要并缓存：
+
+- 最近一次成绩：身高、体重、BMI 和总分，是否通过
+- 各单项成绩及是否达到对应性别体测标准的及格线
+- 与之前几次测试相比的变化趋势
+- 尚未参加的补考
+
+成绩或补考通知的写入、删除会清除该学生的摘要（见 ai_chat.models 中的信号）；体测标准变化时
+递增摘要的版本号，使所有学生的摘要一起失效。缓存命中时不查询数据库。
+"""
+from django.core.cache import cache
+from fitness.models import MakeupNotification, PhysicalStandard, Student, TestResult
+
+# 摘要缓存的有效期（秒），过期后重新编译一次，避免遗漏未触发信号的批量修改
+DIGEST_CACHE_TIMEOUT = 3600
+# 计算趋势时读取的最近成绩数
+TREND_RESULTS = 3
+
+VERSION_KEY = 'ai:digest:version'
+
+# 单项：(字段, 名称, 单位, 数值越大越好)，顺序与 PhysicalStandard.check_items 的参数一致
+ITEMS = (
+    ('vital_capacity', '肺活量', 'ml', True),
+    ('run_50m', '50米跑', '秒', False),
+    ('sit_and_reach', '坐位体前屈', 'cm', True),
+    ('standing_jump', '立定跳远', 'cm', True),
+    ('run_800m', '800米跑', '秒', False),
+)
+
+
+def _version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        version = 1
+        cache.add(VERSION_KEY, version, None)
+    return version
+
+
+def digest_cache_key(student_id, version=None):
+    """获取学生摘要的缓存键"""
+    return f'ai:digest:{version or _version()}:student:{student_id}'
+
+
+def invalidate(*student_ids):
+    """清除学生的摘要缓存"""
+    version = _version()
+    cache.delete_many([digest_cache_key(student_id, version) for student_id in student_ids if student_id])
+
+
+def invalidate_all():
+    """体测标准变化时使所有学生的摘要失效"""
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, 2, None)
+
+
+def get_digests(student_ids):
+    """获取多个学生的摘要，返回 {学生ID: 摘要文本}，没有成绩的学生摘要为空字符串"""
+    version = _version()
+    keys = {student_id: digest_cache_key(student_id, version) for student_id in student_ids}
+    cached = cache.get_many(keys.values())
+    digests = {}
+    for student_id, key in keys.items():
+        if key in cached:
+            digests[student_id] = cached[key]
+        else:
+            digests[student_id] = build_digest(student_id)
+            cache.set(key, digests[student_id], DIGEST_CACHE_TIMEOUT)
+    return digests
+
+
+def get_digest(student_id):
+    """获取一个学生的摘要"""
+    return get_digests([student_id])[student_id]
+
+
+def _format_number(value):
+    return f'{value:g}'
+
+
+def _bmi_status(bmi, standard):
+    if standard is None:
+        return ''
+    if bmi < standard.bmi_min:
+        return '偏低'
+    if bmi > standard.bmi_max:
+        return '偏高'
+    return '正常'
+
+
+def build_digest(student_id):
+    """查询数据库编译学生的摘要文本"""
+    student = Student.objects.filter(id=student_id).only('id', 'gender').first()
+    if student is None:
+        return ''
+    results = list(
+        TestResult.objects.filter(student_id=student_id)
+        .select_related('test_plan')
+        .order_by('-test_date', '-id')[:TREND_RESULTS]
+    )
+    if not results:
+        return ''
+    standard = PhysicalStandard.objects.filter(gender=student.gender).first()
+    pending = list(
+        MakeupNotification.objects.filter(student_id=student_id)
+        .exclude(test_plan__testresult__student_id=student_id)
+        .select_related('test_plan')
+        .order_by('test_plan__test_date')
+    )
+
+    latest = results[0]
+    passed = latest.passes_standard(standard)
+    lines = [
+        f"学生体测档案（{student.get_gender_display()}生）：",
+        f"最近一次：{latest.test_plan.title}（{latest.test_date:%Y-%m-%d}），总分{latest.total_score}，"
+        f"{'通过' if passed else '未通过'}",
+    ]
+    if latest.height and latest.weight:
+        bmi_status = _bmi_status(latest.bmi, standard)
+        lines.append(
+            f"身高{_format_number(latest.height)}cm，体重{_format_number(latest.weight)}kg，"
+            f"BMI {latest.bmi:.1f}{f'（{bmi_status}）' if bmi_status else ''}"
+        )
+
+    values = [getattr(latest, field) for field, *_ in ITEMS]
+    checks = standard.check_items(*values) if standard else (None,) * len(ITEMS)
+    items = []
+    for (field, name, unit, _), value, ok in zip(ITEMS, values, checks):
+        text = f"{name}{_format_number(value)}{unit}"
+        if ok is not None:
+            text += '达标' if ok else f"未达标（及格{_format_number(getattr(standard, f'{field}_pass'))}{unit}）"
+        items.append(text)
+    lines.append('单项：' + '；'.join(items))
+
+    if len(results) > 1:
+        previous = results[1]
+        history = ' → '.join(f"{result.total_score}（{result.test_plan.title}）" for result in reversed(results))
+        changes = []
+        for field, name, unit, higher_better in ITEMS:
+            delta = getattr(latest, field) - getattr(previous, field)
+            if delta:
+                better = (delta > 0) == higher_better
+                changes.append(f"{name}{delta:+g}{unit}（{'进步' if better else '退步'}）")
+        lines.append(f"历次总分：{history}")
+        if changes:
+            lines.append('较上次：' + '；'.join(changes))
+
+    if pending:
+        lines.append('待参加补考：' + '；'.join(
+            f"{notification.test_plan.title}（{notification.test_plan.test_date:%Y-%m-%d}，{notification.test_plan.location}）"
+            for notification in pending
+        ))
+    return '\n'.join(lines)
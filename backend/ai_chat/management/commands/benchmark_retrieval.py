@@ -0,0 +1,140 @@
+import random
+import shutil
+import statistics
+import tempfile
+import time
+from pathlib import Path
+from django.core.management.base import BaseCommand
+from ai_chat import retrieval
+from ai_chat.retrieval import KIND_NEWS, PassageIndex
+
+# 生成模拟新闻段落的词汇
+WORDS = [
+    '体测', '肺活量', '五十米跑', '坐位体前屈', '立定跳远', '八百米跑', '一千米跑', '引体向上', '仰卧起坐', '跳绳',
+    '篮球', '足球', '排球', '乒乓球', '羽毛球', '网球', '游泳', '田径', '马拉松', '健美操',
+    '训练', '比赛', '冠军', '校队', '联赛', '运动会', '选拔', '教练', '裁判', '观众',
+    '拉伸', '热身', '耐力', '爆发力', '柔韧性', '协调性', '核心力量', '有氧运动', '无氧运动', '间歇跑',
+    '营养', '蛋白质', '碳水化合物', '饮水', '睡眠', '恢复', '伤病', '膝关节', '脚踝', '肌肉',
+    '学生', '班级', '年级', '学院', '体育课', '体育老师', '家长', '健康', '体重', '身高',
+    '成绩', '及格', '优秀', '补考', '标准', '提高', '下降', '进步', '记录', '纪录',
+    '春季', '秋季', '操场', '体育馆', '报名', '通知', '安排', '计划', '活动', '讲座',
+]
+QUESTION_PREFIXES = ['', '请问', '怎样', '如何', '为什么', '有没有关于']
+QUESTION_SUFFIXES = ['', '？', '的建议', '有什么要求', '怎么办', '的新闻']
+
+
+def make_passage(rng, size):
+    words = []
+    length = 0
+    while length < size:
+        word = rng.choice(WORDS) if rng.random() < 0.9 else str(rng.randint(1, 3000))
+        words.append(word)
+        length += len(word)
+    # 模拟标点，每隔几个词断句
+    return ''.join(word + ('，' if rng.random() < 0.15 else '') for word in words) + '。'
+
+
+def make_query(rng, text, span, noise):
+    """从段落中截取一段连续文本，随机替换部分字符，加上提问的前后缀"""
+    start = rng.randint(0, max(0, len(text) - span))
+    chars = list(text[start:start + span])
+    for i in range(len(chars)):
+        if rng.random() < noise:
+            chars[i] = rng.choice(rng.choice(WORDS))
+    return rng.choice(QUESTION_PREFIXES) + ''.join(chars) + rng.choice(QUESTION_SUFFIXES)
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+class Command(BaseCommand):
+    help = '本地检索的基准测试：召回率（recall@1、recall@k）、检索延迟和增量更新延迟'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--passages', type=int, default=20000, help='模拟的新闻段落数')
+        parser.add_argument('--queries', type=int, default=1000, help='检索次数')
+        parser.add_argument('--top-k', type=int, default=3)
+        parser.add_argument('--span', type=int, default=20, help='查询从段落中截取的字符数')
+        parser.add_argument('--noise', type=float, default=0.1, help='查询中被随机替换的字符比例')
+        parser.add_argument('--updates', type=int, default=200, help='增量更新（替换一条新闻的段落）的次数')
+        parser.add_argument('--database', action='store_true',
+                            help='使用数据库中已发布的新闻和体测标准，以新闻标题作为查询')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        k = options['top_k']
+        directory = Path(tempfile.mkdtemp(prefix='retrieval-benchmark-'))
+        try:
+            if options['database']:
+                records = list(retrieval.iter_records())
+                titles = {}
+                for kind, object_id, text in records:
+                    if kind == KIND_NEWS:
+                        titles.setdefault(object_id, text[1:text.index('》')])
+                queries = [(title, object_id) for object_id, title in titles.items()]
+                rng.shuffle(queries)
+                queries = queries[:options['queries']]
+            else:
+                records = [
+                    (KIND_NEWS, i, make_passage(rng, retrieval.PASSAGE_CHARS))
+                    for i in range(options['passages'])
+                ]
+                queries = []
+                for _ in range(options['queries']):
+                    _, object_id, text = rng.choice(records)
+                    queries.append((make_query(rng, text, options['span'], options['noise']), object_id))
+            if not records or not queries:
+                self.stderr.write('没有可用于测试的段落或查询')
+                return
+
+            index = PassageIndex(directory)
+            start = time.perf_counter()
+            count = index.rebuild(records)
+            build_seconds = time.perf_counter() - start
+            size = sum(path.stat().st_size for path in directory.rglob('*.bin'))
+            self.stdout.write(
+                f'建立索引: {count} 个段落，{build_seconds:.2f} 秒，{size / 1024 / 1024:.1f}MB'
+            )
+            self.report(index, queries, k, '检索')
+
+            # 增量更新：替换随机新闻的段落，追加部分未排序，检索时逐条比较
+            timings = []
+            replaced = set()
+            for _ in range(options['updates']):
+                object_id = rng.choice(queries)[1]
+                text = make_passage(rng, retrieval.PASSAGE_CHARS)
+                start = time.perf_counter()
+                index.replace(KIND_NEWS, object_id, [text])
+                timings.append((time.perf_counter() - start) * 1000)
+                replaced.add(object_id)
+            if timings:
+                self.stdout.write(
+                    f'增量更新: {len(timings)} 次，p50 {statistics.median(timings):.2f}ms，'
+                    f'p95 {percentile(timings, 0.95):.2f}ms'
+                )
+                # 被替换的新闻不再能按原文检索到，只统计其余的查询
+                remaining = [(query, expected) for query, expected in queries if expected not in replaced]
+                if remaining:
+                    self.report(index, remaining, k, '更新后检索')
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def report(self, index, queries, k, label):
+        timings = []
+        hits_at_1 = hits_at_k = 0
+        for query, expected in queries:
+            start = time.perf_counter()
+            passages = index.search(query, k, min_score=0)
+            timings.append((time.perf_counter() - start) * 1000)
+            ids = [passage.object_id for passage in passages]
+            hits_at_1 += bool(ids) and ids[0] == expected
+            hits_at_k += expected in ids
+        self.stdout.write(
+            f'{label}: {len(queries)} 次，recall@1 {hits_at_1 / len(queries):.3f}，'
+            f'recall@{k} {hits_at_k / len(queries):.3f}，'
+            f'延迟 p50 {statistics.median(timings):.2f}ms，p95 {percentile(timings, 0.95):.2f}ms，'
+            f'p99 {percentile(timings, 0.99):.2f}ms'
+        )
@@ -0,0 +1,98 @@
+import json
+import random
+import statistics
+import time
+from django.core.management.base import BaseCommand
+from ai_chat import decoder
+from ai_chat.decoder import StreamDecoder, SSE, NDJSON
+
+# 模拟的生成内容，中英文混合并包含需要转义的字符
+TOKENS = ['坚持', '每天', ' running', '30', '分钟', '，', '"拉伸"', '\n', ' and', ' strength', '练习', '。']
+
+
+def build_stream(framing, tokens):
+    lines = []
+    for token in tokens:
+        if framing == SSE:
+            payload = {'id': 'chatcmpl-1', 'object': 'chat.completion.chunk', 'model': 'deepseek-chat',
+                       'choices': [{'index': 0, 'delta': {'content': token}, 'finish_reason': None}]}
+            lines.append(f'data: {json.dumps(payload, ensure_ascii=False)}\n\n')
+        else:
+            payload = {'model': 'deepseek-r1:1.5b', 'created_at': '2025-04-07T22:25:00Z',
+                       'message': {'role': 'assistant', 'content': token}, 'done': False}
+            lines.append(json.dumps(payload, ensure_ascii=False) + '\n')
+    lines.append('data: [DONE]\n\n' if framing == SSE else '{"message": {"role": "assistant", "content": ""}, "done": true}\n')
+    return ''.join(lines).encode('utf-8')
+
+
+def split_stream(data, max_chunk, rng):
+    """按随机大小切分字节流，模拟网络读到的数据块（可能截断行和多字节字符）"""
+    chunks = []
+    position = 0
+    while position < len(data):
+        size = rng.randint(1, max_chunk)
+        chunks.append(data[position:position + size])
+        position += size
+    return chunks
+
+
+def legacy_decode(framing, chunks):
+    """改造前的解码方式：按行切分、解码为字符串、检查前缀后完整解析JSON"""
+    buffer = b''
+    for data in chunks:
+        buffer += data
+        *lines, buffer = buffer.split(b'\n')
+        for line in lines:
+            if not line:
+                continue
+            line_text = line.decode('utf-8')
+            if framing == SSE:
+                if line_text.startswith('data: '):
+                    line_text = line_text[6:]
+                if line_text == '[DONE]':
+                    return
+                chunk = json.loads(line_text)
+                yield chunk.get('choices', [{}])[0].get('delta', {}).get('content', '')
+            else:
+                chunk = json.loads(line_text)
+                yield chunk.get('message', {}).get('content', '')
+
+
+def decoder_decode(framing, chunks):
+    for chunk in decoder.decode_stream(framing, chunks):
+        yield chunk.content
+
+
+class Command(BaseCommand):
+    help = '流式响应解码的微基准：比较增量解码器与逐行完整解析JSON的每秒解码token数'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tokens', type=int, default=200000, help='每轮解码的token数')
+        parser.add_argument('--max-chunk', type=int, default=1024, help='模拟网络数据块的最大字节数')
+        parser.add_argument('--repeat', type=int, default=5, help='重复轮数，取中位数')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        tokens = [TOKENS[i % len(TOKENS)] for i in range(options['tokens'])]
+        expected = ''.join(tokens)
+        self.stdout.write(f'JSON解析器: {"orjson" if decoder._loads is not json.loads else "json"}')
+
+        for framing in (SSE, NDJSON):
+            data = build_stream(framing, tokens)
+            chunks = split_stream(data, options['max_chunk'], rng)
+            rates = {}
+            for name, decode in (('legacy', legacy_decode), ('decoder', decoder_decode)):
+                timings = []
+                for _ in range(options['repeat']):
+                    start = time.perf_counter()
+                    text = ''.join(decode(framing, chunks))
+                    timings.append(time.perf_counter() - start)
+                if text != expected:
+                    self.stderr.write(f'{framing} {name} 解码结果不正确')
+                rates[name] = len(tokens) / statistics.median(timings)
+                self.stdout.write(
+                    f'{framing:<7} {name:<8} {rates[name]:>12,.0f} tokens/s  '
+                    f'({len(data) / 1024 / 1024:.1f}MB, {len(chunks)} 块)'
+                )
+            self.stdout.write(f'{framing:<7} 加速 {rates["decoder"] / rates["legacy"]:.2f}x')
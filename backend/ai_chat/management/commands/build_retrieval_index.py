@@ -0,0 +1,16 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from ai_chat import retrieval
+
+
+class Command(BaseCommand):
+    help = '从已发布的体育新闻和体测标准重新建立AI助手的本地检索索引'
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        count = retrieval.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f'已建立检索索引: {count} 个段落，用时 {time.perf_counter() - start:.2f} 秒'
+            f'（{settings.AI_RETRIEVAL_INDEX_DIR}）'
+        ))
@@ -0,0 +1,59 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:58
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Left
+
+
+def backfill_message_stats(apps, schema_editor):
+    """根据已有消息填充对话的消息统计"""
+    Conversation = apps.get_model('ai_chat', 'Conversation')
+    Message = apps.get_model('ai_chat', 'Message')
+    messages = Message.objects.filter(conversation=OuterRef('pk'))
+    latest = messages.order_by('-id')
+    count = messages.order_by().values('conversation').annotate(c=Count('id')).values('c')
+    Conversation.objects.update(
+        message_count=Coalesce(Subquery(count), 0),
+        last_message_preview=Coalesce(
+            Subquery(latest.annotate(preview=Left('content', 100)).values('preview')[:1]), Value('')
+        ),
+        last_message_role=Coalesce(Subquery(latest.values('role')[:1]), Value('')),
+        last_message_at=Subquery(latest.values('timestamp')[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_chat', '0002_alter_conversation_options_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message_preview',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message_role',
+            field=models.CharField(blank=True, default='', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='message_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='conversation',
+            index=models.Index(fields=['user', '-updated_at'], name='ai_conv_user_updated_idx'),
+        ),
+        migrations.RunPython(backfill_message_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_chat', '0003_conversation_message_stats'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['conversation', 'id'], name='ai_msg_conversation_id_idx'),
+        ),
+    ]
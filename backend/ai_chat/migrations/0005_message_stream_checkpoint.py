@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_chat', '0004_message_conversation_id_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='stream_event_id',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='stream_status',
+            field=models.CharField(blank=True, choices=[('streaming', 'Streaming'), ('complete', 'Complete'), ('interrupted', 'Interrupted')], default='', max_length=12),
+        ),
+    ]
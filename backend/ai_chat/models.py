@@ -1,10 +1,18 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Count, Exists, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Left
+from django.db.models.query import QuerySet
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
 from django.contrib.auth import get_user_model
 
 User = get_user_model()
 
 # Create your models here.
 
+# 会话列表中最后一条消息预览的长度
+PREVIEW_LENGTH = 100
+
 class Conversation(models.Model):
     """用户和AI之间的对话"""
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='ai_conversations')
@@ -13,6 +21,11 @@ class Conversation(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     use_memory = models.BooleanField(default=True)
     memory_summary = models.TextField(blank=True, null=True)
+    # 冗余的消息统计，由 Message 的信号维护，会话列表无需加载消息
+    message_count = models.PositiveIntegerField(default=0)
+    last_message_preview = models.CharField(max_length=PREVIEW_LENGTH, blank=True, default='')
+    last_message_role = models.CharField(max_length=10, blank=True, default='')
+    last_message_at = models.DateTimeField(null=True, blank=True)
     
     def __str__(self):
         return f"{self.title} ({self.user.username})"
@@ -21,9 +34,34 @@ class Conversation(models.Model):
         """更新记忆摘要"""
         self.memory_summary = new_summary
         self.save(update_fields=['memory_summary'])
+
+    @classmethod
+    def refresh_message_stats(cls, conversation_ids):
+        """根据消息表重新计算对话的消息数和最后一条消息预览
+
+        对所有传入的对话只执行一条带子查询的 UPDATE。
+        """
+        conversation_ids = set(conversation_ids)
+        if not conversation_ids:
+            return 0
+        messages = Message.objects.filter(conversation=OuterRef('pk'))
+        latest = messages.order_by('-id')
+        count = messages.order_by().values('conversation').annotate(c=Count('id')).values('c')
+        return cls.objects.filter(id__in=conversation_ids).update(
+            message_count=Coalesce(Subquery(count), 0),
+            last_message_preview=Coalesce(
+                Subquery(latest.annotate(preview=Left('content', PREVIEW_LENGTH)).values('preview')[:1]), Value('')
+            ),
+            last_message_role=Coalesce(Subquery(latest.values('role')[:1]), Value('')),
+            last_message_at=Subquery(latest.values('timestamp')[:1]),
+        )
     
     class Meta:
         ordering = ['-updated_at']
+        indexes = [
+            # 会话列表按用户过滤并按更新时间倒序
+            models.Index(fields=['user', '-updated_at'], name='ai_conv_user_updated_idx'),
+        ]
 
 class Message(models.Model):
     ROLE_CHOICES = (
@@ -31,10 +69,140 @@ class Message(models.Model):
         ('assistant', 'Assistant'),
         ('system', 'System'),
     )
+    STREAM_STREAMING = 'streaming'
+    STREAM_COMPLETE = 'complete'
+    STREAM_INTERRUPTED = 'interrupted'
+    STREAM_STATUS_CHOICES = (
+        (STREAM_STREAMING, 'Streaming'),
+        (STREAM_COMPLETE, 'Complete'),
+        (STREAM_INTERRUPTED, 'Interrupted'),
+    )
     conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='messages')
     role = models.CharField(max_length=10, choices=ROLE_CHOICES)
     content = models.TextField()
     timestamp = models.DateTimeField(auto_now_add=True)
+    # 流式回复的生成状态和 content 对应的最后一个事件ID，用于断线续传；非流式消息为空
+    stream_status = models.CharField(max_length=12, choices=STREAM_STATUS_CHOICES, blank=True, default='')
+    stream_event_id = models.PositiveIntegerField(default=0)
+    # AI回复的用量：模型服务报告的 token 数，以及请求开始到完成、到第一个 token 的毫秒数
+    prompt_tokens = models.PositiveIntegerField(default=0)
+    completion_tokens = models.PositiveIntegerField(default=0)
+    cached_tokens = models.PositiveIntegerField(default=0)
+    latency_ms = models.PositiveIntegerField(null=True, blank=True)
+    ttft_ms = models.PositiveIntegerField(null=True, blank=True)
+    # 内容的 token 数，用于构建上下文时按预算裁剪，见 tokens 模块；为空表示尚未估算
+    token_count = models.PositiveIntegerField(null=True, blank=True)
     
     def __str__(self):
         return f"{self.role}: {self.content[:50]}..."
+    
+    class Meta:
+        indexes = [
+            # 消息历史按 (对话, ID) 做游标分页
+            models.Index(fields=['conversation', 'id'], name='ai_msg_conversation_id_idx'),
+        ]
+
+class TokenUsage(models.Model):
+    """每个用户每天的AI用量汇总
+
+    计入每日额度的 prompt_tokens、completion_tokens 由 usage 模块每条回复原子累加，
+    其余统计在内存中累计后批量写入。
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='ai_token_usage')
+    date = models.DateField()
+    requests = models.PositiveIntegerField(default=0)
+    prompt_tokens = models.PositiveBigIntegerField(default=0)
+    completion_tokens = models.PositiveBigIntegerField(default=0)
+    cached_tokens = models.PositiveBigIntegerField(default=0)
+    # 所有请求的总耗时，平均耗时为 latency_ms / requests
+    latency_ms = models.PositiveBigIntegerField(default=0)
+    
+    def __str__(self):
+        return f"{self.user_id} {self.date}: {self.prompt_tokens + self.completion_tokens} tokens"
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'date'], name='ai_usage_user_date_uniq'),
+        ]
+
+@receiver(post_save, sender=Message)
+def update_conversation_stats_on_save(sender, instance, created, **kwargs):
+    """消息写入时维护所属对话的消息数和最后一条消息预览"""
+    if created:
+        # 新消息一定是最后一条，直接累加计数，不必重新统计；同时刷新对话的更新时间
+        Conversation.objects.filter(id=instance.conversation_id).update(
+            message_count=F('message_count') + 1,
+            last_message_preview=instance.content[:PREVIEW_LENGTH],
+            last_message_role=instance.role,
+            last_message_at=instance.timestamp,
+            updated_at=instance.timestamp,
+        )
+    else:
+        # 已有消息被修改（如流式回复完成后写入内容），只有它是最后一条时预览才会变化
+        later = Message.objects.filter(conversation_id=instance.conversation_id, id__gt=instance.id)
+        Conversation.objects.filter(id=instance.conversation_id).exclude(Exists(later)).update(
+            last_message_preview=instance.content[:PREVIEW_LENGTH],
+            last_message_role=instance.role,
+        )
+
+@receiver(post_delete, sender=Message)
+def update_conversation_stats_on_delete(sender, instance, origin=None, **kwargs):
+    """消息被删除时刷新所属对话的统计"""
+    # 删除对话时级联删除的消息无需刷新；按查询集批量删除时由调用方统一刷新
+    if isinstance(origin, (Conversation, QuerySet)):
+        return
+    Conversation.refresh_message_stats([instance.conversation_id])
+
+@receiver(post_save, sender='fitness.TestResult')
+@receiver(post_delete, sender='fitness.TestResult')
+@receiver(post_save, sender='fitness.MakeupNotification')
+@receiver(post_delete, sender='fitness.MakeupNotification')
+def invalidate_student_digest(sender, instance, **kwargs):
+    """成绩或补考通知变化时，清除该学生的体测档案摘要"""
+    from .digest import invalidate
+    invalidate(instance.student_id)
+
+@receiver(post_save, sender='fitness.Student')
+def invalidate_student_digest_on_profile(sender, instance, created, **kwargs):
+    """学生档案修改（如性别变化影响适用的体测标准）时，清除该学生的摘要"""
+    if not created:
+        from .digest import invalidate
+        invalidate(instance.id)
+
+@receiver(post_save, sender='fitness.PhysicalStandard')
+@receiver(post_delete, sender='fitness.PhysicalStandard')
+def invalidate_all_digests(sender, **kwargs):
+    """体测标准变化时，所有学生的摘要一起失效"""
+    from .digest import invalidate_all
+    invalidate_all()
+
+# 新闻中参与检索的字段，只修改其他字段（如浏览次数）时不更新检索索引
+INDEXED_NEWS_FIELDS = {'title', 'content', 'keywords', 'status'}
+
+@receiver(post_save, sender='fitness.SportsNews')
+def update_news_retrieval_index(sender, instance, update_fields=None, **kwargs):
+    """新闻保存后在事务提交时增量更新检索索引"""
+    if update_fields is not None and not INDEXED_NEWS_FIELDS & set(update_fields):
+        return
+    from .retrieval import index_news
+    transaction.on_commit(lambda: index_news(instance))
+
+@receiver(post_delete, sender='fitness.SportsNews')
+def remove_news_from_retrieval_index(sender, instance, **kwargs):
+    """新闻删除后从检索索引中移除"""
+    from .retrieval import remove_news
+    news_id = instance.id
+    transaction.on_commit(lambda: remove_news(news_id))
+
+@receiver(post_save, sender='fitness.PhysicalStandard')
+def update_standard_retrieval_index(sender, instance, **kwargs):
+    """体测标准保存后更新检索索引"""
+    from .retrieval import index_standard
+    transaction.on_commit(lambda: index_standard(instance))
+
+@receiver(post_delete, sender='fitness.PhysicalStandard')
+def remove_standard_from_retrieval_index(sender, instance, **kwargs):
+    """体测标准删除后从检索索引中移除"""
+    from .retrieval import remove_standard
+    standard_id = instance.id
+    transaction.on_commit(lambda: remove_standard(standard_id))
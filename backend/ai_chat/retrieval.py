@@ -0,0 +1,489 @@
+"""体育新闻和体测标准的本地检索
+
+把已发布的 SportsNews 正文和各性别的 PhysicalStandard 切分成段落，用 BM25 检索与用户提问相关的段落，
+附加到发送给模型的系统提示词中。中文没有分词器，按相邻两个汉字（二元组）切分，英文和数字按整词；
+词项用 CRC32 散列为 uint32。不依赖模型服务或 GPU，一次检索只需几毫秒。
+
+索引保存在 ``AI_RETRIEVAL_INDEX_DIR`` 下，``CURRENT`` 文件记录当前版本目录，目录中是可以直接
+内存映射的 NumPy 数组文件：
+
+- ``passages.bin``：每个段落的来源、对象ID、词数以及在倒排和文本文件中的结束位置
+- ``terms.bin`` / ``docs.bin`` / ``tfs.bin``：倒排记录（词项、段落序号、词频）
+- ``text.bin``：段落原文（UTF-8）
+- ``live.bin``：段落是否有效，它的长度就是已提交的段落数
+- ``meta.json``：建立索引时按词项排序的倒排记录数
+
+建立索引（``build_retrieval_index`` 命令）时倒排记录按词项排序，检索时二分查找。之后新闻保存时
+增量更新：旧段落在 ``live.bin`` 中原地标记为无效，新段落追加到文件末尾（追加部分未排序，检索时
+逐条比较）。最后写入 ``live.bin`` 作为提交，写入中断时未提交的数据在下次写入前截掉。追加的部分
+过多时在原地压缩为新的版本目录，各进程检索时发现版本或段落数变化后重新映射文件。
+"""
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+import zlib
+from collections import namedtuple
+from contextlib import contextmanager
+from pathlib import Path
+import numpy as np
+from django.conf import settings
+
+try:
+    import fcntl
+except ImportError:
+    # Windows 开发环境没有 fcntl，只在进程内加锁
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# BM25 参数
+K1 = 1.2
+B = 0.75
+# 相关度低于该值的段落不返回，避免把无关资料附加到提示词中
+MIN_SCORE = 3.0
+# 段落的最大字符数和相邻段落的重叠字符数
+PASSAGE_CHARS = 300
+PASSAGE_OVERLAP = 50
+# 追加的倒排记录超过已排序部分的比例（且超过最小条数）时压缩索引
+COMPACT_RATIO = 0.25
+COMPACT_MIN_POSTINGS = 50000
+
+# 段落来源
+KIND_NEWS = 1
+KIND_STANDARD = 2
+
+CURRENT = 'CURRENT'
+PASSAGE_DTYPE = np.dtype([
+    ('kind', 'u1'),
+    ('object_id', '<u8'),
+    ('length', '<u4'),
+    ('posting_end', '<u8'),
+    ('text_end', '<u8'),
+])
+POSTING_FILES = (('terms.bin', '<u4'), ('docs.bin', '<u4'), ('tfs.bin', '<u2'))
+
+# kind: 来源；object_id: 新闻或体测标准的主键；text: 段落原文；score: BM25 得分
+Passage = namedtuple('Passage', ['kind', 'object_id', 'text', 'score'])
+
+# 英文单词和数字，或者连续的汉字
+_TOKEN_RE = re.compile(r'[a-z0-9]+|[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+')
+# 切分段落时优先断开的位置
+_BREAKS = '。！？；\n'
+
+_write_lock = threading.Lock()
+
+
+def tokenize(text):
+    """把文本切分为词项：英文和数字按整词，汉字按相邻两个字，单独的汉字保留为一个词项"""
+    terms = []
+    for run in _TOKEN_RE.findall(text.lower()):
+        if run[0] < '\x80' or len(run) == 1:
+            terms.append(run)
+        else:
+            terms.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return terms
+
+
+def hash_terms(terms):
+    """把词项散列为 uint32 数组"""
+    return np.fromiter((zlib.crc32(term.encode('utf-8')) for term in terms), dtype=np.uint32, count=len(terms))
+
+
+def chunk_text(text, size=PASSAGE_CHARS, overlap=PASSAGE_OVERLAP):
+    """把文本切分为不超过 size 个字符的段落，尽量在句末断开，相邻段落重叠 overlap 个字符"""
+    text = text.strip()
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = min(start + size, len(text))
+        if end < len(text):
+            cut = max(text.rfind(mark, start + size // 2, end) for mark in _BREAKS)
+            if cut >= 0:
+                end = cut + 1
+        chunk = text[start:end].strip()
+        if chunk:
+            chunks.append(chunk)
+        if end >= len(text):
+            break
+        start = max(end - overlap, start + 1)
+    return chunks
+
+
+def news_passages(news):
+    """新闻的段落：正文分段，每段以标题开头；未发布的新闻没有段落"""
+    if news.status != 'published':
+        return []
+    body = news.content
+    if news.keywords:
+        body = f"{body}\n关键词：{news.keywords}"
+    return [f"《{news.title}》{chunk}" for chunk in chunk_text(body)]
+
+
+def standard_passages(standard):
+    """体测标准的段落：每个性别一段，列出 BMI 范围和各单项的及格、优秀标准"""
+    return [
+        f"{standard.get_gender_display()}生体测标准：BMI正常范围{standard.bmi_min:g}-{standard.bmi_max:g}；"
+        f"肺活量及格{standard.vital_capacity_pass}ml、优秀{standard.vital_capacity_excellent}ml；"
+        f"50米跑及格{standard.run_50m_pass:g}秒、优秀{standard.run_50m_excellent:g}秒；"
+        f"坐位体前屈及格{standard.sit_and_reach_pass}cm、优秀{standard.sit_and_reach_excellent}cm；"
+        f"立定跳远及格{standard.standing_jump_pass}cm、优秀{standard.standing_jump_excellent}cm；"
+        f"800米跑及格{standard.run_800m_pass}秒、优秀{standard.run_800m_excellent}秒。"
+        "总分60分及以上且各单项均达到及格标准为通过。"
+    ]
+
+
+def _map(path, dtype, count, mode='r'):
+    # 长度为 0 的文件不能内存映射
+    if count == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode=mode, shape=(count,))
+
+
+def _write_at(path, offset, data):
+    """从 offset 处写入数据，先截掉 offset 之后未提交的内容"""
+    with open(path, 'ab') as f:
+        f.truncate(offset)
+        f.write(data)
+
+
+def _encode(records, first_doc):
+    """把 (来源, 对象ID, 文本) 列表编码为倒排记录和段落记录
+
+    返回:
+        (terms, docs, tfs, lengths, text_lengths, 文本字节)，倒排记录按段落顺序排列
+    """
+    terms, docs, tfs, lengths, text_lengths, texts = [], [], [], [], [], []
+    for offset, (_, _, text) in enumerate(records):
+        hashed = hash_terms(tokenize(text))
+        unique, counts = np.unique(hashed, return_counts=True)
+        terms.append(unique)
+        tfs.append(np.minimum(counts, np.iinfo(np.uint16).max))
+        docs.append(np.full(len(unique), first_doc + offset, dtype=np.uint32))
+        lengths.append(len(hashed))
+        data = text.encode('utf-8')
+        text_lengths.append(len(data))
+        texts.append(data)
+    return (
+        np.concatenate(terms).astype(np.uint32) if terms else np.zeros(0, np.uint32),
+        np.concatenate(docs) if docs else np.zeros(0, np.uint32),
+        np.concatenate(tfs).astype(np.uint16) if tfs else np.zeros(0, np.uint16),
+        np.array(lengths, dtype=np.uint32),
+        np.array(text_lengths, dtype=np.uint64),
+        b''.join(texts),
+    )
+
+
+class _Snapshot:
+    """一个版本目录中已提交部分的内存映射"""
+
+    def __init__(self, directory, key, count, mode='r'):
+        self.directory = directory
+        self.key = key
+        self.count = count
+        self.passages = _map(directory / 'passages.bin', PASSAGE_DTYPE, count)
+        self.postings = int(self.passages['posting_end'][-1]) if count else 0
+        self.text_size = int(self.passages['text_end'][-1]) if count else 0
+        self.terms, self.docs, self.tfs = (
+            _map(directory / name, dtype, self.postings) for name, dtype in POSTING_FILES
+        )
+        self.text = _map(directory / 'text.bin', np.uint8, self.text_size)
+        self.live = _map(directory / 'live.bin', np.uint8, count, mode)
+        self.lengths = np.asarray(self.passages['length'], dtype=np.float32)
+        try:
+            meta = json.loads((directory / 'meta.json').read_text())
+            self.sorted_postings = min(meta['sorted_postings'], self.postings)
+        except FileNotFoundError:
+            self.sorted_postings = 0
+
+    def passage_text(self, index):
+        start = int(self.passages['text_end'][index - 1]) if index else 0
+        end = int(self.passages['text_end'][index])
+        return bytes(self.text[start:end]).decode('utf-8')
+
+
+class PassageIndex:
+    """内存映射的 BM25 段落索引，同一进程内的线程共享文件映射"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._snapshot = None
+        self._lock = threading.Lock()
+
+    def _generation(self):
+        try:
+            return (self.path / CURRENT).read_text().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def exists(self):
+        return self._generation() is not None
+
+    def _read_snapshot(self):
+        """返回当前版本的映射，版本或已提交的段落数变化时重新映射"""
+        generation = self._generation()
+        if generation is None:
+            return None
+        directory = self.path / generation
+        try:
+            count = os.stat(directory / 'live.bin').st_size
+        except FileNotFoundError:
+            return None
+        key = (generation, count)
+        snapshot = self._snapshot
+        if snapshot is None or snapshot.key != key:
+            with self._lock:
+                snapshot = self._snapshot
+                if snapshot is None or snapshot.key != key:
+                    snapshot = self._snapshot = _Snapshot(directory, key, count)
+        return snapshot
+
+    def search(self, query, k, min_score=MIN_SCORE):
+        """返回与 query 最相关的至多 k 个有效段落，按得分降序排列"""
+        snapshot = self._read_snapshot()
+        if snapshot is None or snapshot.count == 0 or k <= 0:
+            return []
+        query_terms = np.unique(hash_terms(tokenize(query)))
+        if not len(query_terms):
+            return []
+
+        # 已排序的部分二分查找，之后追加的部分逐条比较
+        terms = snapshot.terms
+        split = snapshot.sorted_postings
+        sorted_terms = terms[:split]
+        lo = np.searchsorted(sorted_terms, query_terms, 'left')
+        hi = np.searchsorted(sorted_terms, query_terms, 'right')
+        hits = [np.arange(start, stop) for start, stop in zip(lo, hi) if stop > start]
+        if snapshot.postings > split:
+            hits.append(split + np.flatnonzero(np.isin(terms[split:], query_terms)))
+        if not hits:
+            return []
+        hits = np.concatenate(hits)
+
+        live = np.asarray(snapshot.live) == 1
+        docs = snapshot.docs[hits].astype(np.intp)
+        alive = live[docs]
+        hits, docs = hits[alive], docs[alive]
+        if not len(hits):
+            return []
+
+        # 有效段落中每个查询词项的文档频率，段落内的词项不重复，直接按词项计数
+        slots = np.searchsorted(query_terms, terms[hits])
+        df = np.bincount(slots, minlength=len(query_terms))
+        total = int(live.sum())
+        average_length = float(snapshot.lengths[live].mean())
+        idf = np.log1p((total - df + 0.5) / (df + 0.5))
+        tf = snapshot.tfs[hits].astype(np.float32)
+        norm = K1 * (1 - B + B * snapshot.lengths[docs] / average_length)
+        weights = idf[slots] * tf * (K1 + 1) / (tf + norm)
+
+        # 按段落序号累加得分，段落数远少于倒排记录数，不必排序去重
+        scores = np.bincount(docs, weights=weights, minlength=snapshot.count)
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [
+            Passage(
+                int(snapshot.passages['kind'][i]),
+                int(snapshot.passages['object_id'][i]),
+                snapshot.passage_text(i),
+                float(scores[i]),
+            )
+            for i in top if scores[i] > 0 and scores[i] >= min_score
+        ]
+
+    @contextmanager
+    def _locked(self):
+        """写入锁：进程内的线程锁加上跨进程的文件锁"""
+        self.path.mkdir(parents=True, exist_ok=True)
+        with _write_lock, open(self.path / '.lock', 'ab') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def replace(self, kind, object_id, texts):
+        """用新的段落替换一个对象的全部段落（texts 为空时只删除）
+
+        段落内容没有变化时不写入（例如只修改了浏览次数）。索引尚未建立时不做任何事。
+
+        返回:
+            是否修改了索引
+        """
+        if not self.exists():
+            return False
+        texts = [text for text in texts if tokenize(text)]
+        with self._locked():
+            generation = self._generation()
+            if generation is None:
+                return False
+            directory = self.path / generation
+            count = os.path.getsize(directory / 'live.bin')
+            snapshot = _Snapshot(directory, None, count, mode='r+')
+            passages = snapshot.passages
+            existing = np.flatnonzero(
+                (passages['kind'] == kind) & (passages['object_id'] == object_id) & (np.asarray(snapshot.live) == 1)
+            )
+            if [snapshot.passage_text(i) for i in existing] == texts:
+                return False
+
+            # 先追加新段落再标记旧段落，检索时不会出现两者都不存在的间隙
+            postings = snapshot.postings
+            if texts:
+                postings += self._append(snapshot, [(kind, object_id, text) for text in texts])
+            if len(existing):
+                snapshot.live[existing] = 0
+                snapshot.live.flush()
+
+            unsorted = postings - snapshot.sorted_postings
+            if unsorted > max(COMPACT_MIN_POSTINGS, snapshot.sorted_postings * COMPACT_RATIO):
+                self._compact()
+            return True
+
+    def _append(self, snapshot, records):
+        """在已提交的数据之后追加段落，返回追加的倒排记录数"""
+        directory = snapshot.directory
+        terms, docs, tfs, lengths, text_lengths, text = _encode(records, snapshot.count)
+        rows = np.zeros(len(records), dtype=PASSAGE_DTYPE)
+        rows['kind'] = [kind for kind, _, _ in records]
+        rows['object_id'] = [object_id for _, object_id, _ in records]
+        rows['length'] = lengths
+        rows['posting_end'] = snapshot.postings + np.cumsum(np.bincount(docs - snapshot.count, minlength=len(records)))
+        rows['text_end'] = snapshot.text_size + np.cumsum(text_lengths)
+
+        # 截掉上次写入中断时留下的未提交数据后追加，最后写入 live.bin 提交
+        for (name, dtype), array in zip(POSTING_FILES, (terms, docs, tfs)):
+            _write_at(directory / name, snapshot.postings * np.dtype(dtype).itemsize, array.tobytes())
+        _write_at(directory / 'text.bin', snapshot.text_size, text)
+        _write_at(directory / 'passages.bin', snapshot.count * PASSAGE_DTYPE.itemsize, rows.tobytes())
+        _write_at(directory / 'live.bin', snapshot.count, np.ones(len(records), dtype=np.uint8).tobytes())
+        return len(terms)
+
+    def _write_generation(self, rows, terms, docs, tfs, text):
+        """写入新的版本目录并切换 CURRENT，删除旧版本（其他进程已映射的文件在 POSIX 上仍可读）"""
+        previous = self._generation()
+        generation = str(time.time_ns())
+        directory = self.path / generation
+        directory.mkdir()
+        order = np.lexsort((docs, terms))
+        for (name, dtype), array in zip(POSTING_FILES, (terms, docs, tfs)):
+            (directory / name).write_bytes(array[order].astype(dtype).tobytes())
+        (directory / 'text.bin').write_bytes(text)
+        (directory / 'passages.bin').write_bytes(rows.tobytes())
+        (directory / 'meta.json').write_text(json.dumps({'sorted_postings': len(terms)}))
+        (directory / 'live.bin').write_bytes(np.ones(len(rows), dtype=np.uint8).tobytes())
+
+        current = self.path / f'{CURRENT}.tmp'
+        current.write_text(generation)
+        os.replace(current, self.path / CURRENT)
+        if previous:
+            shutil.rmtree(self.path / previous, ignore_errors=True)
+
+    def _compact(self):
+        """去掉无效段落并把全部倒排记录重新排序，写入新的版本目录（调用方持有写入锁）"""
+        generation = self._generation()
+        directory = self.path / generation
+        snapshot = _Snapshot(directory, None, os.path.getsize(directory / 'live.bin'))
+        live = np.asarray(snapshot.live) == 1
+        keep = np.flatnonzero(live)
+        remap = np.full(snapshot.count, -1, dtype=np.int64)
+        remap[keep] = np.arange(len(keep))
+
+        postings = live[np.asarray(snapshot.docs, dtype=np.intp)]
+        docs = remap[snapshot.docs[postings]].astype(np.uint32)
+        text_ends = np.asarray(snapshot.passages['text_end'], dtype=np.int64)
+        text_starts = np.concatenate(([0], text_ends[:-1]))
+        text = b''.join(bytes(snapshot.text[text_starts[i]:text_ends[i]]) for i in keep)
+
+        rows = np.array(snapshot.passages[keep])
+        rows['posting_end'] = np.cumsum(np.bincount(docs, minlength=len(keep)))
+        rows['text_end'] = np.cumsum(text_ends[keep] - text_starts[keep])
+        self._write_generation(rows, np.asarray(snapshot.terms[postings]), docs,
+                               np.asarray(snapshot.tfs[postings]), text)
+        logger.info(f"检索索引已压缩: {len(keep)} 个段落")
+
+    def rebuild(self, records):
+        """用 (来源, 对象ID, 文本) 记录重新建立索引，返回段落数"""
+        records = [record for record in records if tokenize(record[2])]
+        terms, docs, tfs, lengths, text_lengths, text = _encode(records, 0)
+        rows = np.zeros(len(records), dtype=PASSAGE_DTYPE)
+        rows['kind'] = [kind for kind, _, _ in records]
+        rows['object_id'] = [object_id for _, object_id, _ in records]
+        rows['length'] = lengths
+        rows['posting_end'] = np.cumsum(np.bincount(docs, minlength=len(records)))
+        rows['text_end'] = np.cumsum(text_lengths)
+        with self._locked():
+            self._write_generation(rows, terms, docs, tfs, text)
+        return len(records)
+
+
+_indexes = {}
+
+
+def get_index():
+    """获取 AI_RETRIEVAL_INDEX_DIR 对应的索引"""
+    path = str(settings.AI_RETRIEVAL_INDEX_DIR)
+    index = _indexes.get(path)
+    if index is None:
+        index = _indexes.setdefault(path, PassageIndex(path))
+    return index
+
+
+def iter_records():
+    """从数据库读取需要建立索引的全部段落"""
+    from fitness.models import PhysicalStandard, SportsNews
+    news = SportsNews.objects.filter(status='published').only('id', 'title', 'content', 'keywords', 'status')
+    for item in news.order_by('id').iterator(chunk_size=500):
+        for text in news_passages(item):
+            yield KIND_NEWS, item.id, text
+    for standard in PhysicalStandard.objects.order_by('id'):
+        for text in standard_passages(standard):
+            yield KIND_STANDARD, standard.id, text
+
+
+def rebuild():
+    """从数据库重新建立索引，返回段落数"""
+    return get_index().rebuild(iter_records())
+
+
+def _update(kind, object_id, texts):
+    # 索引更新失败不影响新闻或标准的保存，重新建立索引即可恢复
+    try:
+        get_index().replace(kind, object_id, texts)
+    except Exception:
+        logger.exception(f"更新检索索引失败: kind={kind}, id={object_id}")
+
+
+def index_news(news):
+    """新闻保存后更新它的段落（未发布的新闻会被移出索引）"""
+    _update(KIND_NEWS, news.id, news_passages(news))
+
+
+def remove_news(news_id):
+    _update(KIND_NEWS, news_id, [])
+
+
+def index_standard(standard):
+    _update(KIND_STANDARD, standard.id, standard_passages(standard))
+
+
+def remove_standard(standard_id):
+    _update(KIND_STANDARD, standard_id, [])
+
+
+def search(query, k=None):
+    """检索与提问相关的段落，k 默认为 AI_RETRIEVAL_TOP_K；索引不存在或出错时返回空列表"""
+    k = settings.AI_RETRIEVAL_TOP_K if k is None else k
+    if k <= 0 or not query.strip():
+        return []
+    try:
+        return get_index().search(query, k)
+    except Exception:
+        logger.exception("检索参考资料失败")
+        return []
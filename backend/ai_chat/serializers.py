@@ -4,13 +4,23 @@ from .models import Conversation, Message
 class MessageSerializer(serializers.ModelSerializer):
     class Meta:
         model = Message
-        fields = ['id', 'role', 'content', 'timestamp']
-        read_only_fields = ['id', 'timestamp']
+        fields = ['id', 'role', 'content', 'timestamp', 'stream_status']
+        read_only_fields = ['id', 'timestamp', 'stream_status']
 
 class ConversationSerializer(serializers.ModelSerializer):
     messages = MessageSerializer(many=True, read_only=True)
     
     class Meta:
         model = Conversation
-        fields = ['id', 'user', 'title', 'created_at', 'updated_at', 'use_memory', 'memory_summary', 'messages']
-        read_only_fields = ['id', 'created_at', 'updated_at', 'user', 'memory_summary']
+        fields = ['id', 'user', 'title', 'created_at', 'updated_at', 'use_memory', 'memory_summary',
+                  'message_count', 'last_message_preview', 'last_message_role', 'last_message_at', 'messages']
+        read_only_fields = ['id', 'created_at', 'updated_at', 'user', 'memory_summary',
+                            'message_count', 'last_message_preview', 'last_message_role', 'last_message_at']
+
+class ConversationListSerializer(serializers.ModelSerializer):
+    """精简版的对话序列化器，用于会话列表，不加载消息"""
+    class Meta:
+        model = Conversation
+        fields = ['id', 'title', 'created_at', 'updated_at', 'use_memory',
+                  'message_count', 'last_message_preview', 'last_message_role', 'last_message_at']
+        read_only_fields = fields
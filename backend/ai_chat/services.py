@@ -1,7 +1,26 @@
 import requests
+import httpx
 import json
 import os
 from django.conf import settings
+from .decoder import SSE, NDJSON, decode_stream, adecode_stream, usage_from_payload
+from . import tokens
+
+# 异步流式请求的超时：连接10秒，等待下一块最多5分钟（本地模型生成较慢）
+STREAM_TIMEOUT = httpx.Timeout(10.0, read=300.0)
+
+_ssl_context = None
+
+
+def _async_client():
+    """创建异步流式请求使用的客户端
+
+    每次创建客户端都会重新加载CA证书（约50毫秒），因此在进程内复用同一个SSL上下文。
+    """
+    global _ssl_context
+    if _ssl_context is None:
+        _ssl_context = httpx.create_ssl_context()
+    return httpx.AsyncClient(timeout=STREAM_TIMEOUT, verify=_ssl_context)
 
 class AIModelService:
     """AI模型服务的基类"""
@@ -9,17 +28,37 @@ class AIModelService:
         """获取AI响应的抽象方法，子类必须实现"""
         raise NotImplementedError("子类必须实现此方法")
         
+    def response_content(self, response):
+        """从 get_response 的返回值中取出回复文本，子类必须实现"""
+        raise NotImplementedError("子类必须实现此方法")
+        
+    def response_usage(self, response):
+        """从 get_response 的返回值中取出用量（decoder.Usage），没有报告时返回 None，子类必须实现"""
+        raise NotImplementedError("子类必须实现此方法")
+        
     def get_streaming_response(self, messages, use_case=None):
-        """获取AI流式响应的抽象方法，子类必须实现"""
+        """获取AI流式响应的抽象方法，子类必须实现
+        
+        产出 decoder.StreamChunk，不同服务的响应格式统一为 (content, done)。
+        """
+        raise NotImplementedError("子类必须实现此方法")
+        
+    async def aget_streaming_response(self, messages, use_case=None):
+        """异步获取AI流式响应的抽象方法，子类必须实现，产出 decoder.StreamChunk
+        
+        关闭返回的异步生成器（或取消正在等待它的任务）会同时关闭与模型服务的连接，
+        模型服务随即停止生成。
+        """
         raise NotImplementedError("子类必须实现此方法")
+        yield
 
 class DeepSeekService(AIModelService):
     """与DeepSeek API通信的服务类"""
     def __init__(self):
         # 从环境变量获取API密钥
         self.api_key = os.environ.get('DEEPSEEK_API_KEY', '')
-        # DeepSeek API端点URL
-        self.base_url = "https://api.deepseek.com"
+        # DeepSeek API端点URL，可通过环境变量指向兼容的服务（例如本地的模拟服务）
+        self.base_url = os.environ.get('DEEPSEEK_BASE_URL', "https://api.deepseek.com")
         self.api_url = f"{self.base_url}/v1/chat/completions"
         # 默认使用的模型
         self.model = "deepseek-chat"  # 使用DeepSeek Chat模型
@@ -87,6 +126,14 @@ class DeepSeekService(AIModelService):
             print(f"DeepSeek API未知错误: {str(e)}")
             raise
         
+    def response_content(self, response):
+        """从非流式响应中取出回复文本（OpenAI 兼容格式）"""
+        return response.get('choices', [{}])[0].get('message', {}).get('content', '')
+        
+    def response_usage(self, response):
+        """从非流式响应中取出用量（OpenAI 兼容格式）"""
+        return usage_from_payload(SSE, response)
+        
     def get_streaming_response(self, messages, use_case="general"):
         """向DeepSeek API发送流式请求并获取流式响应
         
@@ -95,8 +142,29 @@ class DeepSeekService(AIModelService):
             use_case: 使用场景，可以是"coding", "data", "general", "translation", "creative"
             
         Returns:
-            generator: 生成每个响应块的生成器
+            generator: 生成每个响应块（StreamChunk）的生成器
         """
+        headers, data = self._streaming_request(messages, use_case)
+        
+        try:
+            print(f"向DeepSeek API发送流式请求: URL={self.api_url}, 模型={self.model}, 温度={self.temperature}")
+            response = requests.post(self.api_url, headers=headers, json=data, stream=True)
+            
+            # 检查HTTP错误
+            response.raise_for_status()
+            
+            # 按收到的原始字节块增量解码SSE事件
+            yield from decode_stream(SSE, response.iter_content(chunk_size=None))
+        
+        except requests.exceptions.RequestException as e:
+            print(f"DeepSeek API流式请求异常: {str(e)}")
+            raise ValueError(f"DeepSeek API流式请求失败: {str(e)}")
+        except Exception as e:
+            print(f"DeepSeek API流式请求未知错误: {str(e)}")
+            raise
+    
+    def _streaming_request(self, messages, use_case):
+        """构造流式请求的请求头和请求体"""
         if not self.api_key:
             raise ValueError("DeepSeek API密钥未设置")
             
@@ -112,39 +180,36 @@ class DeepSeekService(AIModelService):
             "model": self.model,
             "messages": messages,
             "temperature": self.temperature,
-            "stream": True  # 启用流式传输
+            "stream": True,  # 启用流式传输
+            # 在 [DONE] 之前返回本次请求的用量
+            "stream_options": {"include_usage": True}
         }
+        return headers, data
+    
+    async def aget_streaming_response(self, messages, use_case="general"):
+        """以非阻塞方式向DeepSeek API发送流式请求，逐块产出响应
         
-        try:
-            print(f"向DeepSeek API发送流式请求: URL={self.api_url}, 模型={self.model}, 温度={self.temperature}")
-            response = requests.post(self.api_url, headers=headers, json=data, stream=True)
-            
-            # 检查HTTP错误
-            response.raise_for_status()
+        Args:
+            messages: 消息历史记录
+            use_case: 使用场景，可以是"coding", "data", "general", "translation", "creative"
             
-            # 对每个响应行进行处理
-            for line in response.iter_lines():
-                if line:
-                    # 移除data: 前缀并解析JSON
-                    line_text = line.decode('utf-8')
-                    if line_text.startswith('data: '):
-                        line_text = line_text[6:]  # 移除'data: '前缀
-                        
-                    if line_text == '[DONE]':
-                        break
-                        
-                    try:
-                        chunk = json.loads(line_text)
+        Returns:
+            async generator: 产出每个响应块（StreamChunk）的异步生成器
+        """
+        headers, data = self._streaming_request(messages, use_case)
+        
+        try:
+            print(f"向DeepSeek API发送异步流式请求: URL={self.api_url}, 模型={self.model}, 温度={self.temperature}")
+            async with _async_client() as client:
+                async with client.stream("POST", self.api_url, headers=headers, json=data) as response:
+                    response.raise_for_status()
+                    
+                    async for chunk in adecode_stream(SSE, response.aiter_bytes()):
                         yield chunk
-                    except json.JSONDecodeError as e:
-                        print(f"JSON解析错误: {e}, 原始行: {line_text}")
         
-        except requests.exceptions.RequestException as e:
-            print(f"DeepSeek API流式请求异常: {str(e)}")
+        except httpx.HTTPError as e:
+            print(f"DeepSeek API异步流式请求异常: {str(e)}")
             raise ValueError(f"DeepSeek API流式请求失败: {str(e)}")
-        except Exception as e:
-            print(f"DeepSeek API流式请求未知错误: {str(e)}")
-            raise
 
 
 class OllamaService(AIModelService):
@@ -200,6 +265,14 @@ class OllamaService(AIModelService):
             print(f"Ollama未知错误: {str(e)}")
             raise
             
+    def response_content(self, response):
+        """从非流式响应中取出回复文本（Ollama 格式）"""
+        return response.get('message', {}).get('content', '')
+        
+    def response_usage(self, response):
+        """从非流式响应中取出用量（Ollama 格式）"""
+        return usage_from_payload(NDJSON, response)
+            
     def get_streaming_response(self, messages, use_case=None):
         """向Ollama发送流式请求并获取流式响应
         
@@ -208,7 +281,7 @@ class OllamaService(AIModelService):
             use_case: 使用场景，在Ollama中不使用，保持API一致性
             
         Returns:
-            generator: 生成每个响应块的生成器
+            generator: 生成每个响应块（StreamChunk）的生成器
         """
         # 配置请求参数为流式模式
         data = {
@@ -224,14 +297,8 @@ class OllamaService(AIModelService):
             # 检查HTTP错误
             response.raise_for_status()
             
-            # 对每个响应行进行处理
-            for line in response.iter_lines():
-                if line:
-                    try:
-                        chunk = json.loads(line.decode('utf-8'))
-                        yield chunk
-                    except json.JSONDecodeError as e:
-                        print(f"JSON解析错误: {e}, 原始行: {line.decode('utf-8')}")
+            # 按收到的原始字节块增量解码NDJSON
+            yield from decode_stream(NDJSON, response.iter_content(chunk_size=None))
                         
         except requests.exceptions.RequestException as e:
             print(f"Ollama API流式请求异常: {str(e)}")
@@ -251,6 +318,35 @@ class OllamaService(AIModelService):
         response = requests.post(self.api_url, json=data)
         response.raise_for_status()  # 对HTTP错误抛出异常
         return response.json()
+    
+    async def aget_streaming_response(self, messages, use_case=None):
+        """以非阻塞方式向Ollama发送流式请求，逐块产出响应
+        
+        Args:
+            messages: 消息历史记录
+            use_case: 使用场景，在Ollama中不使用，保持API一致性
+            
+        Returns:
+            async generator: 产出每个响应块（StreamChunk）的异步生成器
+        """
+        data = {
+            "model": self.model,
+            "messages": messages,
+            "stream": True  # 启用流式处理
+        }
+        
+        try:
+            print(f"向Ollama发送异步流式请求: URL={self.api_url}, 模型={self.model}")
+            async with _async_client() as client:
+                async with client.stream("POST", self.api_url, json=data) as response:
+                    response.raise_for_status()
+                    
+                    async for chunk in adecode_stream(NDJSON, response.aiter_bytes()):
+                        yield chunk
+                            
+        except httpx.HTTPError as e:
+            print(f"Ollama API异步流式请求异常: {str(e)}")
+            raise ValueError(f"Ollama API流式请求失败: {str(e)}")
 
 def get_ai_service(service_type="deepseek", use_case="general"):
     """工厂函数，获取适当的AI服务
@@ -286,6 +382,8 @@ class MemoryService:
         self.ai_service = DeepSeekService()
         # 记忆生成阈值，当消息数达到该值时生成记忆
         self.memory_threshold = 10
+        # 记忆生成请求的提示词 token 预算，已有的记忆摘要最多占四分之一
+        self.token_budget = settings.AI_CONTEXT_TOKEN_BUDGET
     
     def should_generate_memory(self, message_count):
         """判断是否应该生成记忆摘要
@@ -315,20 +413,24 @@ class MemoryService:
             "content": self._get_memory_system_prompt(previous_memory)
         }
         
-        # 收集用户和AI的消息，限制数量以避免上下文过长
-        conversation_messages = messages[-self.memory_threshold:]
+        # 用户指令，要求AI生成摘要
+        instruction = {
+            "role": "user",
+            "content": "请根据以上对话内容，生成一个简洁的记忆摘要，捕捉用户的关键信息、偏好和重要上下文。摘要应该以第三人称陈述形式呈现，突出重点。"
+        }
+        
+        # 收集用户和AI的消息，限制数量，并按剩余的 token 预算从最新的消息向前保留
+        conversation_messages, _ = tokens.trim_history(
+            list(messages[-self.memory_threshold:]),
+            self.token_budget - tokens.prompt_tokens([system_message, instruction])
+        )
         
         # 格式化消息
         formatted_messages = [{"role": msg.role, "content": msg.content} for msg in conversation_messages]
         
-        # 在消息列表开头添加系统提示词
+        # 在消息列表开头添加系统提示词，末尾添加用户指令
         formatted_messages.insert(0, system_message)
-        
-        # 添加用户指令，要求AI生成摘要
-        formatted_messages.append({
-            "role": "user",
-            "content": "请根据以上对话内容，生成一个简洁的记忆摘要，捕捉用户的关键信息、偏好和重要上下文。摘要应该以第三人称陈述形式呈现，突出重点。"
-        })
+        formatted_messages.append(instruction)
         
         try:
             # 获取AI生成的记忆摘要
@@ -359,6 +461,7 @@ class MemoryService:
         base_prompt = "你是一个专门负责总结对话的助手。你的任务是识别对话中的关键信息，并创建一个简洁的记忆摘要，以便在将来的对话中参考。"
         
         if previous_memory:
+            previous_memory = tokens.truncate_to_tokens(previous_memory, self.token_budget // 4)
             base_prompt += f"\n\n以下是之前的记忆摘要，请在生成新摘要时考虑这些信息：\n{previous_memory}"
         
         base_prompt += "\n\n重点关注用户的：\n1. 健身和运动目标\n2. 体测数据和身体状况\n3. 饮食偏好和限制\n4. 健身习惯和频率\n5. 任何健康问题或伤病历史"
@@ -381,11 +484,14 @@ class MemoryService:
             "content": "你是一个专门负责整合信息的助手。你的任务是将两段记忆摘要合并成一个连贯的、无冗余的新摘要。保留所有重要信息，消除重复内容，并确保结果逻辑连贯。"
         }
         
+        # 两段摘要各占不超过三分之一的预算
         formatted_messages = [
             system_message,
             {
                 "role": "user",
-                "content": f"请将以下两段记忆摘要合并成一个连贯的摘要，避免重复内容：\n\n旧摘要：\n{old_memory}\n\n新摘要：\n{new_memory}"
+                "content": f"请将以下两段记忆摘要合并成一个连贯的摘要，避免重复内容：\n\n"
+                           f"旧摘要：\n{tokens.truncate_to_tokens(old_memory, self.token_budget // 3)}\n\n"
+                           f"新摘要：\n{tokens.truncate_to_tokens(new_memory, self.token_budget // 3)}"
             }
         ]
         
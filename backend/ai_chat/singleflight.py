@@ -0,0 +1,196 @@
+"""相同提问的并发合并（single-flight）
+
+老师让全班同时向助手提出同一个问题时，短时间内会有大量上下文完全相同的请求。以实际使用的服务、
+模型、使用场景和规范化后的消息列表为键，同一时刻相同的请求只向模型服务发起一次：
+
+- 流式请求（``stream``）：模型服务返回的每一块分发给所有订阅方（SSE 回复的生成任务、
+  WebSocket 消费者），晚加入的订阅方先补发已生成的块；
+- 非流式请求（``call``）：等待中的线程共享同一个结果或异常。
+
+每个对话仍由各自的调用方保存自己的 Message。合并的请求只向模型服务调用一次，用量也只计一次：
+流式请求中模型服务报告的用量只交给第一个读到最后一块的订阅方，其他订阅方收到的该块不带用量；
+非流式请求由 ``call`` 的 fn 实际执行的调用方计入用量。只合并进行中的请求，请求结束后不缓存结果；
+上下文不同（例如对话历史或记忆摘要不同）的请求不会合并。
+
+学生和家长的系统提示词附带各自的体测档案摘要，带摘要的请求各不相同，无法合并。调用方用去掉
+摘要的共享部分计算键并调用 ``is_burst``：同一共享键在 ``BURST_WINDOW`` 秒内再次出现（集中提问）时，
+改为发送共享部分并按共享键合并。代价是集中提问期间除第一个请求外，回答不再结合个人的体测情况；
+不能只用共享部分计算键却发送带摘要的请求，否则其他学生会收到基于第一个学生档案的回答。
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import threading
+import time
+from contextlib import aclosing
+
+logger = logging.getLogger(__name__)
+
+# 键 -> 进行中的流式请求 / 非流式请求
+_flights = {}
+_calls = {}
+_lock = threading.Lock()
+
+# 同一共享键在此秒数内再次出现时视为集中提问
+BURST_WINDOW = 10
+
+# 共享键 -> 最近一次出现的时间；超过 _RECENT_LIMIT 个时清除窗口外的键
+_recent = {}
+_RECENT_LIMIT = 10000
+
+
+def flight_key(ai_service, messages, use_case=None):
+    """计算请求的合并键
+
+    消息内容去掉首尾空白并合并连续空白，只有空白差异的提问视为相同。
+    """
+    normalized = [(message['role'], ' '.join(message['content'].split())) for message in messages]
+    payload = json.dumps(
+        [type(ai_service).__name__, getattr(ai_service, 'api_url', None), getattr(ai_service, 'model', None),
+         use_case, normalized],
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def is_burst(key, window=BURST_WINDOW):
+    """记录共享键本次出现的时间，窗口内出现过或有进行中的相同请求时返回 True"""
+    now = time.monotonic()
+    with _lock:
+        last = _recent.get(key)
+        _recent[key] = now
+        if len(_recent) > _RECENT_LIMIT:
+            for stale in [k for k, seen in _recent.items() if now - seen > window]:
+                del _recent[stale]
+        return key in _flights or key in _calls or (last is not None and now - last <= window)
+
+
+class Flight:
+    """一次进行中的流式请求，保存已收到的块供订阅方读取"""
+
+    def __init__(self, key):
+        self.key = key
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.subscribers = 0
+        self.usage_claimed = False
+        self.task = None
+        self._waiters = []
+
+    async def run(self, producer):
+        try:
+            async with aclosing(producer) as chunks:
+                async for chunk in chunks:
+                    self.chunks.append(chunk)
+                    self._wake()
+        except asyncio.CancelledError:
+            self.error = asyncio.CancelledError()
+            raise
+        except Exception as e:
+            self.error = e
+        finally:
+            with _lock:
+                if _flights.get(self.key) is self:
+                    del _flights[self.key]
+            self.done = True
+            self._wake()
+
+    async def wait(self, position):
+        """等待第 position 块或请求结束"""
+        if self.done or len(self.chunks) > position:
+            return
+        event = asyncio.Event()
+        # 订阅方可能不在请求所在的事件循环中，通过 call_soon_threadsafe 唤醒
+        self._waiters.append((asyncio.get_running_loop(), event))
+        await event.wait()
+
+    def _wake(self):
+        waiters, self._waiters = self._waiters, []
+        for loop, event in waiters:
+            loop.call_soon_threadsafe(event.set)
+
+
+async def stream(key, producer_factory):
+    """订阅键为 key 的流式请求，逐块产出 StreamChunk
+
+    没有进行中的相同请求时调用 producer_factory() 创建模型服务的异步生成器并在后台任务中读取。
+    请求失败时每个订阅方都会收到同一个异常。所有订阅方都关闭（或被取消）后中止请求。
+    模型服务报告的用量只有第一个读到它的订阅方收到，避免同一次调用按订阅方数量重复计入用量。
+    """
+    with _lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = Flight(key)
+        flight.subscribers += 1
+        subscribers = flight.subscribers
+    if leader:
+        flight.task = asyncio.get_running_loop().create_task(flight.run(producer_factory()))
+    else:
+        logger.info(f"合并相同的AI请求: 当前 {subscribers} 个订阅方")
+
+    try:
+        position = 0
+        while True:
+            while position < len(flight.chunks):
+                chunk = flight.chunks[position]
+                if chunk.usage is not None:
+                    with _lock:
+                        claimed, flight.usage_claimed = flight.usage_claimed, True
+                    if claimed:
+                        chunk = chunk._replace(usage=None)
+                yield chunk
+                position += 1
+            if flight.done:
+                if flight.error is not None:
+                    raise flight.error
+                return
+            await flight.wait(position)
+    finally:
+        with _lock:
+            flight.subscribers -= 1
+            abandoned = flight.subscribers == 0 and not flight.done
+            # 不再接受新的订阅方，之后相同的提问会发起新的请求
+            if abandoned and _flights.get(key) is flight:
+                del _flights[key]
+        if abandoned:
+            flight.task.get_loop().call_soon_threadsafe(flight.task.cancel)
+
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+def call(key, fn):
+    """非流式请求的合并：同一个键同时只执行一次 fn()，等待中的调用共享其结果或异常
+
+    结果中的用量只应计入执行 fn() 的调用方，调用方可以在 fn 中记下自己是否实际发起了请求。
+    """
+    with _lock:
+        pending = _calls.get(key)
+        leader = pending is None
+        if leader:
+            pending = _calls[key] = _Call()
+
+    if not leader:
+        logger.info("合并相同的AI请求，等待进行中的请求返回")
+        pending.event.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    try:
+        pending.result = fn()
+        return pending.result
+    except Exception as e:
+        pending.error = e
+        raise
+    finally:
+        with _lock:
+            del _calls[key]
+        pending.event.set()
@@ -0,0 +1,206 @@
+"""AI 流式回复的事件缓冲与断线续传
+
+``send_message_stream`` 的生成过程在独立的任务中进行，生成的事件按顺序编号（SSE 的 ``id:``），
+写入该条回复消息的环形缓冲区；响应只负责从缓冲区读取事件发送给客户端。客户端断线后携带
+``Last-Event-ID`` 重新连接（``resume_stream`` 接口），从缓冲区补发错过的事件，不会再次调用模型服务。
+
+生成过程中每隔 CHECKPOINT_EVENTS 个事件或 CHECKPOINT_SECONDS 秒把已生成的内容写入数据库
+（``Message.content`` 和 ``Message.stream_event_id``）。缓冲区不在当前进程时（多进程部署或进程重启），
+从数据库检查点续传。
+
+所有客户端都断开后，生成任务再保留 RESUME_GRACE_SECONDS 秒等待重连，期间没有客户端重新连接
+则中止模型服务的请求，不再继续生成。
+"""
+import asyncio
+import collections
+import json
+import time
+from .models import Message
+
+# 每条回复在内存中保留的最近事件数
+RING_SIZE = 256
+# 数据库检查点的间隔
+CHECKPOINT_EVENTS = 32
+CHECKPOINT_SECONDS = 2.0
+# 所有客户端断开后等待重连的时间
+RESUME_GRACE_SECONDS = 30.0
+# 生成结束后缓冲区在内存中的保留时间，供断线的客户端取回结尾
+RETAIN_SECONDS = 120.0
+# 从数据库检查点续传时的轮询间隔，以及检查点多久没有进展视为生成已中断
+POLL_SECONDS = CHECKPOINT_SECONDS
+STALE_SECONDS = RESUME_GRACE_SECONDS + 10 * CHECKPOINT_SECONDS
+
+# 消息ID -> StreamBuffer，只包含当前进程中生成的回复
+_buffers = {}
+
+
+def format_event(event_id, payload):
+    """按 SSE 格式编码一个事件"""
+    return f"id: {event_id}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+class StreamBuffer:
+    """一条回复的事件缓冲区
+
+    ``publish`` 由生成任务调用，``follow`` 由响应调用；同一条回复可以同时有多个读取方。
+    """
+
+    def __init__(self, message_id):
+        self.message_id = message_id
+        # (事件ID, SSE 帧, 事件之前已生成文本的长度)
+        self.events = collections.deque(maxlen=RING_SIZE)
+        self.last_event_id = 0
+        self.text = ''
+        self.done = False
+        # 回复开始生成和收到第一块文本的时间，用于记录耗时
+        self.started_at = time.monotonic()
+        self.first_chunk_at = None
+        self.finished_at = None
+        self.subscribers = 0
+        self.task = None
+        self._producer = None
+        self._waiters = []
+        self._abort_handle = None
+        self._checkpoint_id = 0
+        self._checkpoint_at = time.monotonic()
+
+    def start(self, producer):
+        """登记生成协程，在第一个读取方开始读取时于其事件循环中启动"""
+        self._producer = producer
+
+    def _ensure_started(self):
+        if self.task is None and self._producer is not None:
+            self.task = asyncio.get_running_loop().create_task(self._producer)
+            self._producer = None
+
+    def publish(self, payload):
+        """追加一个事件并唤醒等待的读取方，返回事件ID"""
+        self.last_event_id += 1
+        self.events.append((self.last_event_id, format_event(self.last_event_id, payload), len(self.text)))
+        if 'chunk' in payload:
+            if self.first_chunk_at is None:
+                self.first_chunk_at = time.monotonic()
+            self.text += payload['chunk']
+        self._wake()
+        return self.last_event_id
+
+    def finish(self):
+        self.done = True
+        self.finished_at = time.monotonic()
+        self._wake()
+
+    def checkpoint_due(self):
+        """距上次检查点已有足够多的事件或足够长的时间时返回 True，并记为已检查点"""
+        now = time.monotonic()
+        if self.last_event_id - self._checkpoint_id < CHECKPOINT_EVENTS and now - self._checkpoint_at < CHECKPOINT_SECONDS:
+            return False
+        self._checkpoint_id = self.last_event_id
+        self._checkpoint_at = now
+        return True
+
+    def frames_after(self, event_id):
+        """返回 event_id 之后的 SSE 帧和读到的位置
+
+        需要的事件已被环形缓冲区丢弃时，先发送一个 reset 事件携带此前已生成的全部内容，
+        客户端用它替换已收到的内容，再接着补发缓冲区中的事件。
+        """
+        if event_id >= self.last_event_id:
+            return [], event_id
+        first_id, _, text_start = self.events[0]
+        if first_id > event_id + 1:
+            reset = format_event(first_id - 1, {
+                'reset': True, 'content': self.text[:text_start], 'message_id': self.message_id,
+            })
+            frames = [reset] + [frame for _, frame, _ in self.events]
+        else:
+            frames = [frame for eid, frame, _ in self.events if eid > event_id]
+        return frames, self.last_event_id
+
+    async def wait(self, event_id):
+        """等待 event_id 之后的新事件或生成结束"""
+        if self.done or self.last_event_id > event_id:
+            return
+        event = asyncio.Event()
+        # 生成任务和读取方可能不在同一个事件循环中（例如同步测试客户端），通过 call_soon_threadsafe 唤醒
+        self._waiters.append((asyncio.get_running_loop(), event))
+        await event.wait()
+
+    def _wake(self):
+        waiters, self._waiters = self._waiters, []
+        for loop, event in waiters:
+            loop.call_soon_threadsafe(event.set)
+
+    def attach(self):
+        self.subscribers += 1
+        if self._abort_handle is not None:
+            self._abort_handle.cancel()
+            self._abort_handle = None
+        self._ensure_started()
+
+    def detach(self):
+        self.subscribers -= 1
+        if self.subscribers == 0 and not self.done and self.task is not None:
+            self._abort_handle = self.task.get_loop().call_later(RESUME_GRACE_SECONDS, self._abort_if_abandoned)
+
+    def _abort_if_abandoned(self):
+        self._abort_handle = None
+        if self.subscribers == 0 and not self.done:
+            self.task.cancel()
+
+
+def open_stream(message_id):
+    """为一条新的回复创建缓冲区"""
+    now = time.monotonic()
+    for key in [key for key, buffer in _buffers.items()
+                if buffer.done and now - buffer.finished_at > RETAIN_SECONDS]:
+        del _buffers[key]
+    buffer = _buffers[message_id] = StreamBuffer(message_id)
+    return buffer
+
+
+def get_stream(message_id):
+    """返回当前进程中该回复的缓冲区，不存在时返回 None"""
+    return _buffers.get(message_id)
+
+
+async def follow(buffer, last_event_id=0):
+    """从缓冲区读取 last_event_id 之后的事件，直到生成结束"""
+    buffer.attach()
+    try:
+        position = last_event_id
+        while True:
+            frames, position = buffer.frames_after(position)
+            for frame in frames:
+                yield frame
+            if buffer.done and position >= buffer.last_event_id:
+                return
+            await buffer.wait(position)
+    finally:
+        buffer.detach()
+
+
+async def follow_checkpoints(message_id, last_event_id=0):
+    """缓冲区不在当前进程时，轮询数据库检查点续传
+
+    每次检查点有进展就发送一个 reset 事件携带已生成的全部内容；生成结束后发送结束事件。
+    检查点长时间没有进展（生成它的进程已退出）时发送错误事件并结束。
+    """
+    position = last_event_id
+    progressed_at = time.monotonic()
+    while True:
+        message = await Message.objects.only('content', 'stream_status', 'stream_event_id').aget(id=message_id)
+        if message.stream_event_id > position:
+            position = message.stream_event_id
+            progressed_at = time.monotonic()
+            yield format_event(position, {'reset': True, 'content': message.content, 'message_id': message_id})
+
+        if message.stream_status == Message.STREAM_COMPLETE:
+            yield format_event(position + 1, {'status': 'complete', 'message_id': message_id})
+            return
+        if message.stream_status != Message.STREAM_STREAMING:
+            yield format_event(position + 1, {'error': '回复生成已中断', 'message_id': message_id})
+            return
+        if time.monotonic() - progressed_at > STALE_SECONDS:
+            yield format_event(position + 1, {'error': '回复生成已中断', 'message_id': message_id})
+            return
+        await asyncio.sleep(POLL_SECONDS)
@@ -0,0 +1,144 @@
+"""本地模拟大模型服务
+
+同时实现 DeepSeek（OpenAI 兼容，``/v1/chat/completions``，SSE 流式）和
+Ollama（``/api/chat``，NDJSON 流式）两种接口，用于基准测试和本地调试，不需要真实的模型和密钥。
+回复内容固定，可配置分块数量和每块之间的延迟。响应中的用量按每个字符一个 token 计算。
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_REPLY = '坚持每天进行30分钟有氧运动，并配合拉伸和力量练习，可以有效提高体测成绩。'
+
+
+class StubLLMServer:
+    """在后台线程中运行的模拟大模型服务
+
+    参数:
+        reply: 回复内容
+        chunks: 流式响应拆分的块数
+        chunk_delay: 每块之间的延迟（秒），模拟生成速度
+        first_token_delay: 第一块之前的延迟（秒）
+    """
+
+    def __init__(self, reply=DEFAULT_REPLY, chunks=20, chunk_delay=0.0, first_token_delay=0.0,
+                 host='127.0.0.1', port=0):
+        self.reply = reply
+        self.chunks = max(1, chunks)
+        self.chunk_delay = chunk_delay
+        self.first_token_delay = first_token_delay
+        self.requests = 0
+        # 客户端在流式响应结束前断开的次数
+        self.aborted = 0
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def pieces(self):
+        size = max(1, -(-len(self.reply) // self.chunks))
+        return [self.reply[i:i + size] for i in range(0, len(self.reply), size)]
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = json.loads(self.rfile.read(length) or b'{}')
+                stub.requests += 1
+                ollama = self.path.startswith('/api/chat')
+                prompt_tokens = sum(len(message.get('content') or '') for message in body.get('messages', []))
+                if not body.get('stream'):
+                    self._complete(ollama, prompt_tokens)
+                    return
+                include_usage = ollama or (body.get('stream_options') or {}).get('include_usage')
+                try:
+                    self._stream(ollama, prompt_tokens if include_usage else None)
+                except ConnectionError:
+                    stub.aborted += 1
+                    self.close_connection = True
+
+            def _send_headers(self, content_type, length=None):
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                if length is None:
+                    self.send_header('Transfer-Encoding', 'chunked')
+                else:
+                    self.send_header('Content-Length', str(length))
+                self.end_headers()
+
+            def _write_chunk(self, data):
+                self.wfile.write(f'{len(data):x}\r\n'.encode() + data + b'\r\n')
+                self.wfile.flush()
+
+            def _usage(self, ollama, prompt_tokens):
+                if ollama:
+                    return {'prompt_eval_count': prompt_tokens, 'eval_count': len(stub.reply)}
+                return {'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': len(stub.reply),
+                                  'total_tokens': prompt_tokens + len(stub.reply),
+                                  'prompt_cache_hit_tokens': 0, 'prompt_cache_miss_tokens': prompt_tokens}}
+
+            def _complete(self, ollama, prompt_tokens):
+                time.sleep(stub.first_token_delay + stub.chunk_delay * stub.chunks)
+                if ollama:
+                    payload = {'message': {'role': 'assistant', 'content': stub.reply}, 'done': True}
+                else:
+                    payload = {'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': stub.reply},
+                                            'finish_reason': 'stop'}]}
+                payload.update(self._usage(ollama, prompt_tokens))
+                data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+                self._send_headers('application/json', len(data))
+                self.wfile.write(data)
+
+            def _stream(self, ollama, prompt_tokens=None):
+                self._send_headers('application/x-ndjson' if ollama else 'text/event-stream')
+                time.sleep(stub.first_token_delay)
+                for piece in stub.pieces():
+                    if ollama:
+                        line = json.dumps({'message': {'role': 'assistant', 'content': piece}, 'done': False},
+                                          ensure_ascii=False) + '\n'
+                    else:
+                        line = 'data: ' + json.dumps({'choices': [{'index': 0, 'delta': {'content': piece}}]},
+                                                     ensure_ascii=False) + '\n\n'
+                    self._write_chunk(line.encode('utf-8'))
+                    if stub.chunk_delay:
+                        time.sleep(stub.chunk_delay)
+                if ollama:
+                    payload = {'message': {'role': 'assistant', 'content': ''}, 'done': True}
+                    payload.update(self._usage(ollama, prompt_tokens or 0))
+                    self._write_chunk(json.dumps(payload).encode('utf-8') + b'\n')
+                else:
+                    if prompt_tokens is not None:
+                        payload = {'choices': [], **self._usage(ollama, prompt_tokens)}
+                        self._write_chunk(f'data: {json.dumps(payload)}\n\n'.encode('utf-8'))
+                    self._write_chunk(b'data: [DONE]\n\n')
+                self.wfile.write(b'0\r\n\r\n')
+                self.wfile.flush()
+
+        return Handler
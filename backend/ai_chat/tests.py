@@ -1,3 +1,563 @@
-from django.test import TestCase
+import asyncio
+import json
+import re
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import aclosing
+from unittest import mock
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase, override_settings
+from rest_framework.test import APIClient
+from fitness.models import PhysicalStandard, SportsNews, User
+from fitness.principal import token_for_user
+from . import retrieval, singleflight, streams, tokens, usage
+from .decoder import NDJSON, SSE, StreamChunk, StreamDecoder, Usage, decode_stream
+from .models import Conversation, Message, TokenUsage
+from .retrieval import KIND_NEWS, KIND_STANDARD, PassageIndex
+from .views import ConversationViewSet, choose_flight
 
-# Create your tests here.
+
+def temporary_directory(test):
+    directory = tempfile.mkdtemp(prefix='ai-chat-test-')
+    test.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+    return directory
+
+
+class AIChatTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        # 检索索引写入临时目录，不影响开发环境的索引
+        index_dir = override_settings(AI_RETRIEVAL_INDEX_DIR=f'{temporary_directory(self)}/index')
+        index_dir.enable()
+        self.addCleanup(index_dir.disable)
+        self.user = User.objects.create_user('s1', password='x', user_type='student')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+
+class ConversationUpdateTests(AIChatTestCase):
+    def test_patch_does_not_overwrite_concurrent_message_stats(self):
+        conversation = Conversation.objects.create(user=self.user)
+        get_object = ConversationViewSet.get_object
+
+        def stale_get_object(view):
+            # 读取对话之后、保存之前，另一个请求写入了一条消息
+            instance = get_object(view)
+            Message.objects.create(conversation=instance, role='user', content='你好')
+            return instance
+
+        with mock.patch.object(ConversationViewSet, 'get_object', stale_get_object):
+            response = self.client.patch(f'/api/ai/conversations/{conversation.id}/',
+                                         {'title': '跑步训练', 'use_memory': False}, format='json')
+        self.assertEqual(response.status_code, 200)
+
+        conversation.refresh_from_db()
+        self.assertEqual(conversation.title, '跑步训练')
+        self.assertFalse(conversation.use_memory)
+        self.assertEqual(conversation.message_count, 1)
+        self.assertEqual(conversation.last_message_preview, '你好')
+
+
+class MessageHistoryTests(AIChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.conversation = Conversation.objects.create(user=self.user)
+        self.messages = [
+            Message.objects.create(conversation=self.conversation, role='user' if i % 2 == 0 else 'assistant',
+                                   content=f'消息{i}')
+            for i in range(7)
+        ]
+        self.url = f'/api/ai/conversations/{self.conversation.id}/messages/'
+
+    def test_pages_backwards_from_newest_message(self):
+        pages = []
+        params = {'limit': 3}
+        while True:
+            response = self.client.get(self.url, params)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data['count'], 7)
+            pages.append([message['content'] for message in response.data['results']])
+            if response.data['next_before'] is None:
+                break
+            params['before'] = response.data['next_before']
+        self.assertEqual(pages, [['消息4', '消息5', '消息6'], ['消息1', '消息2', '消息3'], ['消息0']])
+
+    def test_messages_written_after_first_page_are_not_repeated(self):
+        response = self.client.get(self.url, {'limit': 4})
+        Message.objects.create(conversation=self.conversation, role='user', content='新消息')
+        response = self.client.get(self.url, {'limit': 4, 'before': response.data['next_before']})
+        self.assertEqual([message['content'] for message in response.data['results']], ['消息0', '消息1', '消息2'])
+        self.assertIsNone(response.data['next_before'])
+
+    def test_rejects_invalid_cursor(self):
+        response = self.client.get(self.url, {'before': 'abc'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_other_users_conversation_is_not_visible(self):
+        other = User.objects.create_user('s2', password='x', user_type='student')
+        client = APIClient()
+        client.force_authenticate(other)
+        self.assertEqual(client.get(self.url).status_code, 404)
+
+
+class UsageTests(AIChatTestCase):
+    def reply(self, prompt_tokens, completion_tokens):
+        conversation = Conversation.objects.create(user=self.user, title='额度')
+        return Message.objects.create(conversation=conversation, role='assistant', content='回复',
+                                      prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+
+    def test_quota_tokens_are_counted_in_database_immediately(self):
+        self.addCleanup(usage._pending.clear)
+        usage.record(self.user.id, self.reply(30, 20))
+        # 其他进程没有这个进程内存中尚未写入的统计，额度仍按数据库中的计数检查
+        usage._pending.clear()
+        usage.record(self.user.id, self.reply(4, 6))
+        self.assertEqual(usage.get_used_tokens(self.user.id), 60)
+        with override_settings(AI_DAILY_TOKEN_QUOTA=60):
+            self.assertTrue(usage.quota_exceeded(self.user.id))
+        row = TokenUsage.objects.get(user=self.user)
+        self.assertEqual((row.prompt_tokens, row.completion_tokens, row.requests), (34, 26, 0))
+        usage.flush()
+        row.refresh_from_db()
+        self.assertEqual((row.prompt_tokens, row.completion_tokens, row.requests), (34, 26, 1))
+
+
+class TokenEstimateTests(SimpleTestCase):
+    def test_estimates_by_character_class(self):
+        self.assertEqual(tokens.estimate_tokens(''), 0)
+        self.assertEqual(tokens.estimate_tokens('你好，世界！'), 4)
+        self.assertEqual(tokens.estimate_tokens('running'), 3)
+        self.assertEqual(tokens.estimate_tokens('跑步 30分钟😀'), 5)
+
+    def test_truncate_keeps_prefix_within_budget(self):
+        text = '立定跳远' * 500
+        truncated = tokens.truncate_to_tokens(text, 100)
+        self.assertTrue(text.startswith(truncated))
+        self.assertLessEqual(tokens.estimate_tokens(truncated), 100)
+        self.assertGreater(tokens.estimate_tokens(truncated), 90)
+        self.assertEqual(tokens.truncate_to_tokens('短文本', 100), '短文本')
+
+
+class TrimHistoryTests(AIChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.conversation = Conversation.objects.create(user=self.user)
+        Message.objects.bulk_create([
+            Message(conversation=self.conversation, role='user' if i % 2 == 0 else 'assistant',
+                    content=f'第{i}条' + '训练' * 50)
+            for i in range(6)
+        ])
+        self.messages = list(Message.objects.filter(conversation=self.conversation).order_by('id'))
+
+    def test_keeps_newest_messages_within_budget(self):
+        cost = tokens.estimate_tokens(self.messages[0].content) + tokens.MESSAGE_OVERHEAD
+        kept, used = tokens.trim_history(self.messages, cost * 3 + 1)
+        self.assertEqual(kept, self.messages[-3:])
+        self.assertEqual(used, cost * 3)
+        self.assertEqual(tokens.trim_history(self.messages, cost - 1), ([], 0))
+
+    def test_backfills_missing_token_counts(self):
+        tokens.message_tokens(self.messages)
+        self.assertFalse(Message.objects.filter(conversation=self.conversation, token_count__isnull=True).exists())
+        with self.assertNumQueries(0):
+            tokens.message_tokens(self.messages)
+
+    @override_settings(AI_CONTEXT_TOKEN_BUDGET=400, AI_RETRIEVAL_TOP_K=0)
+    def test_prompt_estimate_stays_within_budget(self):
+        response = self.client.post(f'/api/ai/conversations/{self.conversation.id}/estimate_tokens/',
+                                    {'message': '怎样提高跳远成绩？'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertLessEqual(response.data['prompt_tokens'], 400)
+        self.assertGreater(response.data['trimmed_messages'], 0)
+        self.assertEqual(response.data['context_messages'] + response.data['trimmed_messages'], 6)
+
+
+class NewsRetrievalSignalTests(AIChatTestCase):
+    def test_counting_views_does_not_reindex_news(self):
+        news = SportsNews.objects.create(title='校运会', content='田径比赛下周开始报名。')
+        with mock.patch('ai_chat.retrieval.index_news') as index_news:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(f'/api/news/{news.id}/increment_views/')
+        self.assertEqual(response.status_code, 200)
+        index_news.assert_not_called()
+        news.refresh_from_db()
+        self.assertEqual(news.views, 1)
+
+
+def sse_body(pieces, usage=None):
+    lines = [f"data: {json.dumps({'choices': [{'delta': {'content': piece}}]}, ensure_ascii=False)}\n\n"
+             for piece in pieces]
+    if usage:
+        lines.append(f"data: {json.dumps({'choices': [], 'usage': usage})}\n\n")
+    lines.append('data: [DONE]\n\n')
+    return ''.join(lines).encode('utf-8')
+
+
+def split_every(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+class StreamDecoderTests(TestCase):
+    pieces = ['你好', '，', '"引号"', '\\反斜杠\n换行', 'data: [DONE]', '🏃‍♂️跑步']
+
+    def decode(self, framing, chunks):
+        decoded = list(decode_stream(framing, chunks))
+        return ''.join(chunk.content for chunk in decoded), decoded[-1]
+
+    def test_sse_split_at_every_byte_boundary(self):
+        body = sse_body(self.pieces, usage={'prompt_tokens': 12, 'completion_tokens': 7,
+                                            'prompt_cache_hit_tokens': 4})
+        for size in (1, 2, 3, 5, 7, 64, len(body)):
+            text, last = self.decode(SSE, split_every(body, size))
+            self.assertEqual(text, ''.join(self.pieces), size)
+            self.assertEqual(last, StreamChunk('', True, Usage(12, 7, 4)), size)
+
+    def test_ndjson_split_at_every_byte_boundary(self):
+        lines = [json.dumps({'message': {'content': piece}, 'done': False}, ensure_ascii=False) for piece in self.pieces]
+        lines.append(json.dumps({'message': {'content': ''}, 'done': True, 'prompt_eval_count': 9, 'eval_count': 5}))
+        body = '\n'.join(lines).encode('utf-8')
+        for size in (1, 3, 10, len(body)):
+            text, last = self.decode(NDJSON, split_every(body, size))
+            self.assertEqual(text, ''.join(self.pieces), size)
+            self.assertEqual(last, StreamChunk('', True, Usage(9, 5, 0)), size)
+
+    def test_multibyte_character_split_across_chunks(self):
+        body = sse_body(['体测'])
+        cut = body.index('体'.encode('utf-8')) + 1
+        decoder = StreamDecoder(SSE)
+        self.assertEqual(decoder.feed(body[:cut]), [])
+        chunks = decoder.feed(body[cut:])
+        self.assertEqual(chunks[0], StreamChunk('体测', False))
+        self.assertTrue(decoder.done)
+        self.assertIsNone(decoder.usage)
+
+    def test_ignores_data_after_done_marker(self):
+        body = sse_body(['一']) + sse_body(['二'])
+        text, _ = self.decode(SSE, [body])
+        self.assertEqual(text, '一')
+
+
+def parse_events(text):
+    events = []
+    for block in text.split('\n\n'):
+        if block.strip():
+            event_id, data = re.match(r'id: (\d+)\ndata: (.*)$', block, re.S).groups()
+            events.append((int(event_id), json.loads(data)))
+    return events
+
+
+class ResumeStreamTests(AIChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.conversation = Conversation.objects.create(user=self.user)
+        self.message = Message.objects.create(conversation=self.conversation, role='assistant', content='',
+                                              stream_status=Message.STREAM_STREAMING)
+        self.url = f'/api/ai/conversations/{self.conversation.id}/messages/{self.message.id}/stream/'
+        self.access = str(token_for_user(self.user).access_token)
+        self.addCleanup(streams._buffers.pop, self.message.id, None)
+
+    def publish_reply(self, pieces):
+        buffer = streams.open_stream(self.message.id)
+        buffer.publish({'message_id': self.message.id})
+        for piece in pieces:
+            buffer.publish({'chunk': piece})
+        buffer.publish({'status': 'complete', 'message_id': self.message.id})
+        buffer.finish()
+        return buffer
+
+    async def resume(self, last_event_id):
+        response = await self.async_client.get(self.url, headers={
+            'Last-Event-ID': str(last_event_id), 'Authorization': f'Bearer {self.access}',
+        })
+        self.assertEqual(response.status_code, 200)
+        return parse_events(b''.join([chunk async for chunk in response.streaming_content]).decode('utf-8'))
+
+    def assemble(self, events, content=''):
+        for _, payload in events:
+            if payload.get('reset'):
+                content = payload['content']
+            content += payload.get('chunk', '')
+        return content
+
+    async def test_resume_replays_events_after_last_event_id(self):
+        self.publish_reply(['跑', '步', '训', '练'])
+        events = await self.resume(3)
+        self.assertEqual([event_id for event_id, _ in events], [4, 5, 6])
+        self.assertEqual(self.assemble(events, '跑步'), '跑步训练')
+        self.assertEqual(events[-1][1]['status'], 'complete')
+
+    async def test_resume_sends_reset_when_ring_dropped_events(self):
+        with mock.patch.object(streams, 'RING_SIZE', 3):
+            self.publish_reply(['跑', '步', '训', '练'])
+        events = await self.resume(1)
+        self.assertTrue(events[0][1]['reset'])
+        self.assertEqual(events[0][0], 3)
+        self.assertEqual(self.assemble(events), '跑步训练')
+
+    async def test_resume_from_database_checkpoint(self):
+        await Message.objects.filter(id=self.message.id).aupdate(
+            content='跑步训练', stream_status=Message.STREAM_COMPLETE, stream_event_id=5)
+        events = await self.resume(2)
+        self.assertEqual(events[0], (5, {'reset': True, 'content': '跑步训练', 'message_id': self.message.id}))
+        self.assertEqual(events[-1], (6, {'status': 'complete', 'message_id': self.message.id}))
+
+
+class SingleFlightTests(SimpleTestCase):
+    def producer(self, pieces, started, release=None, error=None):
+        async def generate():
+            started.append(1)
+            for piece in pieces:
+                if release is not None:
+                    await release.wait()
+                yield StreamChunk(piece, False)
+            if error is not None:
+                raise error
+        return generate
+
+    async def collect(self, key, factory):
+        return [chunk.content async for chunk in singleflight.stream(key, factory)]
+
+    def test_flight_key_ignores_whitespace_but_not_context(self):
+        service = type('DeepSeekService', (), {'api_url': 'http://llm', 'model': 'chat'})()
+        key = singleflight.flight_key(service, [{'role': 'user', 'content': ' 怎样提高  成绩？'}], 'general')
+        self.assertEqual(key, singleflight.flight_key(service, [{'role': 'user', 'content': '怎样提高 成绩？\n'}], 'general'))
+        self.assertNotEqual(key, singleflight.flight_key(service, [{'role': 'user', 'content': '怎样提高 成绩？'}], 'fitness'))
+
+    def test_is_burst_within_window(self):
+        self.addCleanup(singleflight._recent.clear)
+        self.assertFalse(singleflight.is_burst('shared'))
+        self.assertTrue(singleflight.is_burst('shared'))
+        self.assertFalse(singleflight.is_burst('other'))
+        with mock.patch.object(singleflight.time, 'monotonic', return_value=time.monotonic() + singleflight.BURST_WINDOW + 1):
+            self.assertFalse(singleflight.is_burst('shared'))
+
+    def test_burst_of_personal_prompts_is_sent_without_profiles(self):
+        self.addCleanup(singleflight._recent.clear)
+        service = type('DeepSeekService', (), {'api_url': 'http://llm', 'model': 'chat'})()
+        question = {'role': 'user', 'content': '怎样提高立定跳远成绩？'}
+        shared = [{'role': 'system', 'content': '体育助手'}, question]
+
+        def personal(profile):
+            return [{'role': 'system', 'content': f'体育助手{profile}'}, question]
+
+        # 第一个提问带个人摘要，不与他人合并
+        messages, first_key = choose_flight(service, personal('学生甲'), shared, 'general')
+        self.assertEqual(messages, personal('学生甲'))
+        # 窗口内的相同提问发送共享部分，按共享键合并，不会带上其他学生的摘要
+        messages, second_key = choose_flight(service, personal('学生乙'), shared, 'general')
+        self.assertEqual(messages, shared)
+        self.assertEqual(second_key, singleflight.flight_key(service, shared, 'general'))
+        self.assertNotEqual(first_key, second_key)
+
+    async def test_concurrent_subscribers_share_one_request(self):
+        started = []
+        release = asyncio.Event()
+        factory = self.producer(['一', '二', '三'], started, release)
+        first = asyncio.ensure_future(self.collect('k', factory))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(self.collect('k', factory))
+        await asyncio.sleep(0)
+        release.set()
+        self.assertEqual(await asyncio.gather(first, second), [['一', '二', '三']] * 2)
+        self.assertEqual(len(started), 1)
+        self.assertNotIn('k', singleflight._flights)
+
+    async def test_reported_usage_goes_to_one_subscriber(self):
+        release = asyncio.Event()
+
+        async def generate():
+            await release.wait()
+            yield StreamChunk('一', False)
+            yield StreamChunk('', True, Usage(10, 5, 0))
+
+        async def usages():
+            return [chunk.usage async for chunk in singleflight.stream('k', generate) if chunk.done]
+
+        tasks = [asyncio.ensure_future(usages()) for _ in range(3)]
+        await asyncio.sleep(0)
+        release.set()
+        results = await asyncio.gather(*tasks)
+        self.assertEqual(sorted(results, key=lambda result: result[0] is None),
+                         [[Usage(10, 5, 0)], [None], [None]])
+
+    async def test_late_subscriber_receives_earlier_chunks(self):
+        started = []
+        release = asyncio.Event()
+        factory = self.producer(['一', '二'], started)
+        blocked = self.producer(['三'], started, release)
+
+        async def generate():
+            async for chunk in factory():
+                yield chunk
+            async for chunk in blocked():
+                yield chunk
+
+        first = asyncio.ensure_future(self.collect('k', generate))
+        for _ in range(5):
+            await asyncio.sleep(0)
+        second = asyncio.ensure_future(self.collect('k', generate))
+        await asyncio.sleep(0)
+        release.set()
+        self.assertEqual(await asyncio.gather(first, second), [['一', '二', '三']] * 2)
+
+    async def test_error_is_raised_to_every_subscriber(self):
+        started = []
+        release = asyncio.Event()
+        factory = self.producer(['一'], started, release, error=ValueError('模型服务错误'))
+        tasks = [asyncio.ensure_future(self.collect('k', factory)) for _ in range(2)]
+        await asyncio.sleep(0)
+        release.set()
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        self.assertTrue(all(isinstance(result, ValueError) for result in results))
+        self.assertEqual(len(started), 1)
+
+    async def test_request_is_cancelled_when_all_subscribers_leave(self):
+        started = []
+        never = asyncio.Event()
+
+        async def generate():
+            started.append(1)
+            yield StreamChunk('一', False)
+            await never.wait()
+            yield StreamChunk('二', False)
+
+        async with aclosing(singleflight.stream('k', generate)) as chunks:
+            self.assertEqual((await chunks.__anext__()).content, '一')
+            flight = singleflight._flights['k']
+        self.assertNotIn('k', singleflight._flights)
+        with self.assertRaises(asyncio.CancelledError):
+            await asyncio.wait_for(flight.task, 1)
+        self.assertEqual(len(started), 1)
+
+    def test_call_runs_once_for_concurrent_threads(self):
+        calls = []
+        release = threading.Event()
+
+        def fn():
+            calls.append(1)
+            release.wait(5)
+            return '回复'
+
+        results = []
+        with mock.patch.object(singleflight.logger, 'info') as info:
+            threads = [threading.Thread(target=lambda: results.append(singleflight.call('k', fn))) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            # 跟随的线程开始等待时会记录一条日志
+            for _ in range(500):
+                if info.call_count == 3:
+                    break
+                time.sleep(0.01)
+            release.set()
+            for thread in threads:
+                thread.join(5)
+        self.assertEqual(results, ['回复'] * 4)
+        self.assertEqual(len(calls), 1)
+        self.assertNotIn('k', singleflight._calls)
+
+
+NEWS_TEXTS = [
+    '学校田径运动会将于下周五在体育场举行，设有一百米、跳远和接力项目，请各班体育委员组织报名。',
+    '冬季长跑活动开始，每天早上绕操场慢跑二十分钟，可以有效提高心肺耐力和八百米成绩。',
+    '篮球联赛决赛中计算机学院以两分险胜，获得本届联赛冠军。',
+    '游泳馆本月维修，期间游泳课改为室内体能训练，开放时间另行通知。',
+    '营养讲座提醒同学们运动后及时补充水分和蛋白质，保证充足睡眠有利于恢复。',
+]
+
+
+class PassageIndexTests(SimpleTestCase):
+    def setUp(self):
+        self.index = PassageIndex(temporary_directory(self))
+        self.index.rebuild([(KIND_NEWS, i + 1, text) for i, text in enumerate(NEWS_TEXTS)])
+
+    def top(self, query, index=None):
+        passages = (index or self.index).search(query, 3, min_score=0)
+        return passages[0].object_id if passages else None
+
+    def test_tokenize_uses_bigrams_and_whole_words(self):
+        self.assertEqual(retrieval.tokenize('立定跳远 BMI 50米'), ['立定', '定跳', '跳远', 'bmi', '50', '米'])
+
+    def test_chunk_text_respects_size_and_overlap(self):
+        text = '。'.join(f'第{i}句话说明体测安排' for i in range(60))
+        chunks = retrieval.chunk_text(text, size=100, overlap=20)
+        self.assertGreater(len(chunks), 1)
+        self.assertTrue(all(len(chunk) <= 100 for chunk in chunks))
+        self.assertTrue(chunks[0].endswith('。'))
+        self.assertIn(chunks[0][-10:], chunks[1])
+
+    def test_search_ranks_relevant_passage_first(self):
+        self.assertEqual(self.top('怎样提高八百米跑的成绩？'), 2)
+        self.assertEqual(self.top('篮球联赛冠军是谁'), 3)
+        passages = self.index.search('运动会什么时候报名', 3, min_score=0)
+        self.assertEqual(passages[0].kind, KIND_NEWS)
+        self.assertEqual(passages[0].text, NEWS_TEXTS[0])
+        self.assertEqual(passages, sorted(passages, key=lambda passage: -passage.score))
+        self.assertEqual(self.index.search('weather forecast', 3, min_score=0), [])
+
+    def test_min_score_filters_weak_matches(self):
+        self.assertTrue(self.index.search('学校', 3, min_score=0))
+        self.assertEqual(self.index.search('学校', 3, min_score=100), [])
+
+    def test_replace_updates_and_removes_passages(self):
+        reader = PassageIndex(self.index.path)
+        self.assertEqual(self.top('游泳馆维修', reader), 4)
+        self.assertTrue(self.index.replace(KIND_NEWS, 4, ['羽毛球馆本月维修，羽毛球课暂停。']))
+        self.assertFalse(self.index.replace(KIND_NEWS, 4, ['羽毛球馆本月维修，羽毛球课暂停。']))
+        # 另一个实例（相当于另一个进程）发现段落数变化后重新映射
+        self.assertEqual(self.top('羽毛球馆维修', reader), 4)
+        self.assertNotEqual(self.top('游泳课', reader), 4)
+
+        self.assertTrue(self.index.replace(KIND_NEWS, 3, []))
+        self.assertIsNone(self.top('篮球联赛冠军', reader))
+
+    def test_compaction_keeps_results(self):
+        generation = self.index._generation()
+        with mock.patch.object(retrieval, 'COMPACT_MIN_POSTINGS', 0), mock.patch.object(retrieval, 'COMPACT_RATIO', 0):
+            self.index.replace(KIND_NEWS, 5, ['营养讲座改到周三晚上，地点在体育馆报告厅。'])
+        self.assertNotEqual(self.index._generation(), generation)
+        self.assertEqual(self.top('营养讲座地点'), 5)
+        self.assertEqual(self.top('八百米成绩'), 2)
+        self.assertEqual(len(self.index.search('讲座', 5, min_score=0)), 1)
+
+    def test_replace_without_index_does_nothing(self):
+        index = PassageIndex(f'{temporary_directory(self)}/missing')
+        self.assertFalse(index.replace(KIND_NEWS, 1, ['田径运动会']))
+        self.assertFalse(index.path.exists())
+        self.assertEqual(index.search('田径运动会', 3), [])
+
+
+class RetrievalContextTests(AIChatTestCase):
+    def setUp(self):
+        super().setUp()
+        for i, text in enumerate(NEWS_TEXTS):
+            SportsNews.objects.create(title=f'新闻{i}', content=text)
+        SportsNews.objects.create(title='草稿', content='乒乓球比赛的草稿新闻。', status='draft')
+        PhysicalStandard.objects.create(
+            gender='M', bmi_min=18.5, bmi_max=23.9, vital_capacity_excellent=4000, run_50m_excellent=7,
+            sit_and_reach_excellent=20, standing_jump_excellent=250, run_800m_excellent=200,
+        )
+        retrieval.rebuild()
+
+    def test_rebuild_indexes_published_news_and_standards(self):
+        kinds = {passage.kind for passage in retrieval.search('男生立定跳远的及格标准是多少', 3)}
+        self.assertIn(KIND_STANDARD, kinds)
+        self.assertEqual(retrieval.search('乒乓球比赛', 3), [])
+
+    def test_saving_news_updates_index(self):
+        news = SportsNews.objects.get(title='草稿')
+        news.status = 'published'
+        with self.captureOnCommitCallbacks(execute=True):
+            news.save()
+        self.assertEqual(retrieval.search('乒乓球比赛的新闻', 1)[0].object_id, news.id)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            news.delete()
+        self.assertEqual(retrieval.search('乒乓球比赛', 3), [])
+
+    def test_reference_passages_are_added_to_prompt(self):
+        conversation = Conversation.objects.create(user=self.user)
+        response = self.client.post(f'/api/ai/conversations/{conversation.id}/estimate_tokens/',
+                                    {'message': '怎样提高八百米跑的成绩？'}, format='json')
+        self.assertGreater(response.data['reference_passages'], 0)
@@ -0,0 +1,79 @@
+"""本地 token 数估算与上下文裁剪
+
+没有安装 DeepSeek 的分词器，按字符类别估算：DeepSeek 官方给出的换算是 1 个中文字符约 0.6 个 token、
+1 个英文字符约 0.3 个 token。其他字符（全角以外的符号、表情、其他文字）按每个字符 1 个 token 保守估计，
+每条消息另加角色等格式开销。估算略偏大，裁剪后的请求不会超出预算。
+
+每条消息的 token 数缓存在 ``Message.token_count`` 上：AI回复优先使用模型服务报告的 completion_tokens，
+其他消息在创建时估算；旧消息在第一次参与构建上下文时估算并批量写回。
+"""
+import math
+import re
+from .models import Message
+
+CJK_TOKENS = 0.6
+ASCII_TOKENS = 0.3
+OTHER_TOKENS = 1.0
+# 每条消息的格式开销（角色标记和分隔符）
+MESSAGE_OVERHEAD = 4
+
+# 中日韩文字、全角标点和全角字符
+_CJK_RE = re.compile(r'[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff00-\uffef]')
+
+
+def estimate_tokens(text):
+    """估算一段文本的 token 数"""
+    if not text:
+        return 0
+    cjk = len(_CJK_RE.findall(text))
+    ascii_count = len(text.encode('ascii', 'ignore'))
+    other = len(text) - cjk - ascii_count
+    return math.ceil(cjk * CJK_TOKENS + ascii_count * ASCII_TOKENS + other * OTHER_TOKENS)
+
+
+def prompt_tokens(formatted_messages):
+    """估算一次请求的提示词 token 数（格式化后的消息列表）"""
+    return sum(estimate_tokens(message['content']) + MESSAGE_OVERHEAD for message in formatted_messages)
+
+
+def truncate_to_tokens(text, max_tokens):
+    """截断文本使其估算的 token 数不超过 max_tokens，保留开头"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    # 按比例截取后逐步缩短，估算是单调的，通常一两次即可
+    end = int(len(text) * max_tokens / estimate_tokens(text))
+    while end > 0 and estimate_tokens(text[:end]) > max_tokens:
+        end = int(end * 0.9)
+    return text[:end]
+
+
+def message_tokens(messages):
+    """返回消息列表中每条消息的 token 数，缺少缓存的消息先估算并批量写回"""
+    missing = [message for message in messages if message.token_count is None]
+    for message in missing:
+        message.token_count = estimate_tokens(message.content)
+    if missing:
+        Message.objects.bulk_update(missing, ['token_count'])
+    return [message.token_count for message in messages]
+
+
+def trim_history(messages, budget):
+    """从最新的消息开始向前保留，直到达到 token 预算
+
+    参数:
+        messages: 按时间正序排列的 Message 列表
+        budget: 历史消息可用的 token 数
+
+    返回:
+        (保留的消息列表（正序）, 保留消息的 token 数)
+    """
+    kept = []
+    used = 0
+    for message, count in zip(reversed(messages), reversed(message_tokens(messages))):
+        count += MESSAGE_OVERHEAD
+        if used + count > budget:
+            break
+        kept.append(message)
+        used += count
+    kept.reverse()
+    return kept, used
@@ -1,10 +1,15 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import ConversationViewSet
+from .views import ConversationViewSet, send_message_stream, resume_stream
 
 router = DefaultRouter()
 router.register('conversations', ConversationViewSet, basename='conversation')
 
 urlpatterns = [
+    # 流式接口是异步视图，不经过视图集路由
+    path('conversations/<int:pk>/send_message_stream/', send_message_stream,
+         name='conversation-send-message-stream'),
+    path('conversations/<int:pk>/messages/<int:message_id>/stream/', resume_stream,
+         name='conversation-resume-stream'),
     path('', include(router.urls)),
 ]
@@ -0,0 +1,152 @@
+"""AI用量记录与每日额度
+
+每条AI回复的用量写在 Message 上（随回复内容一起保存，不额外写库）。按用户按天汇总到 TokenUsage：
+
+- 计入每日额度的 token 数（prompt_tokens、completion_tokens）每条回复立即用一条 ``F()`` UPDATE
+  原子累加，多个进程（worker）的用量都在同一行上，额度检查读这一行即可，不会因为各进程的
+  内存或本地缓存互不可见而放宽额度；
+- 其余统计（请求数、命中缓存的 token 数、耗时）先在进程内存中累计，累计 FLUSH_RECORDS 条或
+  距上次写入超过 FLUSH_SECONDS 秒后批量写入：一条 INSERT 补齐缺少的行，一条带 CASE 的 UPDATE 累加所有行。
+"""
+import atexit
+import logging
+import threading
+import time
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Case, F, Q, Value, When
+from django.utils import timezone
+from .models import TokenUsage
+from .tokens import estimate_tokens
+
+logger = logging.getLogger(__name__)
+User = get_user_model()
+
+# 累计多少条用量或多长时间（秒）后批量写入汇总表
+FLUSH_RECORDS = 100
+FLUSH_SECONDS = 10.0
+
+# 汇总表中批量累加的字段；计入额度的 prompt_tokens、completion_tokens 由 record 立即写入
+FIELDS = ('requests', 'cached_tokens', 'latency_ms')
+
+# (用户ID, 日期) -> 尚未写入的累计值
+_pending = {}
+_pending_records = 0
+_flushed_at = time.monotonic()
+_lock = threading.Lock()
+
+
+def set_message_usage(message, usage, started, first_token_at=None):
+    """把一次请求的用量、耗时和回复的 token 数写到回复消息上，返回需要保存的字段
+
+    参数:
+        usage: 模型服务报告的 decoder.Usage，没有报告时为 None
+        started: 请求开始的 time.monotonic()
+        first_token_at: 收到第一个 token 的 time.monotonic()，非流式请求为 None
+    """
+    now = time.monotonic()
+    if usage is not None:
+        message.prompt_tokens, message.completion_tokens, message.cached_tokens = usage
+    message.latency_ms = int((now - started) * 1000)
+    message.ttft_ms = int((first_token_at - started) * 1000) if first_token_at is not None else None
+    # 回复作为后续请求的上下文时的 token 数：优先使用模型服务报告的值
+    message.token_count = message.completion_tokens or estimate_tokens(message.content)
+    return ['prompt_tokens', 'completion_tokens', 'cached_tokens', 'latency_ms', 'ttft_ms', 'token_count']
+
+
+def record(user_id, message):
+    """累计一条回复的用量：计入额度的 token 数立即写入汇总表，其余统计达到批量写入条件时写入"""
+    global _pending_records
+    key = (user_id, timezone.now().date())
+    if message.prompt_tokens or message.completion_tokens:
+        _add_tokens(*key, message.prompt_tokens, message.completion_tokens)
+
+    with _lock:
+        counters = _pending.setdefault(key, dict.fromkeys(FIELDS, 0))
+        counters['requests'] += 1
+        counters['cached_tokens'] += message.cached_tokens
+        counters['latency_ms'] += message.latency_ms or 0
+        _pending_records += 1
+        due = _pending_records >= FLUSH_RECORDS or time.monotonic() - _flushed_at >= FLUSH_SECONDS
+    if due:
+        flush()
+
+
+def _add_tokens(user_id, date, prompt_tokens, completion_tokens):
+    """在数据库中原子累加用户当天计入额度的 token 数，当天还没有汇总行时先插入"""
+    rows = TokenUsage.objects.filter(user_id=user_id, date=date)
+    increments = {
+        'prompt_tokens': F('prompt_tokens') + prompt_tokens,
+        'completion_tokens': F('completion_tokens') + completion_tokens,
+    }
+    try:
+        with transaction.atomic():
+            if not rows.update(**increments):
+                # 其他进程可能同时插入同一行，冲突时忽略后再累加
+                TokenUsage.objects.bulk_create([TokenUsage(user_id=user_id, date=date)], ignore_conflicts=True)
+                rows.update(**increments)
+    except Exception:
+        # 用户已被删除等情况下丢弃这次用量，不影响回复的保存
+        logger.exception("写入AI额度用量失败")
+
+
+def flush():
+    """把内存中累计的用量批量写入汇总表，返回写入的行数"""
+    global _pending, _pending_records, _flushed_at
+    with _lock:
+        pending, _pending = _pending, {}
+        _pending_records = 0
+        _flushed_at = time.monotonic()
+    if not pending:
+        return 0
+
+    try:
+        # 累计期间被删除的用户不再写入，否则外键约束会让整批写入一直失败
+        existing = set(User.objects.filter(id__in={user_id for user_id, _ in pending}).values_list('id', flat=True))
+        pending = {key: counters for key, counters in pending.items() if key[0] in existing}
+        if not pending:
+            return 0
+        with transaction.atomic():
+            TokenUsage.objects.bulk_create(
+                [TokenUsage(user_id=user_id, date=date) for user_id, date in pending],
+                ignore_conflicts=True,
+            )
+            condition = Q()
+            for user_id, date in pending:
+                condition |= Q(user_id=user_id, date=date)
+            TokenUsage.objects.filter(condition).update(**{
+                field: F(field) + Case(
+                    *[When(user_id=user_id, date=date, then=Value(counters[field]))
+                      for (user_id, date), counters in pending.items()],
+                    default=Value(0),
+                )
+                for field in FIELDS
+            })
+    except Exception:
+        # 写入失败时放回内存，下次再写
+        logger.exception("写入AI用量汇总失败")
+        with _lock:
+            for key, counters in pending.items():
+                merged = _pending.setdefault(key, dict.fromkeys(FIELDS, 0))
+                for field in FIELDS:
+                    merged[field] += counters[field]
+        return 0
+    return len(pending)
+
+
+# 进程退出前写入尚未写入的用量
+atexit.register(flush)
+
+
+def get_used_tokens(user_id):
+    """读取用户当天已用的 token 数（按 user、date 唯一索引查询一行）"""
+    row = TokenUsage.objects.filter(user_id=user_id, date=timezone.now().date()).values(
+        'prompt_tokens', 'completion_tokens').first()
+    return row['prompt_tokens'] + row['completion_tokens'] if row else 0
+
+
+def quota_exceeded(user_id):
+    """用户当天的 token 用量是否已达到每日额度（AI_DAILY_TOKEN_QUOTA，为 0 时不限制）"""
+    quota = getattr(settings, 'AI_DAILY_TOKEN_QUOTA', 0)
+    return bool(quota) and get_used_tokens(user_id) >= quota
@@ -3,16 +3,37 @@ from rest_framework import viewsets, permissions, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
+from django.conf import settings
 from django.db import transaction
 from django.utils import timezone
+from django.http import HttpResponse, JsonResponse
+from django.shortcuts import get_object_or_404
 from django.http.response import StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+from asgiref.sync import sync_to_async
+from contextlib import aclosing
 from .models import Conversation, Message
-from .serializers import ConversationSerializer, MessageSerializer
+from .serializers import ConversationSerializer, ConversationListSerializer, MessageSerializer
 from .services import get_ai_service, MemoryService
+from fitness.principal import get_principal
+from . import digest, retrieval, singleflight, streams, tokens, usage
+import asyncio
+import time
 import traceback
 import json
 # Create your views here.
 
+# 消息分页的默认和最大每页条数
+MESSAGE_PAGE_SIZE = 20
+MAX_MESSAGE_PAGE_SIZE = 100
+# 构建上下文时最多读取的历史消息数，实际发送的条数由 token 预算决定
+CONTEXT_MESSAGES = 20
+# 记忆摘要最多占用的预算比例（1/4）
+MEMORY_BUDGET_DIVISOR = 4
+# 检索到的参考资料最多占用的预算比例（1/4）
+RETRIEVAL_BUDGET_DIVISOR = 4
+
 class ConversationViewSet(viewsets.ModelViewSet):
     """对话管理API接口"""
     serializer_class = ConversationSerializer
@@ -20,11 +41,27 @@ class ConversationViewSet(viewsets.ModelViewSet):
     
     def get_queryset(self):
         """只返回当前用户的对话记录，按更新时间降序排序"""
-        return Conversation.objects.filter(user=self.request.user).order_by('-updated_at')
+        return Conversation.objects.filter(user_id=self.request.user.id).order_by('-updated_at')
+    
+    def get_serializer_class(self):
+        """列表使用不含消息的精简序列化器，完整消息通过详情或 messages 接口获取"""
+        if self.action == 'list':
+            return ConversationListSerializer
+        return ConversationSerializer
     
     def perform_create(self, serializer):
         """创建新对话时设置用户"""
-        serializer.save(user=self.request.user)
+        serializer.save(user_id=self.request.user.id)
+    
+    def perform_update(self, serializer):
+        """只保存请求中修改的字段
+
+        消息统计由 Message 的信号用 UPDATE 累加，完整保存会用读取时的旧值覆盖并发写入的计数。
+        """
+        conversation = serializer.instance
+        for field, value in serializer.validated_data.items():
+            setattr(conversation, field, value)
+        conversation.save(update_fields=[*serializer.validated_data, 'updated_at'])
     
     def _prepare_conversation_context(self, conversation, user_message, request):
         """准备对话上下文的辅助方法
@@ -35,7 +72,8 @@ class ConversationViewSet(viewsets.ModelViewSet):
             request: 请求对象
             
         返回:
-            成功时返回 (formatted_messages, service_type, use_case) 元组
+            成功时返回 (formatted_messages, shared_messages, service_type, use_case) 元组，
+            shared_messages 为去掉个人体测摘要的消息列表（见 _build_context）
             失败时返回 Response 对象
         """
         # 验证消息不为空
@@ -45,45 +83,99 @@ class ConversationViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
+        # 检查当天的AI用量额度（读取缓存的计数，不查询数据库）
+        if usage.quota_exceeded(request.user.id):
+            return Response(
+                {'error': '今日AI使用额度已用完，请明天再试'},
+                status=status.HTTP_429_TOO_MANY_REQUESTS
+            )
+        
+        # 构建上下文（不含本条消息的历史按 token 预算裁剪）
+        formatted_messages, context, shared_messages = self._build_context(conversation, user_message, request)
+        if context['message_tokens'] > context['budget']:
+            return Response(
+                {'error': '消息过长，请缩短后再发送'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
         # 保存用户消息
         Message.objects.create(
             conversation=conversation,
             role='user',
-            content=user_message
+            content=user_message,
+            token_count=tokens.estimate_tokens(user_message)
         )
         
-        # 更新对话时间戳
-        conversation.save()  # 这将更新updated_at字段
+        # 从请求中获取服务类型和使用场景
+        service_type = request.data.get('service_type', 'auto')
+        use_case = request.data.get('use_case', 'general')
+        
+        return formatted_messages, shared_messages, service_type, use_case
+    
+    def _build_context(self, conversation, user_message, request):
+        """构建发送给AI服务的消息列表，不保存消息
         
-        # 获取用户类型，用于个性化响应
-        user_type = request.user.user_type if hasattr(request.user, 'user_type') else 'unknown'
+        系统提示词（含截断后的记忆摘要和检索到的参考资料）和当前消息必须发送，剩余的 token 预算从最新的历史消息开始向前填充。
         
-        # 构建系统提示词，根据用户类型定制
-        system_prompt = self._get_system_prompt_for_user_type(user_type, request.user)
+        返回:
+            (formatted_messages, context, shared_messages)，context 为估算的 token 数和保留的历史消息数；
+            shared_messages 是系统提示词中去掉个人体测摘要的消息列表，用于合并集中提问（见 singleflight），
+            没有个人摘要时为 None
+        """
+        budget = settings.AI_CONTEXT_TOKEN_BUDGET
+        
+        # 构建系统提示词，根据用户类型定制（主体优先取自令牌声明，不查询数据库）
+        principal = get_principal(request)
+        role_prompt = self._get_system_prompt_for_user_type(principal)
+        profile = self._get_profile_prompt(principal)
+        context_prompt = ""
         
-        # 将对话记忆添加到系统提示中（如果启用记忆功能）
+        # 将对话记忆添加到系统提示中（如果启用记忆功能），记忆摘要最多占预算的四分之一
         if conversation.use_memory and conversation.memory_summary:
-            system_prompt += f"\n\n用户的历史记忆摘要：\n{conversation.memory_summary}"
-            
+            summary = tokens.truncate_to_tokens(conversation.memory_summary, budget // MEMORY_BUDGET_DIVISOR)
+            context_prompt += f"\n\n用户的历史记忆摘要：\n{summary}"
+        
+        # 附加从体育新闻和体测标准中检索到的参考资料，最多占预算的四分之一
+        passages = retrieval.search(user_message)
+        if passages:
+            reference = tokens.truncate_to_tokens(
+                "\n".join(f"[{index}] {passage.text}" for index, passage in enumerate(passages, 1)),
+                budget // RETRIEVAL_BUDGET_DIVISOR
+            )
+            context_prompt += f"\n\n以下是本校体育新闻和体测标准中的参考资料，与问题相关时请据此回答：\n{reference}"
+        
+        system_prompt = role_prompt + profile + context_prompt
         system_message = {
             "role": "system", 
             "content": system_prompt
         }
+        system_tokens = tokens.estimate_tokens(system_prompt) + tokens.MESSAGE_OVERHEAD
+        message_tokens = tokens.estimate_tokens(user_message) + tokens.MESSAGE_OVERHEAD
         
-        # 获取对话历史（最后10条消息，避免上下文过长）
-        messages = Message.objects.filter(conversation=conversation).order_by('timestamp')[:10]
-        
-        # 格式化消息用于AI服务
-        formatted_messages = [{"role": msg.role, "content": msg.content} for msg in messages]
+        # 获取最近的对话历史，按剩余预算从最新的消息向前保留
+        recent = list(
+            Message.objects.filter(conversation=conversation)
+            .only('id', 'role', 'content', 'token_count')
+            .order_by('-id')[:CONTEXT_MESSAGES]
+        )[::-1]
+        history, history_tokens = tokens.trim_history(recent, budget - system_tokens - message_tokens)
         
-        # 将系统提示词添加到消息列表的开头
-        formatted_messages.insert(0, system_message)
+        # 格式化消息用于AI服务：系统提示词、历史消息、当前消息
+        formatted_messages = [system_message]
+        formatted_messages += [{"role": msg.role, "content": msg.content} for msg in history]
+        formatted_messages.append({"role": "user", "content": user_message})
+        shared_messages = None
+        if profile:
+            shared_messages = [{"role": "system", "content": role_prompt + context_prompt}, *formatted_messages[1:]]
         
-        # 从请求中获取服务类型和使用场景
-        service_type = request.data.get('service_type', 'auto')
-        use_case = request.data.get('use_case', 'general')
-        
-        return formatted_messages, service_type, use_case
+        return formatted_messages, {
+            'prompt_tokens': system_tokens + history_tokens + message_tokens,
+            'message_tokens': message_tokens,
+            'context_messages': len(history),
+            'trimmed_messages': len(recent) - len(history),
+            'reference_passages': len(passages),
+            'budget': budget,
+        }, shared_messages
         
     def _update_conversation_memory(self, conversation, message_count):
         """更新对话记忆的辅助方法
@@ -97,12 +189,15 @@ class ConversationViewSet(viewsets.ModelViewSet):
         
         # 当消息数达到阈值时，更新记忆
         if conversation.use_memory and memory_service.should_generate_memory(message_count):
-            # 获取所有消息进行记忆生成
-            all_messages = Message.objects.filter(conversation=conversation).order_by('timestamp')
+            # 只取记忆生成需要的最近消息（查询集不支持负索引切片）
+            recent_messages = list(
+                Message.objects.filter(conversation=conversation)
+                .order_by('-timestamp')[:memory_service.memory_threshold]
+            )[::-1]
             
             # 生成或更新记忆摘要
             new_memory = memory_service.generate_memory(
-                all_messages, 
+                recent_messages, 
                 previous_memory=conversation.memory_summary
             )
             
@@ -131,29 +226,38 @@ class ConversationViewSet(viewsets.ModelViewSet):
             if isinstance(result, Response):  # 如果是错误响应，直接返回
                 return result
                 
-            formatted_messages, service_type, use_case = result
+            formatted_messages, shared_messages, service_type, use_case = result
             
             # 根据配置获取AI服务
             ai_service = get_ai_service(service_type=service_type, use_case=use_case)
             
-            # 获取AI响应
-            response = ai_service.get_response(formatted_messages, use_case=use_case if hasattr(ai_service, 'use_case_temperatures') else None)
+            # 获取AI响应，同时进行中的相同请求只调用一次模型服务
+            formatted_messages, key = choose_flight(ai_service, formatted_messages, shared_messages, use_case)
+            started = time.monotonic()
+            called = []
+            
+            def fetch():
+                # 只有实际调用模型服务的请求计入用量，等待合并结果的请求不重复计入
+                called.append(True)
+                return ai_service.get_response(formatted_messages, use_case=use_case if hasattr(ai_service, 'use_case_temperatures') else None)
             
-            # 根据服务类型提取AI响应内容
-            if service_type == 'ollama':
-                ai_message = response.get('message', {}).get('content', '')
-            else:  # OpenAI和DeepSeek使用相同的响应格式
-                ai_message = response.get('choices', [{}])[0].get('message', {}).get('content', '')
+            response = singleflight.call(key, fetch)
+            
+            # 由实际使用的服务按各自的响应格式提取内容（auto 可能回退到 Ollama）
+            ai_message = ai_service.response_content(response)
             
             if not ai_message:
                 raise ValueError("无法从AI响应中提取消息内容")
             
-            # 保存AI响应
-            ai_response = Message.objects.create(
+            # 保存AI响应及其用量，并累计到用户当天的用量
+            ai_response = Message(
                 conversation=conversation,
                 role='assistant',
                 content=ai_message
             )
+            usage.set_message_usage(ai_response, ai_service.response_usage(response) if called else None, started)
+            ai_response.save()
+            usage.record(request.user.id, ai_response)
             
             # 检查是否需要更新对话记忆
             message_count = Message.objects.filter(conversation=conversation).count()
@@ -175,131 +279,138 @@ class ConversationViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
     
-    def _get_system_prompt_for_user_type(self, user_type, user):
-        """根据用户类型生成系统提示词
+    @action(detail=True, methods=['post'])
+    def estimate_tokens(self, request, pk=None):
+        """估算发送一条消息的 token 消耗，不保存消息也不调用AI服务
+        
+        返回:
+            prompt_tokens: 本次请求提示词的估算 token 数（系统提示词、保留的历史消息和当前消息）
+            message_tokens: 当前消息的估算 token 数
+            context_messages / trimmed_messages: 保留和因超出预算被省略的历史消息数
+            budget: 提示词的 token 预算
+            used_today / daily_quota: 当天已用的 token 数和每日额度（0 表示不限制）
+        """
+        conversation = self.get_object()
+        _, context, _ = self._build_context(conversation, request.data.get('message', ''), request)
+        context['used_today'] = usage.get_used_tokens(request.user.id)
+        context['daily_quota'] = settings.AI_DAILY_TOKEN_QUOTA
+        return Response(context)
+    
+    def _get_system_prompt_for_user_type(self, principal):
+        """根据用户类型生成系统提示词（不含个人体测摘要，见 _get_profile_prompt）
         
         参数:
-            user_type: 用户类型 ('student', 'parent', 'admin', 'unknown')
-            user: 用户对象
+            principal: 当前请求的主体（fitness.principal.Principal）
             
         返回:
             适合用户类型的系统提示词
         """
         base_prompt = "你是一位专业的体育健身AI助手，为健身运动提供专业指导和建议。"
         
-        if user_type == 'student':
-            # 尝试获取学生资料
-            try:
-                student_profile = user.student_profile
-                prompt = f"{base_prompt}你正在与一名学生交流，请提供适合学生的健身和体测指导。"
-                
-                # 如果有身高体重数据，可以计算BMI并添加到提示中
-                if hasattr(student_profile, 'height') and hasattr(student_profile, 'weight'):
-                    if student_profile.height and student_profile.weight:
-                        height_m = student_profile.height / 100  # 转换为米
-                        bmi = student_profile.weight / (height_m * height_m)
-                        prompt += f" 该学生的BMI约为{bmi:.1f}。"
-                
-                return prompt
-            except:
-                return f"{base_prompt}你正在与一名学生交流，请提供适合学生的健身和体测指导。"
+        if principal.is_student:
+            return f"{base_prompt}你正在与一名学生交流，请提供适合学生的健身和体测指导。"
                 
-        elif user_type == 'parent':
+        elif principal.is_parent:
             return f"{base_prompt}你正在与一位家长交流，请提供适合指导孩子体育锻炼的建议，并考虑如何帮助家长更好地关注孩子的身体健康发展。"
             
-        elif user_type == 'admin':
+        elif principal.is_admin:
             return f"{base_prompt}你正在与一位管理员交流，请提供关于体育教育、健身项目管理和学生体测数据分析的专业建议。"
             
         else:
             return f"{base_prompt}请提供关于健身、营养和体育锻炼的专业建议。"
     
-    @action(detail=True, methods=['post'])
-    def send_message_stream(self, request, pk=None):
-        """以流式方式发送消息并获取AI响应"""
-        try:
-            conversation = self.get_object()
-            user_message = request.data.get('message', '')
-            
-            # 准备对话上下文
-            result = self._prepare_conversation_context(conversation, user_message, request)
-            if isinstance(result, Response):  # 如果是错误响应，直接返回
-                return result
-                
-            formatted_messages, service_type, use_case = result
-            
-            # 根据配置获取AI服务
-            ai_service = get_ai_service(service_type=service_type, use_case=use_case)
-            
-            # 创建流式响应的内部函数
-            def stream_response():
-                try:
-                    # 创建用于保存完整响应的变量
-                    full_response = ""
-                    
-                    # 创建AI响应消息数据库记录
-                    ai_response = Message.objects.create(
-                        conversation=conversation,
-                        role='assistant',
-                        content="" # 初始为空，将在生成完成后更新
-                    )
-                    
-                    # 先发送消息ID，让前端知道这条消息的标识
-                    yield f"{{\"message_id\": {ai_response.id}}}\n"
-                    
-                    # 获取流式响应
-                    for chunk in ai_service.get_streaming_response(formatted_messages, use_case=use_case):
-                        # 提取文本块内容
-                        if service_type == 'ollama':
-                            chunk_text = chunk.get('message', {}).get('content', '')
-                        else:  # OpenAI和DeepSeek使用相同的格式
-                            chunk_text = chunk.get('choices', [{}])[0].get('delta', {}).get('content', '')
-                        
-                        if chunk_text:
-                            # 累积完整响应
-                            full_response += chunk_text
-                            
-                            # 将块数据作为JSON发送，确保转义所有特殊字符
-                            yield f"{{\"chunk\": {json.dumps(chunk_text)}}}\n"
-                    
-                    # 更新数据库中的AI消息内容
-                    ai_response.content = full_response
-                    ai_response.save()
-                    
-                    # 检查是否需要更新对话记忆
-                    message_count = Message.objects.filter(conversation=conversation).count()
-                    self._update_conversation_memory(conversation, message_count)
-                    
-                    # 发送完成信号
-                    yield f"{{\"status\": \"complete\", \"message_id\": {ai_response.id}}}\n"
-                    
-                except Exception as e:
-                    print(f"流式响应生成时出错: {str(e)}")
-                    print(traceback.format_exc())
-                    
-                    # 发送错误信息
-                    yield f"{{\"error\": \"{str(e)}\"}}\n"
+    def _get_profile_prompt(self, principal):
+        """学生（子女）的体测档案摘要，附加在系统提示词的用户类型说明之后；没有摘要时返回空字符串
+        
+        摘要见 digest.py，缓存命中时不查询数据库。
+        """
+        if principal.is_student:
+            profile = digest.get_digest(principal.student_id) if principal.student_id else None
+            if profile:
+                return f"请结合该学生的体测情况给出有针对性的建议。\n\n{profile}"
             
-            # 返回流式响应
-            return StreamingHttpResponse(
-                streaming_content=stream_response(),
-                content_type='text/event-stream'
-            )
+        elif principal.is_parent:
+            profiles = [profile for profile in digest.get_digests(principal.child_ids).values() if profile]
+            if len(profiles) == 1:
+                return f"以下是孩子的体测情况：\n\n{profiles[0]}"
+            elif profiles:
+                return "以下是各个孩子的体测情况：" + "".join(
+                    f"\n\n孩子{index}：\n{profile}" for index, profile in enumerate(profiles, 1)
+                )
+        return ""
+    
+    def dispatch_sync(self, request, pk, handler):
+        """流式接口的同步准备阶段，按 DRF 的请求流程完成认证、权限检查并获取对话
+        
+        流式接口是异步视图（见模块级的 send_message_stream 和 resume_stream），DRF 的视图集
+        不支持异步动作，因此在线程中调用本方法复用视图集的认证、权限和对话查询逻辑。
+        
+        参数:
+            handler: handler(request, conversation)，返回准备好的数据或错误响应
             
-        except Exception as e:
-            print(f"发送流式消息时出错: {str(e)}")
-            print(traceback.format_exc())
-            return Response(
-                {'error': str(e)}, 
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
+        返回:
+            handler 的返回值；出错时返回已渲染的错误响应
+        """
+        self.args = ()
+        self.kwargs = {'pk': pk}
+        request = self.initialize_request(request, pk=pk)
+        self.request = request
+        self.headers = self.default_response_headers
+        
+        try:
+            self.initial(request, pk=pk)
+            result = handler(request, self.get_object())
+            if not isinstance(result, Response):
+                return result
+            response = result
+        except Exception as exc:
+            response = self.handle_exception(exc)
+        
+        response = self.finalize_response(request, response, pk=pk)
+        return response.render()
+    
+    def prepare_stream(self, request, conversation):
+        """保存用户消息并准备模型请求，返回 (conversation, formatted_messages, key, use_case, ai_service)"""
+        result = self._prepare_conversation_context(conversation, request.data.get('message', ''), request)
+        if isinstance(result, Response):
+            return result
+        formatted_messages, shared_messages, service_type, use_case = result
+        ai_service = get_ai_service(service_type=service_type, use_case=use_case)
+        formatted_messages, key = choose_flight(ai_service, formatted_messages, shared_messages, use_case)
+        return conversation, formatted_messages, key, use_case, ai_service
     
     @action(detail=True, methods=['get'])
     def messages(self, request, pk=None):
-        """获取对话的所有消息"""
+        """分页获取对话消息，从最新的消息开始向前翻页
+        
+        查询参数:
+            before: 上一页返回的 next_before，只返回ID小于它的消息；为空时返回最新的消息
+            limit: 每页消息数，默认20，最大100
+            
+        返回:
+            results 按时间正序排列，可直接插入到已加载消息的前面；
+            next_before 为空表示没有更早的消息
+        """
         conversation = self.get_object()
-        messages = Message.objects.filter(conversation=conversation).order_by('timestamp')
-        serializer = MessageSerializer(messages, many=True)
-        return Response(serializer.data)
+        try:
+            limit = max(1, min(int(request.query_params.get('limit', MESSAGE_PAGE_SIZE)), MAX_MESSAGE_PAGE_SIZE))
+            before = request.query_params.get('before')
+            before = int(before) if before else None
+        except ValueError:
+            return Response({'error': '无效的分页参数'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        # 按 (conversation_id, id) 索引倒序扫描，多取一条判断是否还有更早的消息
+        messages = Message.objects.filter(conversation=conversation)
+        if before is not None:
+            messages = messages.filter(id__lt=before)
+        page = list(messages.order_by('-id')[:limit + 1])
+        has_more = len(page) > limit
+        page = page[:limit][::-1]
+        return Response({
+            'results': MessageSerializer(page, many=True).data,
+            'count': conversation.message_count,
+            'next_before': page[0].id if has_more else None,
+        })
     
     @action(detail=True, methods=['post'])
     def clear_messages(self, request, pk=None):
@@ -307,8 +418,9 @@ class ConversationViewSet(viewsets.ModelViewSet):
         conversation = self.get_object()
         
         try:
-            # 删除对话中的所有消息
+            # 删除对话中的所有消息，批量删除不会逐条刷新统计，删除后统一刷新
             Message.objects.filter(conversation=conversation).delete()
+            Conversation.refresh_message_stats([conversation.id])
             return Response({'status': 'success', 'message': '对话消息已清空'})
         except Exception as e:
             return Response(
@@ -338,3 +450,148 @@ class ConversationViewSet(viewsets.ModelViewSet):
                 {'error': f'删除消息失败: {str(e)}'}, 
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
+
+
+def choose_flight(ai_service, formatted_messages, shared_messages, use_case):
+    """选择发送给模型服务的消息和合并键，返回 (messages, key)
+    
+    带个人体测摘要的请求只在集中提问时改为发送共享部分并按共享键合并（取舍见 singleflight）。
+    """
+    if shared_messages is not None:
+        shared_key = singleflight.flight_key(ai_service, shared_messages, use_case)
+        if singleflight.is_burst(shared_key):
+            return shared_messages, shared_key
+    return formatted_messages, singleflight.flight_key(ai_service, formatted_messages, use_case)
+
+
+def event_stream_response(content):
+    """返回 SSE 格式的流式响应，并禁止代理缓冲"""
+    response = StreamingHttpResponse(streaming_content=content, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+async def generate_reply(view, buffer, conversation, ai_response, ai_service, formatted_messages, key, use_case):
+    """生成AI回复并写入事件缓冲区
+    
+    与客户端连接无关：客户端断线后继续生成，直到所有客户端断开超过等待重连的时间后被取消。
+    """
+    reported = None
+    try:
+        # 先发送消息ID，让前端知道这条消息的标识
+        buffer.publish({'message_id': ai_response.id})
+        
+        # 同时进行中的相同请求共享一次模型服务调用，每个对话各自保存回复；
+        # aclosing 确保任务被取消时退订，所有订阅方都退订后关闭与模型服务的连接
+        producer = lambda: ai_service.aget_streaming_response(formatted_messages, use_case=use_case)
+        async with aclosing(singleflight.stream(key, producer)) as chunks:
+            async for chunk in chunks:
+                if chunk.usage is not None:
+                    reported = chunk.usage
+                if chunk.content:
+                    buffer.publish({'chunk': chunk.content})
+                    # 定期把已生成的内容写入数据库，供其他进程续传
+                    if buffer.checkpoint_due():
+                        await Message.objects.filter(id=ai_response.id).aupdate(
+                            content=buffer.text, stream_event_id=buffer.last_event_id
+                        )
+        
+        # 更新数据库中的AI消息内容和用量，并累计到用户当天的用量
+        ai_response.content = buffer.text
+        ai_response.stream_status = Message.STREAM_COMPLETE
+        ai_response.stream_event_id = buffer.last_event_id
+        update_fields = usage.set_message_usage(ai_response, reported, buffer.started_at, buffer.first_chunk_at)
+        await ai_response.asave(update_fields=['content', 'stream_status', 'stream_event_id'] + update_fields)
+        await sync_to_async(usage.record)(conversation.user_id, ai_response)
+        
+        # 检查是否需要更新对话记忆（记忆生成调用同步接口，放到线程中执行）
+        message_count = await Message.objects.filter(conversation=conversation).acount()
+        await sync_to_async(view._update_conversation_memory)(conversation, message_count)
+        
+        # 发送完成信号
+        buffer.publish({'status': 'complete', 'message_id': ai_response.id})
+        
+    except asyncio.CancelledError:
+        # 所有客户端断开且没有重连，模型服务的连接已随 aclosing 关闭，保存已生成的部分
+        print(f"客户端未重连，已中止AI响应生成: 消息ID={ai_response.id}")
+        await _save_interrupted(conversation, ai_response, buffer)
+        buffer.publish({'error': '回复生成已中断', 'message_id': ai_response.id})
+        raise
+        
+    except Exception as e:
+        print(f"流式响应生成时出错: {str(e)}")
+        print(traceback.format_exc())
+        await _save_interrupted(conversation, ai_response, buffer)
+        
+        # 发送错误信息
+        buffer.publish({'error': str(e), 'message_id': ai_response.id})
+        
+    finally:
+        buffer.finish()
+
+
+async def _save_interrupted(conversation, ai_response, buffer):
+    """保存中断时已生成的内容；模型服务没有报告用量，只记录耗时"""
+    ai_response.content = buffer.text
+    ai_response.stream_status = Message.STREAM_INTERRUPTED
+    ai_response.stream_event_id = buffer.last_event_id
+    update_fields = usage.set_message_usage(ai_response, None, buffer.started_at, buffer.first_chunk_at)
+    await ai_response.asave(update_fields=['content', 'stream_status', 'stream_event_id'] + update_fields)
+    await sync_to_async(usage.record)(conversation.user_id, ai_response)
+
+
+@csrf_exempt
+@require_POST
+async def send_message_stream(request, pk):
+    """以流式方式发送消息并获取AI响应
+    
+    异步视图：在 ASGI 下流式响应由事件循环驱动，不会在整个生成过程中占用线程。
+    响应为 SSE 格式，每个事件带顺序编号的 id；连接中断后可通过 resume_stream 接口续传。
+    认证使用请求头中的令牌，不依赖会话，因此不需要 CSRF 校验。
+    """
+    view = ConversationViewSet(action_map={'post': 'send_message_stream'})
+    prepared = await sync_to_async(view.dispatch_sync)(request, pk, view.prepare_stream)
+    if isinstance(prepared, HttpResponse):
+        return prepared
+    conversation, formatted_messages, key, use_case, ai_service = prepared
+    
+    # 创建AI响应消息数据库记录，内容在生成过程中定期写入
+    ai_response = await Message.objects.acreate(
+        conversation=conversation,
+        role='assistant',
+        content="",
+        stream_status=Message.STREAM_STREAMING
+    )
+    buffer = streams.open_stream(ai_response.id)
+    buffer.start(generate_reply(view, buffer, conversation, ai_response, ai_service,
+                                formatted_messages, key, use_case))
+    return event_stream_response(streams.follow(buffer))
+
+
+@require_GET
+async def resume_stream(request, pk, message_id):
+    """断线后续传AI回复
+    
+    请求头 Last-Event-ID（或查询参数 last_event_id）为客户端收到的最后一个事件ID。
+    回复仍在当前进程中时从内存缓冲区补发之后的事件并继续推送；否则从数据库检查点续传。
+    """
+    view = ConversationViewSet(action_map={'get': 'resume_stream'})
+    
+    def get_message(request, conversation):
+        return get_object_or_404(Message, id=message_id, conversation=conversation, role='assistant')
+    
+    message = await sync_to_async(view.dispatch_sync)(request, pk, get_message)
+    if isinstance(message, HttpResponse):
+        return message
+    
+    try:
+        last_event_id = int(request.headers.get('Last-Event-ID') or request.GET.get('last_event_id') or 0)
+    except ValueError:
+        return JsonResponse({'error': '无效的 Last-Event-ID'}, status=status.HTTP_400_BAD_REQUEST,
+                            json_dumps_params={'ensure_ascii': False})
+    
+    buffer = streams.get_stream(message.id)
+    if buffer is not None:
+        return event_stream_response(streams.follow(buffer, last_event_id))
+    return event_stream_response(streams.follow_checkpoints(message.id, last_event_id))
@@ -1,5 +1,6 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
+from django.db import transaction
 from .models import User, Student, PhysicalStandard, TestPlan, TestResult, Comment, HealthReport, MakeupNotification, SportsNews, NewsComment
 
 @admin.register(User)
@@ -88,7 +89,7 @@ class MakeupNotificationAdmin(admin.ModelAdmin):
 
 @admin.register(SportsNews)
 class SportsNewsAdmin(admin.ModelAdmin):
-    list_display = ('title', 'pub_date', 'status', 'views', 'is_featured')
+    list_display = ('title', 'pub_date', 'status', 'views', 'approved_comment_count', 'is_featured')
     search_fields = ('title', 'content', 'source_name')
     list_filter = ('status', 'is_featured', 'pub_date')
     date_hierarchy = 'pub_date'
@@ -108,7 +109,10 @@ class NewsCommentAdmin(admin.ModelAdmin):
     actions = ['approve_comments']
     
     def approve_comments(self, request, queryset):
-        queryset.update(is_approved=True)
+        with transaction.atomic():
+            news_ids = set(queryset.values_list('news_id', flat=True))
+            queryset.update(is_approved=True)
+            SportsNews.refresh_comment_stats(news_ids)
     approve_comments.short_description = '批准选中的评论'
 
 # 自定义管理站点标题
@@ -3,6 +3,9 @@ from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny
 from rest_framework_simplejwt.tokens import RefreshToken
+from .principal import token_for_user
+from .authentication import revoked_tokens
+from .login import LoginBusy
 from django.contrib.auth import authenticate
 from django.contrib.auth.models import User
 from .serializers import UserSerializer
@@ -16,12 +19,15 @@ def login(request):
     if not username or not password:
         return Response({'error': '请提供用户名和密码'}, status=status.HTTP_400_BAD_REQUEST)
 
-    user = authenticate(username=username, password=password)
+    try:
+        user = authenticate(request, username=username, password=password)
+    except LoginBusy as e:
+        return Response({'error': str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
 
     if not user:
         return Response({'error': '用户名或密码错误'}, status=status.HTTP_401_UNAUTHORIZED)
 
-    refresh = RefreshToken.for_user(user)
+    refresh = token_for_user(user)
     
     return Response({
         'refresh': str(refresh),
@@ -43,7 +49,7 @@ def register(request):
         return Response({'error': '用户名已存在'}, status=status.HTTP_400_BAD_REQUEST)
 
     user = User.objects.create_user(username=username, password=password, email=email)
-    refresh = RefreshToken.for_user(user)
+    refresh = token_for_user(user)
 
     return Response({
         'refresh': str(refresh),
@@ -57,6 +63,8 @@ def logout(request):
         refresh_token = request.data.get('refresh')
         token = RefreshToken(refresh_token)
         token.blacklist()
+        # 当前进程立即拒绝由该刷新令牌签发的访问令牌
+        revoked_tokens.add(token)
         return Response({'message': '成功登出'}, status=status.HTTP_200_OK)
     except Exception:
         return Response({'error': '无效的令牌'}, status=status.HTTP_400_BAD_REQUEST)
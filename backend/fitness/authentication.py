@@ -0,0 +1,203 @@
+"""无状态JWT认证
+
+访问令牌中携带用户ID、用户类型、学生ID和子女ID等声明（见 fitness.principal.token_for_user），
+认证时直接用这些声明构造轻量用户对象，只有访问声明以外的属性时才查询 ``User``。
+
+访问令牌还携带签发时的主体版本号，与 ``User.principal_version`` 中的当前版本不一致（学生档案或家长关系已变化）时
+拒绝该令牌，刷新令牌时重新加载声明。
+
+令牌吊销通过进程内的黑名单缓存检查：访问令牌携带签发它的刷新令牌的 jti，
+缓存定期从 simplejwt 的黑名单表增量加载，不再每个请求查询一次数据库。
+"""
+import threading
+import time
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+from django.utils.functional import SimpleLazyObject
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.utils import datetime_from_epoch
+from .principal import Principal, CLAIM_USER_TYPE, CLAIM_PRINCIPAL_VERSION, apply_claims, get_principal_version
+
+# 访问令牌中记录刷新令牌jti的声明
+CLAIM_REFRESH_JTI = 'refresh_jti'
+
+# 可以直接从令牌读取、无需查询数据库的用户属性
+CLAIM_USERNAME = 'username'
+CLAIM_IS_STAFF = 'is_staff'
+CLAIM_IS_SUPERUSER = 'is_superuser'
+
+
+class FitnessRefreshToken(RefreshToken):
+    """生成的访问令牌会记录刷新令牌的jti，刷新令牌被吊销时访问令牌随之失效"""
+
+    @property
+    def access_token(self):
+        access = super().access_token
+        access[CLAIM_REFRESH_JTI] = self[api_settings.JTI_CLAIM]
+        return access
+
+
+class FitnessTokenRefreshSerializer(TokenRefreshSerializer):
+    """刷新令牌：重新加载用户和声明，先轮换刷新令牌，再由新的刷新令牌签发访问令牌
+
+    simplejwt 默认先签发访问令牌再把旧刷新令牌加入黑名单，
+    那样新访问令牌记录的是已吊销的jti。
+    """
+    token_class = FitnessRefreshToken
+
+    def validate(self, attrs):
+        refresh = self.token_class(attrs['refresh'])
+        data = {}
+
+        # 每次刷新都从数据库加载用户：已停用的用户不能续期，声明按当前的用户属性和主体重新生成，
+        # 不会随着刷新令牌的轮换一直沿用登录时的声明
+        user_id = refresh[api_settings.USER_ID_CLAIM]
+        user = get_user_model().objects.filter(**{api_settings.USER_ID_FIELD: user_id}).first()
+        if user is None or not user.is_active:
+            raise AuthenticationFailed('用户不存在或已停用', code='user_inactive')
+        apply_claims(refresh, user)
+
+        if api_settings.ROTATE_REFRESH_TOKENS:
+            if api_settings.BLACKLIST_AFTER_ROTATION:
+                refresh.blacklist()
+                revoked_tokens.add(refresh)
+            refresh.set_jti()
+            refresh.set_exp()
+            refresh.set_iat()
+            data['refresh'] = str(refresh)
+
+        data['access'] = str(refresh.access_token)
+        return data
+
+
+class RevokedTokenCache:
+    """进程内的已吊销刷新令牌jti，定期从黑名单表增量加载
+
+    每次只加载主键大于上次最大值的黑名单记录，已过期的jti在内存中清除。
+    并发事务可能晚于更大的主键提交，每隔 ``rebuild_interval`` 秒完整重建一次，补上这类遗漏。
+    """
+
+    def __init__(self, refresh_interval=30, rebuild_interval=600):
+        self.refresh_interval = refresh_interval
+        self.rebuild_interval = rebuild_interval
+        self._jtis = {}  # jti -> 过期时间
+        self._last_id = 0
+        self._loaded_at = None
+        self._rebuilt_at = None
+        self._lock = threading.Lock()
+
+    def is_revoked(self, jti):
+        if self._loaded_at is None or time.monotonic() - self._loaded_at > self.refresh_interval:
+            self.reload()
+        return jti in self._jtis
+
+    def reload(self):
+        from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+        with self._lock:
+            now = timezone.now()
+            rebuild = self._rebuilt_at is None or time.monotonic() - self._rebuilt_at > self.rebuild_interval
+            # 已过期的令牌无论如何都会被拒绝，不需要加载
+            queryset = BlacklistedToken.objects.filter(token__expires_at__gt=now)
+            if rebuild:
+                jtis = {}
+                last_id = 0
+            else:
+                jtis = {jti: expires_at for jti, expires_at in self._jtis.items() if expires_at > now}
+                last_id = self._last_id
+                queryset = queryset.filter(id__gt=last_id)
+            for row_id, jti, expires_at in queryset.values_list('id', 'token__jti', 'token__expires_at'):
+                jtis[jti] = expires_at
+                last_id = max(last_id, row_id)
+            self._jtis = jtis
+            self._last_id = last_id
+            self._loaded_at = time.monotonic()
+            if rebuild:
+                self._rebuilt_at = self._loaded_at
+
+    def add(self, token):
+        """本进程吊销刷新令牌时立即生效，无需等待下次加载"""
+        with self._lock:
+            self._jtis[token[api_settings.JTI_CLAIM]] = datetime_from_epoch(token['exp'])
+
+
+revoked_tokens = RevokedTokenCache()
+
+
+def user_claims(user):
+    """ClaimsUser 可直接读取的用户属性"""
+    return {
+        CLAIM_USERNAME: user.username,
+        CLAIM_IS_STAFF: user.is_staff,
+        CLAIM_IS_SUPERUSER: user.is_superuser,
+    }
+
+
+class ClaimsUser(SimpleLazyObject):
+    """由令牌声明构造的轻量用户
+
+    id、user_type、username、is_staff 等声明中的属性直接返回；
+    访问其他属性（包括 is_active）或作为外键赋值时才从数据库加载完整的 User。
+    用户被停用或权限变化时主体版本号递增，已签发的访问令牌在认证时被拒绝。
+    """
+
+    def __init__(self, token):
+        try:
+            user_id = token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken('令牌中没有用户标识')
+        super().__init__(lambda: get_user_model().objects.get(**{api_settings.USER_ID_FIELD: user_id}))
+        # 直接写入实例字典，属性查找不会触发加载
+        self.__dict__.update({
+            'id': user_id,
+            'pk': user_id,
+            'user_type': token[CLAIM_USER_TYPE],
+            'username': token.get(CLAIM_USERNAME, ''),
+            'is_staff': token.get(CLAIM_IS_STAFF, False),
+            'is_superuser': token.get(CLAIM_IS_SUPERUSER, False),
+            'is_authenticated': True,
+            'is_anonymous': False,
+        })
+
+    def __bool__(self):
+        return True
+
+
+class PrincipalJWTAuthentication(JWTAuthentication):
+    """JWT认证，根据令牌声明构造轻量用户并填充请求主体（见 fitness.principal）
+
+    缺少主体声明的旧令牌仍按 simplejwt 的方式查询 User。
+    """
+
+    def authenticate(self, request):
+        result = super().authenticate(request)
+        if result is None:
+            return None
+        user, token = result
+        principal = Principal.from_claims(user.id, token.payload)
+        if principal is not None:
+            request._fitness_principal = principal
+        return user, token
+
+    def get_validated_token(self, raw_token):
+        token = super().get_validated_token(raw_token)
+        refresh_jti = token.get(CLAIM_REFRESH_JTI)
+        if refresh_jti and revoked_tokens.is_revoked(refresh_jti):
+            raise InvalidToken('令牌已被吊销')
+        # 携带声明的令牌：主体版本不是最新时令牌中的学生ID、子女ID可能已过期，要求客户端刷新
+        if CLAIM_USER_TYPE in token:
+            user_id = token.get(api_settings.USER_ID_CLAIM)
+            version = get_principal_version(user_id)
+            # 查不到版本号（用户已删除）或令牌缺少版本号时一律拒绝
+            if version is None or token.get(CLAIM_PRINCIPAL_VERSION) != version:
+                raise InvalidToken('用户信息已变化，请刷新令牌')
+        return token
+
+    def get_user(self, validated_token):
+        if CLAIM_USER_TYPE not in validated_token:
+            return super().get_user(validated_token)
+        return ClaimsUser(validated_token)
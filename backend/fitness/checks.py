@@ -0,0 +1,24 @@
+"""部署检查（manage.py check --deploy）"""
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+
+LOCAL_CACHE_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def uses_local_cache():
+    """默认缓存是否只在当前进程内有效"""
+    return settings.CACHES['default']['BACKEND'] in LOCAL_CACHE_BACKENDS
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    if not uses_local_cache():
+        return []
+    return [Warning(
+        '默认缓存是进程内缓存，多个进程的通知未读数、AI档案摘要和用量计数互不同步',
+        hint='设置环境变量 REDIS_URL 使用 Redis 作为共享缓存',
+        id='fitness.W001',
+    )]
@@ -0,0 +1,172 @@
+"""测试成绩列式导出（Parquet / Arrow IPC）
+
+将 ``TestResult`` 与 ``Student``、``TestPlan`` 关联后的宽表按测试计划分文件写出，
+每个计划一个文件（``plan_<ID>.parquet`` 或 ``plan_<ID>.arrow``）。数据按主键分批
+从数据库读取并逐批写入 record batch，内存只保留一批数据。
+
+``load_results`` 以内存映射方式读回：Arrow IPC 文件零拷贝映射，Parquet 文件通过
+内存映射读取后解码。需要安装 pyarrow。
+"""
+import os
+import re
+from .export import iter_batches, DEFAULT_BATCH_SIZE
+
+# (列名, 查询字段, pyarrow 类型名)
+COLUMNS = [
+    ('result_id', 'id', 'int64'),
+    ('student_id', 'student__student_id', 'string'),
+    ('student_name', 'student__name', 'string'),
+    ('gender', 'student__gender', 'string'),
+    ('class_name', 'student__class_name', 'string'),
+    ('test_plan_id', 'test_plan_id', 'int64'),
+    ('test_plan_title', 'test_plan__title', 'string'),
+    ('plan_type', 'test_plan__plan_type', 'string'),
+    ('test_date', 'test_date', 'timestamp'),
+    ('height', 'height', 'float64'),
+    ('weight', 'weight', 'float64'),
+    ('bmi', 'bmi', 'float64'),
+    ('vital_capacity', 'vital_capacity', 'int32'),
+    ('run_50m', 'run_50m', 'float64'),
+    ('sit_and_reach', 'sit_and_reach', 'int32'),
+    ('standing_jump', 'standing_jump', 'int32'),
+    ('run_800m', 'run_800m', 'int32'),
+    ('total_score', 'total_score', 'int32'),
+    ('is_makeup', 'is_makeup', 'bool'),
+]
+
+FORMATS = {'parquet': '.parquet', 'arrow': '.arrow'}
+
+_PLAN_FILE_RE = re.compile(r'^plan_(\d+)\.(parquet|arrow)$')
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        raise ValueError('列式导出需要安装 pyarrow')
+    return pyarrow
+
+
+def result_schema():
+    pa = _pyarrow()
+    types = {
+        'int64': pa.int64(), 'int32': pa.int32(), 'float64': pa.float64(),
+        'string': pa.string(), 'bool': pa.bool_(), 'timestamp': pa.timestamp('ms'),
+    }
+    return pa.schema([(name, types[type_name]) for name, _, type_name in COLUMNS])
+
+
+def _record_batch(schema, rows):
+    """将 values_list 元组列表按列转置为 RecordBatch"""
+    pa = _pyarrow()
+    columns = list(zip(*rows))
+    return pa.RecordBatch.from_arrays(
+        [pa.array(values, type=field.type) for values, field in zip(columns, schema)],
+        schema=schema,
+    )
+
+
+class _PlanWriter:
+    """单个测试计划文件的写入器"""
+
+    def __init__(self, path, schema, file_format):
+        pa = _pyarrow()
+        if file_format == 'parquet':
+            import pyarrow.parquet as pq
+            self._writer = pq.ParquetWriter(path, schema, compression='zstd')
+        else:
+            # 不压缩的 IPC 文件可以被零拷贝地内存映射
+            self._sink = pa.OSFile(path, 'wb')
+            self._writer = pa.ipc.new_file(self._sink, schema)
+        self.file_format = file_format
+
+    def write(self, batch):
+        self._writer.write_batch(batch)
+
+    def close(self):
+        self._writer.close()
+        if self.file_format == 'arrow':
+            self._sink.close()
+
+
+def export_columnar(queryset, output_dir, file_format='parquet', batch_size=DEFAULT_BATCH_SIZE):
+    """按测试计划分文件导出成绩
+
+    参数:
+        queryset: TestResult 查询集
+        output_dir: 输出目录，不存在时自动创建
+        file_format: 'parquet' 或 'arrow'
+        batch_size: 每批读取和写入的行数
+
+    返回:
+        {测试计划ID: 行数}
+    """
+    if file_format not in FORMATS:
+        raise ValueError(f'不支持的列式格式: {file_format}')
+    schema = result_schema()
+    os.makedirs(output_dir, exist_ok=True)
+
+    counts = {}
+    plan_ids = queryset.order_by('test_plan_id').values_list('test_plan_id', flat=True).distinct()
+    fields = [field for _, field, _ in COLUMNS]
+    for plan_id in list(plan_ids):
+        path = os.path.join(output_dir, f'plan_{plan_id}{FORMATS[file_format]}')
+        # 先写临时文件，完成后再替换，读取方不会看到写了一半的文件
+        writer = _PlanWriter(path + '.tmp', schema, file_format)
+        try:
+            count = 0
+            for rows in iter_batches(queryset.filter(test_plan_id=plan_id), fields, batch_size):
+                writer.write(_record_batch(schema, rows))
+                count += len(rows)
+        finally:
+            writer.close()
+        os.replace(path + '.tmp', path)
+        counts[plan_id] = count
+    return counts
+
+
+def load_results(path, plan_ids=None, columns=None, file_format=None):
+    """以内存映射方式读取 export_columnar 导出的成绩
+
+    参数:
+        path: 导出目录
+        plan_ids: 只读取指定测试计划，为空时读取全部
+        columns: 只读取指定列，为空时读取全部
+        file_format: 'parquet' 或 'arrow'，为空时按目录中的文件判断；
+            同一目录中两种格式都有时必须指定，否则同一计划的成绩会被重复读取
+
+    返回:
+        pyarrow.Table，可调用 ``to_pandas()`` 转为 DataFrame
+    """
+    pa = _pyarrow()
+    if file_format is not None and file_format not in FORMATS:
+        raise ValueError(f'不支持的列式格式: {file_format}')
+    matches = [match for match in map(_PLAN_FILE_RE.match, sorted(os.listdir(path))) if match is not None]
+    if file_format is None:
+        formats = {match.group(2) for match in matches}
+        if len(formats) > 1:
+            raise ValueError(f'{path} 中同时有 parquet 和 arrow 文件，请指定 file_format')
+    else:
+        matches = [match for match in matches if match.group(2) == file_format]
+
+    tables = []
+    for match in matches:
+        filename = match.group(0)
+        if plan_ids is not None and int(match.group(1)) not in plan_ids:
+            continue
+        file_path = os.path.join(path, filename)
+        if match.group(2) == 'parquet':
+            import pyarrow.parquet as pq
+            table = pq.read_table(file_path, columns=columns, memory_map=True)
+        else:
+            table = pa.ipc.open_file(pa.memory_map(file_path, 'r')).read_all()
+            if columns is not None:
+                table = table.select(columns)
+        tables.append(table)
+
+    if not tables:
+        schema = result_schema()
+        if columns is not None:
+            schema = pa.schema([schema.field(name) for name in columns])
+        return schema.empty_table()
+    return pa.concat_tables(tables)
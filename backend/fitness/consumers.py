@@ -0,0 +1,85 @@
+import json
+from urllib.parse import parse_qs
+from channels.generic.websocket import AsyncWebsocketConsumer
+from channels.db import database_sync_to_async
+from .models import User, Student
+
+
+class NewsConsumer(AsyncWebsocketConsumer):
+    """新闻、审核结果等实时推送的WebSocket消费者"""
+
+    async def connect(self):
+        # 获取Token并验证用户（请求头或查询参数 ?token=）
+        token = self.get_token()
+        self.user = await self.get_user_from_token(token) if token else None
+
+        if not self.user:
+            await self.close()
+            return
+
+        # 所有用户加入通用新闻组
+        self.groups_joined = ['news_general']
+
+        # 管理员和学生用户加入特定组
+        if self.user.user_type == 'admin':
+            self.groups_joined.append('news_admin')
+        elif self.user.user_type == 'student':
+            student = await self.get_student_profile(self.user)
+            if student:
+                self.student_id = student.id
+                self.groups_joined.append(f'news_student_{self.student_id}')
+
+        for group in self.groups_joined:
+            await self.channel_layer.group_add(group, self.channel_name)
+
+        await self.accept()
+
+    async def disconnect(self, close_code):
+        # 离开所有已加入的组
+        for group in getattr(self, 'groups_joined', []):
+            await self.channel_layer.group_discard(group, self.channel_name)
+
+    async def receive(self, text_data):
+        # 客户端通常不需要向服务器发送消息
+        pass
+
+    async def news_message(self, event):
+        """推送新闻消息"""
+        await self.send(text_data=json.dumps({
+            'type': 'news',
+            'message': event['message']
+        }))
+
+    async def moderation_message(self, event):
+        """推送一批评论审核结果"""
+        await self.send(text_data=json.dumps({
+            'type': 'moderation',
+            'message': event['message']
+        }))
+
+    def get_token(self):
+        """从Authorization请求头或查询参数中获取令牌"""
+        headers = dict(self.scope.get('headers', []))
+        auth_header = headers.get(b'authorization', b'').decode('utf-8')
+        if auth_header.startswith('Bearer '):
+            return auth_header.split(' ', 1)[1]
+        query = parse_qs(self.scope.get('query_string', b'').decode('utf-8'))
+        return query.get('token', [None])[0]
+
+    @database_sync_to_async
+    def get_user_from_token(self, token):
+        """从令牌获取用户"""
+        try:
+            from rest_framework_simplejwt.tokens import AccessToken
+            token_obj = AccessToken(token)
+            return User.objects.get(id=token_obj.payload.get('user_id'))
+        except Exception:
+            return None
+
+    @database_sync_to_async
+    def get_student_profile(self, user):
+        """获取用户关联的学生档案"""
+        try:
+            return Student.objects.get(user=user)
+        except Student.DoesNotExist:
+            return None
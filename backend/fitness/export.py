@@ -0,0 +1,149 @@
+"""测试成绩导出
+
+按主键分批读取 ``values_list`` 元组（不实例化模型），逐行计算各单项及总体是否及格，
+以生成器的形式输出 CSV 或 XLSX，内存占用与导出行数无关。
+"""
+import csv
+import tempfile
+from django.utils import timezone
+from .models import PhysicalStandard
+
+DEFAULT_BATCH_SIZE = 2000
+
+# (表头, 查询字段)
+EXPORT_FIELDS = [
+    ('学号', 'student__student_id'),
+    ('姓名', 'student__name'),
+    ('性别', 'student__gender'),
+    ('班级', 'student__class_name'),
+    ('测试计划', 'test_plan__title'),
+    ('测试时间', 'test_date'),
+    ('身高(cm)', 'height'),
+    ('体重(kg)', 'weight'),
+    ('BMI指数', 'bmi'),
+    ('肺活量(ml)', 'vital_capacity'),
+    ('50米跑(秒)', 'run_50m'),
+    ('坐位体前屈(cm)', 'sit_and_reach'),
+    ('立定跳远(cm)', 'standing_jump'),
+    ('800米跑(秒)', 'run_800m'),
+    ('总分', 'total_score'),
+    ('是否补测', 'is_makeup'),
+]
+
+# 与 PhysicalStandard.check_items 的参数顺序一致
+ITEM_FIELDS = ['vital_capacity', 'run_50m', 'sit_and_reach', 'standing_jump', 'run_800m']
+
+PASS_HEADERS = ['肺活量及格', '50米跑及格', '坐位体前屈及格', '立定跳远及格', '800米跑及格', '是否及格']
+
+HEADERS = [header for header, _ in EXPORT_FIELDS] + PASS_HEADERS
+
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+
+def filter_results(queryset, plan=None, class_name=None, date_from=None, date_to=None):
+    """按测试计划、班级和测试日期范围过滤成绩"""
+    if plan:
+        queryset = queryset.filter(test_plan_id=plan)
+    if class_name:
+        queryset = queryset.filter(student__class_name=class_name)
+    if date_from:
+        queryset = queryset.filter(test_date__date__gte=date_from)
+    if date_to:
+        queryset = queryset.filter(test_date__date__lte=date_to)
+    return queryset
+
+
+def iter_rows(queryset, batch_size=DEFAULT_BATCH_SIZE):
+    """按主键分批读取成绩，逐行生成导出数据（不含表头）
+
+    MySQL 驱动会把整个结果集缓存在客户端，``iterator()`` 并不能限制内存，
+    因此按主键游标分批查询，每批只保留 batch_size 行。
+    """
+    standards = {standard.gender: standard for standard in PhysicalStandard.objects.all()}
+    fields = ['id'] + [field for _, field in EXPORT_FIELDS]
+    gender_index = fields.index('student__gender')
+    score_index = fields.index('total_score')
+    item_indexes = [fields.index(field) for field in ITEM_FIELDS]
+
+    for batch in iter_batches(queryset, fields, batch_size):
+        for row in batch:
+            standard = standards.get(row[gender_index])
+            if standard is None:
+                # 找不到对应性别的标准时按不及格处理，与 TestResult.passes_standard 一致
+                items = (False,) * len(item_indexes)
+            else:
+                items = standard.check_items(*(row[index] for index in item_indexes))
+            passed = row[score_index] >= 60 and all(items)
+            yield list(row[1:]) + list(items) + [passed]
+
+
+def iter_batches(queryset, fields, batch_size=DEFAULT_BATCH_SIZE):
+    """按主键游标分批查询 values_list 元组，fields 的第一个字段必须是 'id'"""
+    queryset = queryset.order_by('id').values_list(*fields)
+    last_id = 0
+    while True:
+        batch = list(queryset.filter(id__gt=last_id)[:batch_size])
+        if not batch:
+            return
+        yield batch
+        last_id = batch[-1][0]
+
+
+class _Echo:
+    """csv.writer 的伪文件对象，write 直接返回写入的内容"""
+
+    def write(self, value):
+        return value
+
+
+def _csv_value(value):
+    if isinstance(value, bool):
+        return '是' if value else '否'
+    if hasattr(value, 'isoformat'):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    return value
+
+
+def stream_csv(rows):
+    """生成 CSV 文本块，首块带 BOM 以便 Excel 正确识别 UTF-8"""
+    writer = csv.writer(_Echo())
+    yield '\ufeff' + writer.writerow(HEADERS)
+    for row in rows:
+        yield writer.writerow([_csv_value(value) for value in row])
+
+
+def write_xlsx(rows, output):
+    """以 openpyxl 只写模式写入 XLSX
+
+    只写模式逐行写入临时文件，不在内存中保留单元格；XLSX 是 zip 格式，
+    需要全部写完后才能输出，调用方应传入磁盘上的文件对象。
+    """
+    try:
+        from openpyxl import Workbook
+    except ImportError:
+        raise ValueError('导出XLSX需要安装 openpyxl')
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('测试成绩')
+    sheet.append(HEADERS)
+    for row in rows:
+        # openpyxl 不支持带时区的时间，转换为本地时间
+        sheet.append([
+            timezone.localtime(value).replace(tzinfo=None) if getattr(value, 'tzinfo', None) else value
+            for value in row
+        ])
+    workbook.save(output)
+
+
+def xlsx_tempfile(rows):
+    """将 XLSX 写入临时文件并返回已定位到开头的文件对象"""
+    output = tempfile.TemporaryFile()
+    try:
+        write_xlsx(rows, output)
+    except Exception:
+        output.close()
+        raise
+    output.seek(0)
+    return output
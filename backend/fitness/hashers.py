@@ -0,0 +1,42 @@
+"""按 settings.FITNESS_PASSWORD_PROFILE 配置代价参数的密码哈希器
+
+参数调整后，旧参数生成的哈希会在用户下次登录时自动重新计算（见 must_update）。
+"""
+from django.conf import settings
+from django.contrib.auth.hashers import Argon2PasswordHasher, ScryptPasswordHasher
+
+
+def _profile(algorithm):
+    return getattr(settings, 'FITNESS_PASSWORD_PROFILE', {}).get(algorithm, {})
+
+
+class ProfileScryptPasswordHasher(ScryptPasswordHasher):
+    """scrypt 哈希器，代价参数取自 FITNESS_PASSWORD_PROFILE['scrypt']"""
+
+    @property
+    def work_factor(self):
+        return _profile('scrypt').get('work_factor', ScryptPasswordHasher.work_factor)
+
+    @property
+    def block_size(self):
+        return _profile('scrypt').get('block_size', ScryptPasswordHasher.block_size)
+
+    @property
+    def parallelism(self):
+        return _profile('scrypt').get('parallelism', ScryptPasswordHasher.parallelism)
+
+
+class ProfileArgon2PasswordHasher(Argon2PasswordHasher):
+    """Argon2 哈希器（需要 argon2-cffi），代价参数取自 FITNESS_PASSWORD_PROFILE['argon2']"""
+
+    @property
+    def time_cost(self):
+        return _profile('argon2').get('time_cost', Argon2PasswordHasher.time_cost)
+
+    @property
+    def memory_cost(self):
+        return _profile('argon2').get('memory_cost', Argon2PasswordHasher.memory_cost)
+
+    @property
+    def parallelism(self):
+        return _profile('argon2').get('parallelism', Argon2PasswordHasher.parallelism)
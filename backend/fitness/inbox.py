@@ -0,0 +1,101 @@
+"""补考通知收件箱
+
+未读数按用户缓存，通知的创建和标记已读会同步调整缓存中的计数，
+客户端轮询角标时只需读取一个缓存整数。计数用 incr/decr 调整，多进程部署时缓存必须是
+共享的（settings.REDIS_URL），否则各进程的计数互不同步。
+"""
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count
+
+# 缓存过期后会重新统计一次，避免计数长期偏差
+UNREAD_CACHE_TIMEOUT = 300
+
+# 管理员可以查看所有通知，共用一个计数
+ALL_UNREAD_KEY = 'inbox:unread:all'
+
+
+def unread_cache_key(user):
+    """获取用户未读数的缓存键"""
+    if user.user_type == 'admin':
+        return ALL_UNREAD_KEY
+    return f'inbox:unread:user:{user.id}'
+
+
+def _recipient_keys(user_id, parent_id):
+    """一条通知影响的所有缓存键：学生本人、家长和管理员"""
+    keys = [ALL_UNREAD_KEY, f'inbox:unread:user:{user_id}']
+    if parent_id:
+        keys.append(f'inbox:unread:user:{parent_id}')
+    return keys
+
+
+def _adjust(keys, delta):
+    """调整已缓存的计数；未缓存的键会在下次读取时重新统计"""
+    for key in keys:
+        try:
+            if delta > 0:
+                cache.incr(key, delta)
+            else:
+                cache.decr(key, -delta)
+        except ValueError:
+            pass
+
+
+def get_unread_count(user, queryset):
+    """读取用户的未读通知数
+
+    参数:
+        user: 当前用户
+        queryset: 该用户可见的通知查询集，仅在缓存未命中时用于统计
+    """
+    key = unread_cache_key(user)
+    count = cache.get(key)
+    # 并发调整可能导致计数为负，此时重新统计
+    if count is None or count < 0:
+        count = queryset.filter(is_read=False).count()
+        cache.set(key, count, UNREAD_CACHE_TIMEOUT)
+    return count
+
+
+def notification_created(notification):
+    """新通知创建后，在事务提交时增加相关用户的未读数"""
+    student = notification.student
+    keys = _recipient_keys(student.user_id, student.parent_id)
+    transaction.on_commit(lambda: _adjust(keys, 1))
+
+
+def notifications_bulk_created(count):
+    """bulk_create 批量创建的通知不经过 notification_created，事务提交时增加管理员的未读数
+
+    只用于新建学生的通知：这些学生及其家长的计数尚未缓存，下次读取时会重新统计。
+    """
+    transaction.on_commit(lambda: _adjust([ALL_UNREAD_KEY], count))
+
+
+def mark_read(queryset):
+    """将查询集中的未读通知标记为已读
+
+    先按收件人分组统计未读数，再执行一条批量 UPDATE，并相应减少缓存计数。
+
+    返回:
+        被标记为已读的通知数量
+    """
+    with transaction.atomic():
+        unread = queryset.filter(is_read=False)
+        groups = list(
+            unread.order_by()
+            .values('student__user_id', 'student__parent_id')
+            .annotate(n=Count('id'))
+        )
+        if not groups:
+            return 0
+        updated = unread.update(is_read=True)
+
+        def adjust_cache():
+            for group in groups:
+                keys = _recipient_keys(group['student__user_id'], group['student__parent_id'])
+                _adjust(keys, -group['n'])
+
+        transaction.on_commit(adjust_cache)
+    return updated
@@ -0,0 +1,91 @@
+"""登录认证
+
+``HashLimitedModelBackend`` 是项目的认证后端（见 ``AUTHENTICATION_BACKENDS``），登录接口通过
+``django.contrib.auth.authenticate`` 调用它，登录失败时照常发送 ``user_login_failed`` 信号。
+
+密码哈希在请求线程中计算，``run_hash`` 只是一个并发限制器：同时计算的哈希不超过
+``FITNESS_LOGIN_HASH_WORKERS`` 个，避免集中登录时 scrypt/argon2 的计算和内存占满 CPU；
+等待中的请求也有上限，超出容量或等待超时的请求快速失败，而不是占满所有工作进程。
+校验通过且哈希参数过时时，会用当前首选的哈希配置透明地重新计算并保存。
+"""
+import os
+import threading
+import time
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.hashers import check_password, make_password
+
+
+class LoginBusy(Exception):
+    """同时计算哈希和等待的登录请求过多"""
+
+
+_workers = None
+_slots = None
+_init_lock = threading.Lock()
+
+
+def _limits():
+    global _workers, _slots
+    if _workers is None:
+        with _init_lock:
+            if _workers is None:
+                workers = getattr(settings, 'FITNESS_LOGIN_HASH_WORKERS', None) or os.cpu_count() or 2
+                queue_size = getattr(settings, 'FITNESS_LOGIN_QUEUE_SIZE', workers * 4)
+                _slots = threading.BoundedSemaphore(workers + queue_size)
+                _workers = threading.BoundedSemaphore(workers)
+    return _workers, _slots
+
+
+def run_hash(func, *args):
+    """在并发限制下于当前线程执行 func，等待超时或等待的请求过多时抛出 LoginBusy"""
+    workers, slots = _limits()
+    timeout = getattr(settings, 'FITNESS_LOGIN_QUEUE_TIMEOUT', 5)
+    deadline = time.monotonic() + timeout
+    if not slots.acquire(blocking=False):
+        raise LoginBusy('登录请求过多，请稍后再试')
+    try:
+        if not workers.acquire(timeout=max(deadline - time.monotonic(), 0)):
+            raise LoginBusy('登录请求过多，请稍后再试')
+        try:
+            return func(*args)
+        finally:
+            workers.release()
+    finally:
+        slots.release()
+
+
+def _verify(raw_password, encoded):
+    """返回 (密码是否正确, 是否需要升级哈希)，只做计算，不访问数据库"""
+    needs_update = []
+    is_correct = check_password(raw_password, encoded, setter=lambda _: needs_update.append(True))
+    return is_correct, bool(needs_update)
+
+
+class HashLimitedModelBackend(ModelBackend):
+    """与 ModelBackend 相同的用户名密码认证，密码哈希通过 ``run_hash`` 限制并发
+
+    与 ModelBackend 相同：用户不存在时也计算一次哈希，避免通过响应时间判断用户是否存在。
+    """
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        UserModel = get_user_model()
+        if username is None:
+            username = kwargs.get(UserModel.USERNAME_FIELD)
+        if not username or not password:
+            return None
+        try:
+            user = UserModel._default_manager.get_by_natural_key(username)
+        except UserModel.DoesNotExist:
+            run_hash(make_password, password)
+            return None
+
+        is_correct, needs_update = run_hash(_verify, password, user.password)
+        if not is_correct or not self.user_can_authenticate(user):
+            return None
+
+        if needs_update:
+            user.password = run_hash(make_password, password)
+            user.save(update_fields=['password'])
+        return user
@@ -0,0 +1,278 @@
+import contextlib
+import io
+import json
+import os
+import time
+import tracemalloc
+from datetime import datetime
+from unittest import mock
+from asgiref.sync import async_to_sync
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from ai_chat import usage, urls as ai_chat_urls
+from ai_chat.models import Conversation, Message
+from ai_chat.stub_server import StubLLMServer
+from fitness import urls as fitness_urls
+from fitness.models import (User, Student, PhysicalStandard, TestResult, HealthReport, SportsNews, NewsComment,
+                            Comment, MakeupNotification)
+from fitness.principal import token_for_user
+
+ROLES = ('admin', 'student', 'parent')
+
+# 路由器和挂载的路径前缀，所有角色都请求其中全部的 GET 路由
+ROUTERS = [('/api/', fitness_urls.router), ('/api/ai/', ai_chat_urls.router)]
+
+# 路由器之外或非 GET 的接口：(角色, 方法, 路径模板, 请求体)。其他写接口会修改基准数据，不做测量
+EXTRA_ENDPOINTS = [
+    ('student', 'post', '/api/ai/conversations/{conversations}/send_message/',
+     {'message': '怎样提高立定跳远成绩？', 'service_type': 'deepseek'}),
+    ('student', 'post', '/api/ai/conversations/{conversations}/send_message_stream/',
+     {'message': '怎样提高立定跳远成绩？', 'service_type': 'deepseek'}),
+    ('student', 'get', '/api/ai/conversations/{conversations}/messages/{message}/stream/', None),
+]
+
+
+def router_get_paths():
+    """从路由器生成全部 GET 路由的路径模板，详情路由的主键用 {路由前缀} 占位"""
+    paths = []
+    for api_prefix, router in ROUTERS:
+        for prefix, viewset, _ in router.registry:
+            list_path = f'{api_prefix}{prefix}/'
+            detail_path = f'{list_path}{{{prefix}}}/'
+            if hasattr(viewset, 'list'):
+                paths.append(list_path)
+            if hasattr(viewset, 'retrieve'):
+                paths.append(detail_path)
+            for action in viewset.get_extra_actions():
+                if 'get' in action.mapping:
+                    paths.append(f'{detail_path if action.detail else list_path}{action.url_path}/')
+    return paths
+
+
+def benchmark_endpoints():
+    """(角色, 方法, 路径模板, 请求体) 列表"""
+    paths = router_get_paths()
+    return [(role, 'get', path, None) for role in ROLES for path in paths] + EXTRA_ENDPOINTS
+
+
+async def consume(content):
+    async for _ in content:
+        pass
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+class Command(BaseCommand):
+    help = ('接口基准测试：生成规模数据，按角色请求各路由接口（AI 接口使用本地模拟大模型服务），'
+            '统计 p50/p95/p99 延迟、查询数和内存峰值，输出 JSON 报告并与基线比较（数据在结束后回滚）')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--students', type=int, default=1000, help='学生数量')
+        parser.add_argument('--plans', type=int, default=4, help='测试计划数量')
+        parser.add_argument('--messages', type=int, default=40, help='基准对话中的历史消息数')
+        parser.add_argument('--seed', type=int, default=42, help='数据生成的随机种子')
+        parser.add_argument('--repeat', type=int, default=30, help='每个接口的请求次数')
+        parser.add_argument('--llm-chunks', type=int, default=20, help='模拟大模型流式响应的块数')
+        parser.add_argument('--llm-delay', type=float, default=0.0, help='模拟大模型每块的延迟（秒）')
+        parser.add_argument('--output', default='benchmark_report.json', help='报告输出路径')
+        parser.add_argument('--baseline', help='基线报告路径，指定时与基线比较，出现退化时返回非零状态')
+        parser.add_argument('--save-baseline', action='store_true', help='将本次报告保存为基线（覆盖 --baseline）')
+        parser.add_argument('--tolerance', type=float, default=0.2, help='延迟和内存允许的退化比例')
+
+    def handle(self, *args, **options):
+        with StubLLMServer(chunks=options['llm_chunks'], chunk_delay=options['llm_delay']) as llm:
+            env = {
+                'DEEPSEEK_BASE_URL': llm.base_url,
+                'DEEPSEEK_API_KEY': 'benchmark',
+                'OLLAMA_BASE_URL': llm.base_url,
+            }
+            with mock.patch.dict(os.environ, env), transaction.atomic():
+                context = self.seed(options)
+                results = self.run(context, options)
+                # 基准数据不保留，AI用量在回滚前写入，不会留到进程退出时写入已回滚的用户
+                usage.flush()
+                transaction.set_rollback(True)
+
+        report = {
+            'generated_at': datetime.now().isoformat(timespec='seconds'),
+            'params': {key: options[key] for key in ('students', 'plans', 'messages', 'seed', 'repeat',
+                                                     'llm_chunks', 'llm_delay')},
+            'results': results,
+        }
+        with open(options['output'], 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        self.stdout.write(f'报告已写入 {options["output"]}')
+
+        if options['baseline']:
+            if options['save_baseline']:
+                with open(options['baseline'], 'w', encoding='utf-8') as f:
+                    json.dump(report, f, ensure_ascii=False, indent=2)
+                self.stdout.write(f'基线已保存到 {options["baseline"]}')
+            else:
+                self.compare(report, options['baseline'], options['tolerance'])
+
+    def seed(self, options):
+        prefix = f'api{int(time.time())}'
+        call_command('generate_scale_data', students=options['students'], plans=options['plans'],
+                     seed=options['seed'], prefix=prefix, stdout=io.StringIO())
+        admin = User.objects.create(username=f'{prefix}-admin', user_type='admin', is_staff=True)
+        student = Student.objects.select_related('user').filter(student_id__startswith=f'{prefix}-') \
+            .exclude(parent=None).order_by('id').first()
+        parent = student.parent
+
+        # 补充成绩报告、评论、新闻和对话等生成器不覆盖的数据；第一条成绩属于基准学生，
+        # 详情路由请求的都是基准学生（或其家长能看到）的数据
+        own_result = TestResult.objects.filter(student=student).order_by('id').first()
+        results = [own_result] + list(TestResult.objects.filter(student__student_id__startswith=f'{prefix}-')
+                                      .exclude(id=own_result.id).order_by('id')[:options['students'] - 1])
+        HealthReport.objects.bulk_create([
+            HealthReport(test_result=result, overall_assessment='良好', health_suggestions='保持锻炼')
+            for result in results
+        ], batch_size=1000)
+        Comment.objects.bulk_create([
+            Comment(test_result=result, student_id=result.student_id, content='继续努力', is_approved=i % 2 == 0)
+            for i, result in enumerate(results[:200])
+        ])
+        SportsNews.objects.bulk_create([
+            SportsNews(title=f'{prefix}-新闻{i}', content='体育新闻内容' * 50, status='published')
+            for i in range(50)
+        ])
+        news = list(SportsNews.objects.filter(title__startswith=f'{prefix}-'))
+        NewsComment.objects.bulk_create([
+            NewsComment(news=news[i % len(news)], student_id=results[i].student_id, content='好文章',
+                        is_approved=i % 3 != 0)
+            for i in range(min(len(results), 500))
+        ])
+        SportsNews.refresh_comment_stats([item.id for item in news])
+
+        conversation = Conversation.objects.create(user=student.user, title='基准对话')
+        Conversation.objects.bulk_create([
+            Conversation(user=student.user, title=f'历史对话{i}') for i in range(20)
+        ])
+        Message.objects.bulk_create([
+            Message(conversation=conversation, role='user' if i % 2 == 0 else 'assistant', content='体测训练问题' * 20)
+            for i in range(options['messages'])
+        ])
+        Conversation.refresh_message_stats([conversation.id])
+        notification = MakeupNotification.objects.filter(student=student).first() or \
+            MakeupNotification.objects.create(student=student, test_plan_id=own_result.test_plan_id,
+                                              original_result=own_result)
+        return {
+            'users': {'admin': admin, 'student': student.user, 'parent': parent},
+            # 路由前缀 -> 详情路由请求的主键
+            'params': {
+                'users': student.user_id,
+                'students': student.id,
+                'physical-standards': PhysicalStandard.objects.filter(gender=student.gender).first().id,
+                'test-plans': own_result.test_plan_id,
+                'test-results': own_result.id,
+                'comments': Comment.objects.filter(test_result=own_result).first().id,
+                'health-reports': own_result.healthreport.id,
+                'news': news[0].id,
+                'news-comments': NewsComment.objects.filter(news=news[0], student=student).first().id,
+                'notifications': notification.id,
+                'conversations': conversation.id,
+                'message': Message.objects.filter(conversation=conversation, role='assistant').last().id,
+            },
+        }
+
+    def request(self, client, method, path, body):
+        # AI 服务会打印请求日志，基准测试时不输出
+        with contextlib.redirect_stdout(io.StringIO()):
+            if method == 'get':
+                response = client.get(path)
+            else:
+                response = client.post(path, body, format='json')
+            if response.streaming:
+                if response.is_async:
+                    # 异步视图的流式响应（如 send_message_stream）在同步测试客户端中需要在事件循环里读取
+                    async_to_sync(consume)(response.streaming_content)
+                else:
+                    b''.join(response.streaming_content)
+        return response
+
+    def run(self, context, options):
+        clients = {}
+        for role, user in context['users'].items():
+            client = APIClient(HTTP_HOST='localhost')
+            client.credentials(HTTP_AUTHORIZATION=f'Bearer {token_for_user(user).access_token}')
+            clients[role] = client
+
+        results = {}
+        for role, method, template, body in benchmark_endpoints():
+            key = f'{role} {method.upper()} {template}'
+            path = template.format(**context['params'])
+            client = clients[role]
+
+            # 预热一次，并单独测量内存峰值（tracemalloc 会拖慢请求，不计入延迟）
+            tracemalloc.start()
+            response = self.request(client, method, path, body)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            if response.status_code >= 400:
+                self.stderr.write(f'{key} 返回 {response.status_code}')
+                results[key] = {'status': response.status_code}
+                continue
+
+            timings = []
+            queries = []
+            errors = 0
+            for _ in range(options['repeat']):
+                with CaptureQueriesContext(connection) as captured:
+                    start = time.perf_counter()
+                    response = self.request(client, method, path, body)
+                    timings.append((time.perf_counter() - start) * 1000)
+                queries.append(len(captured.captured_queries))
+                errors += response.status_code >= 400
+            timings.sort()
+            results[key] = {
+                'status': response.status_code,
+                'p50_ms': round(percentile(timings, 0.50), 2),
+                'p95_ms': round(percentile(timings, 0.95), 2),
+                'p99_ms': round(percentile(timings, 0.99), 2),
+                'queries': max(queries),
+                'peak_kb': round(peak / 1024, 1),
+                'errors': errors,
+            }
+            result = results[key]
+            self.stdout.write(
+                f'{key:<70} p50={result["p50_ms"]:8.2f}ms  p95={result["p95_ms"]:8.2f}ms  '
+                f'p99={result["p99_ms"]:8.2f}ms  queries={result["queries"]:4d}  peak={result["peak_kb"]:9.1f}KB'
+                + (f'  errors={errors}' if errors else '')
+            )
+        return results
+
+    def compare(self, report, baseline_path, tolerance):
+        with open(baseline_path, encoding='utf-8') as f:
+            baseline = json.load(f)['results']
+
+        regressions = []
+        for key, result in report['results'].items():
+            base = baseline.get(key)
+            if base is None:
+                continue
+            # 状态码变化（包括预热请求就失败、没有延迟数据的接口）本身就是退化
+            if result['status'] != base['status']:
+                regressions.append(f'{key}: 状态码 {base["status"]} -> {result["status"]}')
+                continue
+            if 'p95_ms' not in result:
+                continue
+            if result['errors'] > base.get('errors', 0):
+                regressions.append(f'{key}: 错误数 {base.get("errors", 0)} -> {result["errors"]}')
+            if result['queries'] > base['queries']:
+                regressions.append(f'{key}: 查询数 {base["queries"]} -> {result["queries"]}')
+            if result['p95_ms'] > base['p95_ms'] * (1 + tolerance):
+                regressions.append(f'{key}: p95 {base["p95_ms"]}ms -> {result["p95_ms"]}ms')
+            if result['peak_kb'] > base['peak_kb'] * (1 + tolerance):
+                regressions.append(f'{key}: 内存峰值 {base["peak_kb"]}KB -> {result["peak_kb"]}KB')
+
+        if regressions:
+            for line in regressions:
+                self.stderr.write(line)
+            raise CommandError(f'与基线相比有 {len(regressions)} 项退化')
+        self.stdout.write(self.style.SUCCESS('与基线相比没有退化'))
@@ -0,0 +1,82 @@
+import os
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from rest_framework.test import APIClient
+from fitness.login import run_hash
+from fitness.models import User
+from django.contrib.auth.hashers import make_password
+
+
+class Command(BaseCommand):
+    help = '登录吞吐量基准测试：并发调用登录接口，输出每秒登录数和每核每秒登录数'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100, help='测试用户数量')
+        parser.add_argument('--logins', type=int, default=500, help='登录请求总数')
+        parser.add_argument('--concurrency', type=int, default=16, help='并发客户端数量')
+
+    def handle(self, *args, **options):
+        password = 'bench-password'
+        prefix = f'loginbench{int(time.time())}'
+        # 哈希使用当前首选配置，避免测试中触发哈希升级
+        encoded = run_hash(make_password, password)
+        User.objects.bulk_create([
+            User(username=f'{prefix}-{i}', password=encoded, user_type='student')
+            for i in range(options['users'])
+        ])
+        usernames = [f'{prefix}-{i}' for i in range(options['users'])]
+
+        try:
+            self.run(usernames, password, options)
+        finally:
+            User.objects.filter(username__startswith=f'{prefix}-').delete()
+
+    def run(self, usernames, password, options):
+        local = threading.local()
+        failures = []
+
+        def login(i):
+            client = getattr(local, 'client', None)
+            if client is None:
+                client = local.client = APIClient(HTTP_HOST='localhost')
+            start = time.perf_counter()
+            response = client.post('/api/auth/login/', {
+                'username': usernames[i % len(usernames)],
+                'password': password,
+            }, format='json')
+            elapsed = (time.perf_counter() - start) * 1000
+            if response.status_code != 200:
+                failures.append(response.status_code)
+            return elapsed
+
+        def close_connection(_):
+            connection.close()
+
+        concurrency = options['concurrency']
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            latencies = sorted(pool.map(login, range(options['logins'])))
+            # 关闭客户端线程各自打开的数据库连接
+            list(pool.map(close_connection, range(concurrency)))
+        duration = time.perf_counter() - started
+
+        workers = settings.FITNESS_LOGIN_HASH_WORKERS
+        cores = min(workers, os.cpu_count() or 1)
+        rate = len(latencies) / duration
+        self.stdout.write(f'哈希器: {settings.PASSWORD_HASHERS[0]}')
+        self.stdout.write(f'并发哈希数: {workers}  并发客户端: {concurrency}  CPU核数: {os.cpu_count()}')
+        self.stdout.write(
+            f'登录 {len(latencies)} 次，失败 {len(failures)} 次，耗时 {duration:.2f}s'
+        )
+        self.stdout.write(
+            f'p50={statistics.median(latencies):.1f}ms  '
+            f'p95={latencies[int(len(latencies) * 0.95) - 1]:.1f}ms'
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'{rate:.1f} 次登录/秒，{rate / cores:.1f} 次登录/秒/核'
+        ))
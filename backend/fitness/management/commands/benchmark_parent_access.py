@@ -0,0 +1,111 @@
+import statistics
+import time
+from datetime import timedelta
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+from fitness.models import User, Student, TestPlan, TestResult, HealthReport, MakeupNotification
+
+ENDPOINTS = [
+    '/api/test-results/',
+    '/api/notifications/',
+    '/api/notifications/unread_count/',
+    '/api/health-reports/',
+]
+
+
+class Command(BaseCommand):
+    help = '家长访问路径基准测试：构造多子女、多年成绩的家长并统计各接口耗时和查询数（数据在结束后回滚）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--parents', type=int, default=20, help='家长数量')
+        parser.add_argument('--children', type=int, default=5, help='每位家长的子女数量')
+        parser.add_argument('--years', type=int, default=6, help='每个学生的成绩年数')
+        parser.add_argument('--plans-per-year', type=int, default=2, help='每年的测试计划数量')
+        parser.add_argument('--repeat', type=int, default=20, help='每个接口的请求次数')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            parents = self.seed(options)
+            self.stdout.write(f'已生成 {len(parents)} 位家长，每位 {options["children"]} 个子女，'
+                              f'{options["years"]} 年成绩')
+            self.run(parents, options['repeat'])
+            # 基准数据不保留
+            transaction.set_rollback(True)
+
+    def seed(self, options):
+        password = make_password('benchmark')
+        prefix = f'bench{int(time.time())}'
+        now = timezone.now()
+
+        # MySQL 的 bulk_create 不回填主键，插入后按前缀重新查询
+        TestPlan.objects.bulk_create([
+            TestPlan(title=f'{prefix}-计划{i}', test_date=now - timedelta(days=180 * i),
+                     location='操场', description='基准测试')
+            for i in range(options['years'] * options['plans_per_year'])
+        ])
+        plans = list(TestPlan.objects.filter(title__startswith=f'{prefix}-'))
+
+        User.objects.bulk_create([
+            User(username=f'{prefix}-p{i:05d}', password=password, user_type='parent')
+            for i in range(options['parents'])
+        ])
+        parents = list(User.objects.filter(username__startswith=f'{prefix}-p').order_by('username'))
+        User.objects.bulk_create([
+            User(username=f'{prefix}-s{i:05d}-{j:03d}', password=password, user_type='student')
+            for i in range(options['parents']) for j in range(options['children'])
+        ])
+        child_users = User.objects.filter(username__startswith=f'{prefix}-s').order_by('username')
+        Student.objects.bulk_create([
+            Student(user=user, student_id=f'{prefix}-{index}', name=f'学生{index}',
+                    gender='M' if index % 2 else 'F', class_name=f'{index % 10 + 1}班',
+                    parent=parents[index // options['children']])
+            for index, user in enumerate(child_users)
+        ], batch_size=1000)
+        students = list(Student.objects.filter(student_id__startswith=f'{prefix}-'))
+
+        # bulk_create 不触发补考通知信号，通知单独生成
+        TestResult.objects.bulk_create([
+            TestResult(student=student, test_plan=plan, height=170, weight=60, bmi=20.8,
+                       vital_capacity=3500, run_50m=8.0, sit_and_reach=12, standing_jump=200,
+                       run_800m=230, total_score=55 + (student.id + plan.id) % 40)
+            for student in students for plan in plans
+        ], batch_size=1000)
+        results = list(TestResult.objects.filter(test_plan__in=plans))
+        HealthReport.objects.bulk_create([
+            HealthReport(test_result=result, overall_assessment='良好', health_suggestions='保持锻炼')
+            for result in results
+        ], batch_size=1000)
+        MakeupNotification.objects.bulk_create([
+            MakeupNotification(student_id=result.student_id, test_plan_id=result.test_plan_id,
+                               original_result=result)
+            for result in results if result.total_score < 60
+        ], batch_size=1000)
+        return parents
+
+    def run(self, parents, repeat):
+        client = APIClient(HTTP_HOST='localhost')
+        for endpoint in ENDPOINTS:
+            timings = []
+            queries = []
+            for i in range(repeat):
+                client.force_authenticate(parents[i % len(parents)])
+                with CaptureQueriesContext(connection) as captured:
+                    start = time.perf_counter()
+                    response = client.get(endpoint)
+                    timings.append((time.perf_counter() - start) * 1000)
+                if response.status_code != 200:
+                    self.stderr.write(f'{endpoint} 返回 {response.status_code}')
+                    break
+                queries.append(len(captured.captured_queries))
+            if not queries:
+                continue
+            timings.sort()
+            p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+            self.stdout.write(
+                f'{endpoint:<36} p50={statistics.median(timings):8.2f}ms  p95={p95:8.2f}ms  '
+                f'queries={max(queries)}'
+            )
@@ -0,0 +1,74 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+from fitness import columnar, export
+from fitness.models import TestResult
+
+
+class Command(BaseCommand):
+    help = '导出测试成绩为CSV、XLSX，或按测试计划分文件的 Parquet/Arrow（按批读取，内存占用与行数无关）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help='输出路径；csv/xlsx 为文件，parquet/arrow 为目录')
+        parser.add_argument('--format', dest='file_format', choices=['csv', 'xlsx', 'parquet', 'arrow'],
+                            help='导出格式，默认根据输出文件扩展名确定')
+        parser.add_argument('--plan', type=int, help='测试计划ID')
+        parser.add_argument('--class-name', help='班级')
+        parser.add_argument('--date-from', help='起始测试日期 YYYY-MM-DD')
+        parser.add_argument('--date-to', help='截止测试日期 YYYY-MM-DD')
+        parser.add_argument('--batch-size', type=int, default=export.DEFAULT_BATCH_SIZE, help='每批读取的行数')
+
+    def handle(self, *args, **options):
+        output = options['output']
+        file_format = options['file_format'] or output.rsplit('.', 1)[-1].lower()
+        if file_format not in export.CONTENT_TYPES and file_format not in columnar.FORMATS:
+            raise CommandError('请通过 --format 指定导出格式，或使用 .csv/.xlsx 扩展名')
+
+        dates = {}
+        for name in ('date_from', 'date_to'):
+            if options[name]:
+                try:
+                    dates[name] = parse_date(options[name])
+                except ValueError:
+                    dates[name] = None
+                if dates[name] is None:
+                    raise CommandError(f'日期格式错误: {options[name]}')
+        queryset = export.filter_results(
+            TestResult.objects.all(), plan=options['plan'], class_name=options['class_name'], **dates
+        )
+
+        start = time.perf_counter()
+        if file_format in columnar.FORMATS:
+            try:
+                counts = columnar.export_columnar(
+                    queryset, output, file_format=file_format, batch_size=options['batch_size']
+                )
+            except ValueError as e:
+                raise CommandError(str(e))
+            self.stdout.write(self.style.SUCCESS(
+                f'已导出 {sum(counts.values())} 条成绩（{len(counts)} 个测试计划）到 {output}，'
+                f'耗时 {time.perf_counter() - start:.1f}s'
+            ))
+            return
+
+        count = 0
+
+        def counted(rows):
+            nonlocal count
+            for row in rows:
+                count += 1
+                yield row
+
+        rows = counted(export.iter_rows(queryset, batch_size=options['batch_size']))
+        try:
+            if file_format == 'csv':
+                with open(output, 'w', encoding='utf-8', newline='') as f:
+                    f.writelines(export.stream_csv(rows))
+            else:
+                with open(output, 'wb') as f:
+                    export.write_xlsx(rows, f)
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(
+            f'已导出 {count} 条成绩到 {output}，耗时 {time.perf_counter() - start:.1f}s'
+        ))
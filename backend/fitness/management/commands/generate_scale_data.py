@@ -0,0 +1,267 @@
+import time
+from datetime import datetime, timedelta
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from ai_chat import digest
+from fitness import inbox
+from fitness.checks import uses_local_cache
+from fitness.models import User, Student, PhysicalStandard, TestPlan, TestResult, MakeupNotification
+
+# 默认体测标准，与 generate_test_data 一致
+DEFAULT_STANDARDS = {
+    'M': dict(bmi_min=18.5, bmi_max=24.9, vital_capacity_excellent=4000, run_50m_excellent=7.0,
+              sit_and_reach_excellent=20, standing_jump_excellent=230, run_800m_excellent=180,
+              vital_capacity_pass=3000, run_50m_pass=8.0, sit_and_reach_pass=10,
+              standing_jump_pass=200, run_800m_pass=200),
+    'F': dict(bmi_min=18.0, bmi_max=24.0, vital_capacity_excellent=3000, run_50m_excellent=8.0,
+              sit_and_reach_excellent=25, standing_jump_excellent=180, run_800m_excellent=210,
+              vital_capacity_pass=2500, run_50m_pass=9.0, sit_and_reach_pass=15,
+              standing_jump_pass=150, run_800m_pass=240),
+}
+
+# 测试项目 -> (及格标准字段, 优秀标准字段, 小数位数)
+ITEMS = {
+    'vital_capacity': ('vital_capacity_pass', 'vital_capacity_excellent', 0),
+    'run_50m': ('run_50m_pass', 'run_50m_excellent', 1),
+    'sit_and_reach': ('sit_and_reach_pass', 'sit_and_reach_excellent', 0),
+    'standing_jump': ('standing_jump_pass', 'standing_jump_excellent', 0),
+    'run_800m': ('run_800m_pass', 'run_800m_excellent', 0),
+}
+
+# 身高(cm)和BMI的均值、标准差
+BODY = {
+    'M': {'height': (172.0, 6.0), 'bmi': (21.5, 2.6)},
+    'F': {'height': (160.0, 5.5), 'bmi': (20.5, 2.3)},
+}
+
+SURNAMES = list('王李张刘陈杨黄赵吴周徐孙马朱胡郭何高林罗郑梁谢宋唐许韩冯邓曹彭曾肖田董袁潘于蒋蔡余杜叶程苏魏吕丁任沈')
+GIVEN_CHARS = list('伟芳娜秀英敏静丽强磊军洋勇艳杰娟涛明超秀兰霞平刚桂英华鹏飞宇浩然子轩梓涵欣怡思远嘉诚雨泽')
+
+# 学生能力在各项目间的相关程度，以及相邻两次测试之间的平均进步（以“及格到优秀”的距离为单位）
+ABILITY_WEIGHT = 0.7
+ITEM_MEAN = 0.9
+ITEM_SD = 0.6
+PROGRESS_PER_PLAN = 0.03
+
+
+class Command(BaseCommand):
+    help = '按规模参数快速生成可复现的压测数据（NumPy 向量化生成，bulk_create 分块写入，不触发逐行信号，结束时统一清除相关缓存）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--students', type=int, default=10000, help='学生数量')
+        parser.add_argument('--plans', type=int, default=4, help='测试计划数量，每个学生参加全部测试')
+        parser.add_argument('--children-per-parent', type=int, default=2, help='每位家长的子女数量，0 表示不生成家长')
+        parser.add_argument('--class-size', type=int, default=40, help='每个班级的人数')
+        parser.add_argument('--seed', type=int, default=42, help='随机种子，相同参数和种子生成相同的数据')
+        parser.add_argument('--chunk-size', type=int, default=5000, help='每次批量写入的行数')
+        parser.add_argument('--prefix', default='gen', help='用户名、学号和测试计划标题的前缀')
+
+    def handle(self, *args, **options):
+        try:
+            import numpy as np
+        except ImportError:
+            raise CommandError('生成压测数据需要安装 numpy')
+        self.np = np
+        self.rng = np.random.default_rng(options['seed'])
+        self.chunk_size = options['chunk_size']
+        prefix = options['prefix']
+        if User.objects.filter(username__startswith=f'{prefix}-').exists():
+            raise CommandError(f'已存在前缀为 {prefix} 的数据，请使用其他 --prefix')
+
+        started = time.perf_counter()
+        standards = self.ensure_standards()
+        students = self.create_students(prefix, options)
+        plans = self.create_plans(prefix, options['plans'])
+        total = failed = 0
+        for index, plan in enumerate(plans):
+            step = time.perf_counter()
+            created, failing = self.create_results(plan, index, students, standards)
+            total += created
+            failed += failing
+            self.stdout.write(f'{plan.title}: {created} 条成绩，{failing} 条不及格，{time.perf_counter() - step:.1f}s')
+        self.refresh_derived_state(students['ids'].tolist())
+
+        self.stdout.write(self.style.SUCCESS(
+            f'已生成 {len(students["ids"])} 名学生、{len(plans)} 个测试计划、{total} 条成绩'
+            f'（及格率 {1 - failed / max(total, 1):.1%}），耗时 {time.perf_counter() - started:.1f}s'
+        ))
+
+    def refresh_derived_state(self, student_ids):
+        """bulk_create 不触发信号，清除依赖成绩和通知的缓存
+
+        补考通知的未读数已在 create_results 中调整；这里清除新学生的AI档案摘要。
+        新闻、评论和体测标准的检索索引不受影响。
+        """
+        digest.invalidate(*student_ids)
+        # 缓存只在共享缓存后端（REDIS_URL）中对运行中的服务生效
+        if uses_local_cache():
+            self.stderr.write(self.style.WARNING(
+                '当前使用进程内缓存，运行中服务的未读数和AI档案摘要不会更新，请重启服务或等待缓存过期'
+            ))
+
+    def ensure_standards(self):
+        for gender, values in DEFAULT_STANDARDS.items():
+            if not PhysicalStandard.objects.filter(gender=gender).exists():
+                PhysicalStandard.objects.create(gender=gender, **values)
+        # 与 TestResult.is_passed 一致，每个性别取第一条标准
+        standards = {}
+        for standard in PhysicalStandard.objects.order_by('id'):
+            standards.setdefault(standard.gender, standard)
+        return standards
+
+    def bulk_create(self, model, objects):
+        model.objects.bulk_create(objects, batch_size=self.chunk_size)
+
+    def create_students(self, prefix, options):
+        np = self.np
+        count = options['students']
+        children = options['children_per_parent']
+        # 所有账号共用一个密码哈希，避免逐个计算哈希
+        password = make_password('student123')
+
+        genders = np.where(self.rng.random(count) < 0.5, 'M', 'F')
+        surnames = self.rng.choice(SURNAMES, count)
+        given = self.rng.choice(GIVEN_CHARS, (count, 2))
+        lengths = self.rng.integers(1, 3, count)
+        names = [surname + ''.join(chars[:length]) for surname, chars, length in zip(surnames, given, lengths)]
+
+        with transaction.atomic():
+            parent_ids = []
+            if children > 0:
+                parent_count = (count + children - 1) // children
+                self.bulk_create(User, [
+                    User(username=f'{prefix}-p{i:07d}', password=password, user_type='parent',
+                         phone=f'139{i:08d}')
+                    for i in range(parent_count)
+                ])
+                # MySQL 的 bulk_create 不回填主键，按用户名顺序重新查询
+                parent_ids = list(User.objects.filter(username__startswith=f'{prefix}-p')
+                                  .order_by('username').values_list('id', flat=True))
+
+            for start in range(0, count, self.chunk_size):
+                stop = min(start + self.chunk_size, count)
+                User.objects.bulk_create([
+                    User(username=f'{prefix}-s{i:07d}', password=password, user_type='student',
+                         first_name=names[i], phone=f'138{i:08d}')
+                    for i in range(start, stop)
+                ])
+            user_ids = list(User.objects.filter(username__startswith=f'{prefix}-s')
+                            .order_by('username').values_list('id', flat=True))
+
+            class_size = options['class_size']
+            for start in range(0, count, self.chunk_size):
+                stop = min(start + self.chunk_size, count)
+                Student.objects.bulk_create([
+                    Student(user_id=user_ids[i], student_id=f'{prefix}-{i:07d}', name=names[i],
+                            gender=genders[i], class_name=f'{prefix}-{i // class_size + 1}班',
+                            parent_id=parent_ids[i // children] if parent_ids else None)
+                    for i in range(start, stop)
+                ])
+            ids = list(Student.objects.filter(student_id__startswith=f'{prefix}-')
+                       .order_by('student_id').values_list('id', flat=True))
+
+        # 学生的综合能力决定各项目的相关性
+        ability = self.rng.standard_normal(count)
+        return {'ids': np.array(ids), 'genders': genders, 'ability': ability}
+
+    def create_plans(self, prefix, count):
+        # 每学期一次测试，日期固定，保证相同种子生成相同的数据
+        first = datetime(2021, 3, 1, 9, 0)
+        TestPlan.objects.bulk_create([
+            TestPlan(title=f'{prefix}-第{i + 1}次体测', test_date=first + timedelta(days=182 * i),
+                     location='体育场', description='压测数据', plan_type='regular')
+            for i in range(count)
+        ])
+        return list(TestPlan.objects.filter(title__startswith=f'{prefix}-第', plan_type='regular').order_by('test_date'))
+
+    def generate_scores(self, plan_index, students, standards):
+        """按性别向量化生成一次测试的全部成绩，返回 {字段: 数组}"""
+        np = self.np
+        rng = self.rng
+        count = len(students['ids'])
+        genders = students['genders']
+        columns = {name: np.zeros(count) for name in ['height', 'weight', 'bmi', *ITEMS]}
+        positions = np.zeros((len(ITEMS), count))
+
+        for gender, body in BODY.items():
+            mask = genders == gender
+            size = int(mask.sum())
+            if not size:
+                continue
+            height = rng.normal(*body['height'], size)
+            bmi = rng.normal(*body['bmi'], size).clip(14, 35)
+            columns['height'][mask] = height.round(1)
+            columns['bmi'][mask] = bmi.round(1)
+            columns['weight'][mask] = (bmi * (height / 100) ** 2).round(1)
+
+            standard = standards[gender]
+            for row, (item, (pass_field, excellent_field, digits)) in enumerate(ITEMS.items()):
+                # 以“及格到优秀”的距离为单位的位置：0 为及格线，1 为优秀线
+                noise = rng.standard_normal(size)
+                position = ITEM_MEAN + PROGRESS_PER_PLAN * plan_index + ITEM_SD * (
+                    ABILITY_WEIGHT * students['ability'][mask] + (1 - ABILITY_WEIGHT ** 2) ** 0.5 * noise
+                )
+                pass_value = getattr(standard, pass_field)
+                excellent_value = getattr(standard, excellent_field)
+                # 跑步项目优秀标准小于及格标准，同一公式对两个方向都成立
+                value = (pass_value + (excellent_value - pass_value) * position).round(digits)
+                columns[item][mask] = value
+                positions[row, mask] = (value - pass_value) / (excellent_value - pass_value)
+
+        # 单项得分：及格线 60 分、优秀线 100 分，总分为各项平均
+        columns['total_score'] = (60 + 40 * positions).clip(0, 100).mean(axis=0).round()
+        for item, (pass_field, excellent_field, digits) in ITEMS.items():
+            if digits == 0:
+                columns[item] = columns[item].astype(int)
+        columns['total_score'] = columns['total_score'].astype(int)
+        return columns
+
+    def failing_mask(self, columns, genders, standards):
+        """与 TestResult.passes_standard 相同的判断，向量化计算"""
+        failing = columns['total_score'] < 60
+        for gender, standard in standards.items():
+            mask = genders == gender
+            items = standard.check_items(*(columns[item][mask] for item in ITEMS))
+            passed = items[0] & items[1] & items[2] & items[3] & items[4]
+            failing[mask] |= ~passed
+        return failing
+
+    def create_results(self, plan, plan_index, students, standards):
+        np = self.np
+        columns = self.generate_scores(plan_index, students, standards)
+        failing = self.failing_mask(columns, students['genders'], standards)
+        values = {name: array.tolist() for name, array in columns.items()}
+        student_ids = students['ids'].tolist()
+        count = len(student_ids)
+
+        with transaction.atomic():
+            for start in range(0, count, self.chunk_size):
+                stop = min(start + self.chunk_size, count)
+                # bulk_create 不触发 post_save，补考通知在下面统一生成
+                TestResult.objects.bulk_create([
+                    TestResult(student_id=student_ids[i], test_plan_id=plan.id,
+                               **{name: values[name][i] for name in values})
+                    for i in range(start, stop)
+                ])
+            results = TestResult.objects.filter(test_plan=plan)
+            # test_date 是 auto_now_add，批量写入后统一改为测试计划的日期
+            results.update(test_date=plan.test_date)
+            result_ids = np.array(results.order_by('id').values_list('id', flat=True))
+
+            failing_indexes = np.flatnonzero(failing)
+            if len(failing_indexes):
+                # 信号会为每条不及格成绩单独创建补考计划，这里每个测试计划只创建一个
+                makeup_plan = TestPlan.objects.create(
+                    title=f'{plan.title}补考', test_date=plan.test_date + timedelta(days=14),
+                    location=plan.location, description=f'补考测试 - 原测试：{plan.title}',
+                    plan_type='makeup'
+                )
+                failing_ids = result_ids[failing_indexes].tolist()
+                failing_students = students['ids'][failing_indexes].tolist()
+                self.bulk_create(MakeupNotification, [
+                    MakeupNotification(student_id=student_id, test_plan_id=makeup_plan.id, original_result_id=result_id)
+                    for student_id, result_id in zip(failing_students, failing_ids)
+                ])
+                inbox.notifications_bulk_created(len(failing_ids))
+        return count, len(failing_indexes)
@@ -0,0 +1,65 @@
+import json
+import os
+import time
+from django.core.management.base import BaseCommand, CommandError
+from fitness.roster import RosterImporter, read_roster, DEFAULT_CHUNK_SIZE
+
+
+class Command(BaseCommand):
+    help = '从CSV/XLSX名册批量导入学生账号（按学号幂等更新）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='名册文件路径（.csv 或 .xlsx）')
+        parser.add_argument('--dry-run', action='store_true', help='只校验不保存，输出每行的错误')
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='每个事务处理的行数')
+        parser.add_argument('--workers', type=int, default=None, help='计算密码哈希的进程数，默认为CPU核数')
+        parser.add_argument('--initial-hash-cost', type=int, default=None,
+                            help='初始密码的哈希代价（scrypt 的 work factor 或 argon2 的 time_cost），首次登录时自动升级')
+        parser.add_argument('--report', help='将导入报告写入指定的JSON文件，导入失败时写入错误信息')
+        parser.add_argument('--delete-source', action='store_true', help='导入结束后删除名册文件（后台导入任务使用）')
+
+    def handle(self, *args, **options):
+        importer = RosterImporter(
+            dry_run=options['dry_run'],
+            chunk_size=options['chunk_size'],
+            hash_workers=options['workers'],
+            initial_hash_cost=options['initial_hash_cost'],
+        )
+        start = time.perf_counter()
+        try:
+            with open(options['path'], 'rb') as stream:
+                report = importer.run(read_roster(stream, options['path']))
+        except (OSError, ValueError) as e:
+            self.finish(options, {'error': str(e)})
+            raise CommandError(str(e))
+        except Exception as e:
+            # 后台任务也要留下报告，否则任务状态一直是进行中
+            self.finish(options, {'error': f'导入失败: {e}'})
+            raise
+        elapsed = time.perf_counter() - start
+
+        for error in report['errors'][:50]:
+            self.stderr.write(f'第 {error["row"]} 行: {error["error"]}')
+        if len(report['errors']) > 50:
+            self.stderr.write(f'... 共 {len(report["errors"])} 行错误')
+
+        self.finish(options, report)
+
+        prefix = '[试运行] ' if options['dry_run'] else ''
+        self.stdout.write(self.style.SUCCESS(
+            f'{prefix}新建 {report["created"]} 名学生，更新 {report["updated"]} 名学生，'
+            f'新建 {report["parents_created"]} 个家长账号，{len(report["errors"])} 行错误，耗时 {elapsed:.1f}s'
+        ))
+
+    def finish(self, options, report):
+        """写入报告并按需删除名册；报告先写入临时文件再改名，读取方不会看到写了一半的报告"""
+        if options['report']:
+            temp = f'{options["report"]}.tmp'
+            with open(temp, 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+            os.replace(temp, options['report'])
+        if options['delete_source']:
+            try:
+                os.remove(options['path'])
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from fitness.models import SportsNews
+
+
+class Command(BaseCommand):
+    help = '根据已审核评论重新计算新闻的评论数和最新评论预览'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--news-id', type=int, action='append', dest='news_ids',
+                            help='只修复指定的新闻，可重复传入')
+        parser.add_argument('--batch-size', type=int, default=500, help='每个事务处理的新闻数量')
+
+    def handle(self, *args, **options):
+        news_ids = options['news_ids'] or list(
+            SportsNews.objects.order_by('id').values_list('id', flat=True)
+        )
+        batch_size = options['batch_size']
+
+        updated = 0
+        for start in range(0, len(news_ids), batch_size):
+            with transaction.atomic():
+                updated += SportsNews.refresh_comment_stats(news_ids[start:start + batch_size])
+
+        self.stdout.write(self.style.SUCCESS(f'已修复 {updated} 条新闻的评论统计'))
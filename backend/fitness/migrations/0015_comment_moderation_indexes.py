@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fitness', '0014_testresult_height_testresult_weight'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['is_approved', 'created_at'], name='comment_approved_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='newscomment',
+            index=models.Index(fields=['is_approved', 'created_at'], name='news_comment_approved_idx'),
+        ),
+    ]
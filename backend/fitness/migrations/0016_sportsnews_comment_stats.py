@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fitness', '0015_comment_moderation_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sportsnews',
+            name='approved_comment_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='已审核评论数'),
+        ),
+        migrations.AddField(
+            model_name='sportsnews',
+            name='latest_comment_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='最新评论时间'),
+        ),
+        migrations.AddField(
+            model_name='sportsnews',
+            name='latest_comment_content',
+            field=models.CharField(blank=True, default='', max_length=200, verbose_name='最新评论预览'),
+        ),
+        migrations.AddField(
+            model_name='sportsnews',
+            name='latest_comment_student_name',
+            field=models.CharField(blank=True, default='', max_length=50, verbose_name='最新评论学生'),
+        ),
+    ]
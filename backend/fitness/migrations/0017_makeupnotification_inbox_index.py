@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fitness', '0016_sportsnews_comment_stats'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='makeupnotification',
+            index=models.Index(fields=['student', 'is_read', 'sent_at'], name='notification_inbox_idx'),
+        ),
+    ]
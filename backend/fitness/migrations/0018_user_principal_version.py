@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fitness', '0017_makeupnotification_inbox_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='principal_version',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='主体版本号'),
+        ),
+    ]
@@ -2,7 +2,9 @@ from django.db import models
 from django.contrib.auth.models import AbstractUser
 from django.core.validators import MinValueValidator, MaxValueValidator
 from datetime import timedelta
-from django.db.models.signals import post_save
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Left
+from django.db.models.signals import pre_save, post_save, post_delete
 from django.dispatch import receiver
 
 class User(AbstractUser):
@@ -14,6 +16,8 @@ class User(AbstractUser):
     
     user_type = models.CharField('用户类型', max_length=10, choices=USER_TYPE_CHOICES)
     phone = models.CharField('手机号码', max_length=15, blank=True)
+    # 学生档案、家长关系或账号状态变化时递增（见 fitness.principal.invalidate_principal）
+    principal_version = models.PositiveIntegerField('主体版本号', default=0, editable=False)
     
     class Meta:
         db_table = 'user'
@@ -69,6 +73,16 @@ class PhysicalStandard(models.Model):
     def __str__(self):
         return f'{self.get_gender_display()}生体测标准'
 
+    def check_items(self, vital_capacity, run_50m, sit_and_reach, standing_jump, run_800m):
+        """判断各单项是否达到及格标准，按参数顺序返回布尔值元组"""
+        return (
+            vital_capacity >= self.vital_capacity_pass,
+            run_50m <= self.run_50m_pass,  # 跑步项目时间越短越好
+            sit_and_reach >= self.sit_and_reach_pass,
+            standing_jump >= self.standing_jump_pass,
+            run_800m <= self.run_800m_pass,  # 跑步项目时间越短越好
+        )
+
 class TestPlan(models.Model):
     PLAN_TYPE_CHOICES = (
         ('regular', '常规测试'),
@@ -120,28 +134,23 @@ class TestResult(models.Model):
         try:
             # 获取对应性别的体测标准
             standard = PhysicalStandard.objects.get(gender=self.student.gender)
-            
-            # 检查每个项目是否达到及格标准
-            vital_capacity_passed = self.vital_capacity >= standard.vital_capacity_pass
-            run_50m_passed = self.run_50m <= standard.run_50m_pass  # 跑步项目时间越短越好
-            sit_and_reach_passed = self.sit_and_reach >= standard.sit_and_reach_pass
-            standing_jump_passed = self.standing_jump >= standard.standing_jump_pass
-            run_800m_passed = self.run_800m <= standard.run_800m_pass  # 跑步项目时间越短越好
-            
-            passed_items = [
-                vital_capacity_passed,
-                run_50m_passed,
-                sit_and_reach_passed,
-                standing_jump_passed,
-                run_800m_passed
-            ]
-            
-            # 总分及格线为60分，且所有单项均须达标
-            passed = self.total_score >= 60 and all(passed_items)
-            return passed
         except PhysicalStandard.DoesNotExist:
             # 找不到对应性别的标准时，默认返回不及格
             return False
+        return self.passes_standard(standard)
+
+    def passes_standard(self, standard):
+        """根据给定的体测标准判断是否及格，批量判断时可复用已加载的标准"""
+        if standard is None:
+            return False
+        
+        # 检查每个项目是否达到及格标准
+        passed_items = standard.check_items(
+            self.vital_capacity, self.run_50m, self.sit_and_reach, self.standing_jump, self.run_800m
+        )
+        
+        # 总分及格线为60分，且所有单项均须达标
+        return self.total_score >= 60 and all(passed_items)
 
 class Comment(models.Model):
     test_result = models.ForeignKey(TestResult, on_delete=models.CASCADE, verbose_name='测试成绩')
@@ -154,6 +163,10 @@ class Comment(models.Model):
         db_table = 'comment'
         verbose_name = '评论'
         verbose_name_plural = '评论管理'
+        indexes = [
+            # 审核队列按 (是否批准, 创建时间) 做游标分页
+            models.Index(fields=['is_approved', 'created_at'], name='comment_approved_created_idx'),
+        ]
 
     def __str__(self):
         return f'{self.student.name}的评论'
@@ -183,6 +196,10 @@ class MakeupNotification(models.Model):
         db_table = 'makeup_notification'
         verbose_name = '补考通知'
         verbose_name_plural = '补考通知管理'
+        indexes = [
+            # 收件箱：按学生查询未读通知及按发送时间增量同步
+            models.Index(fields=['student', 'is_read', 'sent_at'], name='notification_inbox_idx'),
+        ]
 
     def __str__(self):
         return f'{self.student.name}的{self.test_plan.title}补考通知'
@@ -204,6 +221,11 @@ class SportsNews(models.Model):
     views = models.PositiveIntegerField('浏览次数', default=0)
     keywords = models.CharField('关键词', max_length=500, null=True, blank=True, help_text='用逗号分隔的关键词，用于搜索')
     is_featured = models.BooleanField('是否置顶', default=False)
+    # 冗余的评论统计，由 refresh_comment_stats 维护，列表页无需关联查询评论表
+    approved_comment_count = models.PositiveIntegerField('已审核评论数', default=0)
+    latest_comment_content = models.CharField('最新评论预览', max_length=200, blank=True, default='')
+    latest_comment_student_name = models.CharField('最新评论学生', max_length=50, blank=True, default='')
+    latest_comment_at = models.DateTimeField('最新评论时间', null=True, blank=True)
     
     class Meta:
         db_table = 'sports_news'
@@ -214,6 +236,27 @@ class SportsNews(models.Model):
     def __str__(self):
         return self.title
 
+    @classmethod
+    def refresh_comment_stats(cls, news_ids):
+        """根据已审核评论重新计算新闻的评论数和最新评论预览
+
+        对所有传入的新闻只执行一条带子查询的 UPDATE，应在评论写入所在的事务中调用。
+        """
+        news_ids = set(news_ids)
+        if not news_ids:
+            return 0
+        approved = NewsComment.objects.filter(news=OuterRef('pk'), is_approved=True)
+        latest = approved.order_by('-created_at', '-id')
+        count = approved.order_by().values('news').annotate(c=Count('id')).values('c')
+        return cls.objects.filter(id__in=news_ids).update(
+            approved_comment_count=Coalesce(Subquery(count), 0),
+            latest_comment_content=Coalesce(
+                Subquery(latest.annotate(preview=Left('content', 200)).values('preview')[:1]), Value('')
+            ),
+            latest_comment_student_name=Coalesce(Subquery(latest.values('student__name')[:1]), Value('')),
+            latest_comment_at=Subquery(latest.values('created_at')[:1]),
+        )
+
 class NewsComment(models.Model):
     news = models.ForeignKey(SportsNews, on_delete=models.CASCADE, related_name='comments', verbose_name='新闻')
     student = models.ForeignKey(Student, on_delete=models.CASCADE, related_name='news_comments', verbose_name='学生')
@@ -226,10 +269,84 @@ class NewsComment(models.Model):
         verbose_name = '新闻评论'
         verbose_name_plural = '新闻评论管理'
         ordering = ['-created_at']
+        indexes = [
+            # 审核队列按 (是否已审核, 评论时间) 做游标分页
+            models.Index(fields=['is_approved', 'created_at'], name='news_comment_approved_idx'),
+        ]
     
     def __str__(self):
         return f'{self.student.name}对{self.news.title}的评论'
 
+# 不影响令牌声明和账号状态的用户字段，只修改这些字段时不使已签发的令牌失效
+USER_VOLATILE_FIELDS = {'last_login', 'password'}
+
+@receiver(pre_save, sender=User)
+def keep_principal_version(sender, instance, update_fields=None, **kwargs):
+    """保存整个用户对象时使用数据库中的主体版本号，避免内存中的旧值回退版本"""
+    if instance.pk is None or (update_fields is not None and 'principal_version' not in update_fields):
+        return
+    version = User.objects.filter(pk=instance.pk).values_list('principal_version', flat=True).first()
+    if version is not None:
+        instance.principal_version = version
+
+@receiver(post_save, sender=User)
+def invalidate_user_principal(sender, instance, created, update_fields=None, **kwargs):
+    """用户被修改（停用、取消管理员权限、更改用户类型等）后，使已签发的访问令牌失效"""
+    if created or (update_fields is not None and set(update_fields) <= USER_VOLATILE_FIELDS):
+        return
+    from .principal import invalidate_principal
+    invalidate_principal(instance.id)
+
+@receiver(post_delete, sender=User)
+def forget_deleted_user_principal(sender, instance, **kwargs):
+    """用户被删除后清除缓存的主体版本号，已签发的访问令牌查不到版本号而被拒绝"""
+    from .principal import forget_principal
+    forget_principal(instance.pk)
+
+@receiver(pre_save, sender=Student)
+def remember_previous_parent(sender, instance, **kwargs):
+    """记录修改前的家长，家长变化时原家长的子女列表也需要失效"""
+    instance._previous_parent_id = None
+    if instance.pk is not None:
+        instance._previous_parent_id = (
+            Student.objects.filter(pk=instance.pk).values_list('parent_id', flat=True).first()
+        )
+
+@receiver(post_save, sender=Student)
+@receiver(post_delete, sender=Student)
+def invalidate_student_principal(sender, instance, **kwargs):
+    """学生档案或家长关系变化时，清除学生、家长和原家长的主体缓存"""
+    from .principal import invalidate_principal
+    previous_parent_id = getattr(instance, '_previous_parent_id', None)
+    invalidate_principal(instance.user_id, instance.parent_id,
+                         previous_parent_id if previous_parent_id != instance.parent_id else None)
+
+@receiver(pre_save, sender=NewsComment)
+def remember_previous_news(sender, instance, **kwargs):
+    """记录修改前所属的新闻，评论移到其他新闻时原新闻的统计也需要刷新"""
+    instance._previous_news_id = None
+    if instance.pk is not None:
+        instance._previous_news_id = (
+            NewsComment.objects.filter(pk=instance.pk).values_list('news_id', flat=True).first()
+        )
+
+@receiver(post_save, sender=NewsComment)
+def update_news_comment_stats_on_save(sender, instance, created, **kwargs):
+    """已审核评论被创建或修改时，刷新所属新闻（以及评论移出的原新闻）的评论统计"""
+    # 新建的待审核评论不影响统计
+    if created and not instance.is_approved:
+        return
+    previous_news_id = getattr(instance, '_previous_news_id', None)
+    SportsNews.refresh_comment_stats([instance.news_id, previous_news_id] if previous_news_id else [instance.news_id])
+
+@receiver(post_delete, sender=NewsComment)
+def update_news_comment_stats_on_delete(sender, instance, origin=None, **kwargs):
+    """已审核评论被删除时，刷新所属新闻的评论统计"""
+    # 删除新闻时级联删除的评论无需刷新
+    if not instance.is_approved or isinstance(origin, SportsNews):
+        return
+    SportsNews.refresh_comment_stats([instance.news_id])
+
 @receiver(post_save, sender=TestResult)
 def create_makeup_notification(sender, instance, created, **kwargs):
     """当保存测试结果时，如果不及格且不是补考，则自动创建补考通知"""
@@ -249,3 +366,10 @@ def create_makeup_notification(sender, instance, created, **kwargs):
             test_plan=makeup_plan,
             original_result=instance
         )
+
+@receiver(post_save, sender=MakeupNotification)
+def update_inbox_unread_count(sender, instance, created, **kwargs):
+    """新通知创建后更新收件箱未读数缓存"""
+    if created and not instance.is_read:
+        from .inbox import notification_created
+        notification_created(instance)
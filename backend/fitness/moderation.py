@@ -0,0 +1,159 @@
+"""评论审核队列
+
+同时处理成绩评论(Comment)和新闻评论(NewsComment)：
+- 按 (is_approved, created_at) 索引做游标分页，列出待审核评论
+- 批量通过/拒绝，每个模型只执行一条 ``UPDATE/DELETE ... WHERE id IN``
+- 审核结果在事务提交后按组一次性推送给订阅者
+"""
+import base64
+from datetime import datetime
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+from django.db.models import Q
+from .models import Comment, NewsComment, SportsNews
+
+# 队列中的评论类型 -> (模型, 关联对象字段)
+MODERATION_MODELS = {
+    'comment': (Comment, 'test_result_id'),
+    'news_comment': (NewsComment, 'news_id'),
+}
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def encode_cursor(created_at, kind, pk):
+    """将队列位置编码为不透明的游标字符串"""
+    raw = f'{created_at.isoformat()}|{kind}|{pk}'
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """解析游标，返回 (created_at, kind, pk)；格式不正确时抛出 ValueError"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+        created_at, kind, pk = raw.split('|')
+        return datetime.fromisoformat(created_at), kind, int(pk)
+    except Exception:
+        raise ValueError('无效的游标')
+
+
+def _after_cursor(kind, cursor):
+    """构造某一类型评论位于游标之后的过滤条件
+
+    队列按 (created_at, kind, id) 升序排列，保证跨两个模型的分页顺序稳定。
+    """
+    created_at, cursor_kind, pk = cursor
+    if kind > cursor_kind:
+        return Q(created_at__gte=created_at)
+    if kind == cursor_kind:
+        return Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk)
+    return Q(created_at__gt=created_at)
+
+
+def pending_queue(cursor=None, limit=DEFAULT_PAGE_SIZE, kinds=None):
+    """获取一页待审核评论
+
+    参数:
+        cursor: 上一页返回的游标，为空时从最早的待审核评论开始
+        limit: 每页数量
+        kinds: 限定的评论类型列表，默认两种都包含
+
+    返回:
+        (items, next_cursor) 元组，没有更多数据时 next_cursor 为 None
+    """
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    position = decode_cursor(cursor) if cursor else None
+
+    items = []
+    for kind in sorted(kinds or MODERATION_MODELS):
+        model, target_field = MODERATION_MODELS[kind]
+        queryset = model.objects.filter(is_approved=False)
+        if position:
+            queryset = queryset.filter(_after_cursor(kind, position))
+        rows = queryset.order_by('created_at', 'id').values(
+            'id', 'student_id', 'student__name', 'content', 'created_at', target_field
+        )[:limit + 1]
+        for row in rows:
+            items.append({
+                'kind': kind,
+                'id': row['id'],
+                'student': row['student_id'],
+                'student_name': row['student__name'],
+                'target': row[target_field],
+                'content': row['content'],
+                'created_at': row['created_at'],
+            })
+
+    items.sort(key=lambda item: (item['created_at'], item['kind'], item['id']))
+    page = items[:limit]
+    next_cursor = None
+    if len(items) > limit:
+        last = page[-1]
+        next_cursor = encode_cursor(last['created_at'], last['kind'], last['id'])
+    return page, next_cursor
+
+
+def bulk_moderate(ids_by_kind, approve):
+    """批量通过或拒绝评论
+
+    通过使用一条 UPDATE 设置 is_approved；拒绝直接删除评论（一条 DELETE）。
+
+    参数:
+        ids_by_kind: {'comment': [id, ...], 'news_comment': [id, ...]}
+        approve: True 表示通过，False 表示拒绝
+
+    返回:
+        {kind: 实际处理的数量}
+    """
+    results = {}
+    affected = []
+    with transaction.atomic():
+        for kind, ids in ids_by_kind.items():
+            model, target_field = MODERATION_MODELS[kind]
+            ids = list(ids)
+            if not ids:
+                results[kind] = 0
+                continue
+            queryset = model.objects.filter(id__in=ids, is_approved=False)
+            rows = list(queryset.values_list('id', 'student_id', target_field))
+            if approve:
+                results[kind] = queryset.update(is_approved=True)
+                if kind == 'news_comment':
+                    # 批量 UPDATE 不触发信号，需手动刷新新闻的评论统计
+                    SportsNews.refresh_comment_stats(target for _, _, target in rows)
+            else:
+                results[kind] = queryset.delete()[0]
+            affected.extend(
+                {'kind': kind, 'id': pk, 'student': student_id} for pk, student_id, _ in rows
+            )
+        if affected:
+            action = 'approved' if approve else 'rejected'
+            transaction.on_commit(lambda: push_moderation_results(action, affected))
+    return results
+
+
+def push_moderation_results(action, affected):
+    """将一批审核结果推送给订阅者
+
+    管理员组收到整批结果，每个相关学生只收到自己评论的结果，每个组只发送一条消息。
+    """
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+
+    send = async_to_sync(channel_layer.group_send)
+    send('news_admin', {
+        'type': 'moderation_message',
+        'message': {'action': action, 'items': affected},
+    })
+
+    by_student = {}
+    for item in affected:
+        by_student.setdefault(item['student'], []).append(item)
+    for student_id, items in by_student.items():
+        send(f'news_student_{student_id}', {
+            'type': 'moderation_message',
+            'message': {'action': action, 'items': items},
+        })
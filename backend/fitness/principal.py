@@ -0,0 +1,185 @@
+"""请求主体（Principal）
+
+将用户类型、学生档案ID和家长的子女ID集中到一个对象中，避免每个视图重复查询
+``Student``。解析顺序：
+
+1. 当前请求上已解析的主体（请求级缓存）
+2. 访问令牌中携带的声明（见 ``token_for_user``）
+3. 共享缓存（Django cache，多进程部署时应配置 Redis 等共享的缓存后端）
+4. 查询数据库
+
+每个用户有一个主体版本号，保存在 ``User.principal_version`` 列中。学生档案或家长关系变化时
+``invalidate_principal`` 在同一事务中递增版本号：缓存中旧版本的主体不再使用，携带旧版本号的访问令牌
+在认证时被拒绝（见 ``fitness.authentication``），客户端刷新令牌后获得新的声明。
+
+缓存中的版本号只是数据库的副本，有效期为 ``PRINCIPAL_CACHE_TIMEOUT``，事务提交后删除；被淘汰或进程重启后
+从数据库重新读取，不会回退为 0。使用进程内缓存时，其他进程最多在有效期内继续接受旧令牌。
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from .models import Student, User
+
+# 共享缓存中主体和主体版本号的有效期（秒）
+PRINCIPAL_CACHE_TIMEOUT = 60
+
+# 写入令牌的声明名称
+CLAIM_USER_TYPE = 'user_type'
+CLAIM_STUDENT_ID = 'student_id'
+CLAIM_CHILD_IDS = 'child_ids'
+CLAIM_PRINCIPAL_VERSION = 'principal_version'
+
+
+class Principal:
+    """当前用户的角色信息
+
+    属性:
+        user_id: 用户ID
+        user_type: 用户类型 ('student', 'parent', 'admin')
+        student_id: 学生用户对应的 Student 主键，没有学生档案时为 None
+        child_ids: 家长用户子女的 Student 主键元组
+    """
+    __slots__ = ('user_id', 'user_type', 'student_id', 'child_ids')
+
+    def __init__(self, user_id, user_type, student_id=None, child_ids=()):
+        self.user_id = user_id
+        self.user_type = user_type
+        self.student_id = student_id
+        self.child_ids = tuple(child_ids)
+
+    @property
+    def is_admin(self):
+        return self.user_type == 'admin'
+
+    @property
+    def is_student(self):
+        return self.user_type == 'student'
+
+    @property
+    def is_parent(self):
+        return self.user_type == 'parent'
+
+    def to_claims(self):
+        """转换为令牌声明"""
+        return {
+            CLAIM_USER_TYPE: self.user_type,
+            CLAIM_STUDENT_ID: self.student_id,
+            CLAIM_CHILD_IDS: list(self.child_ids),
+        }
+
+    @classmethod
+    def from_claims(cls, user_id, claims):
+        """从令牌声明构造主体，声明不完整时返回 None"""
+        if CLAIM_USER_TYPE not in claims:
+            return None
+        return cls(
+            user_id=user_id,
+            user_type=claims[CLAIM_USER_TYPE],
+            student_id=claims.get(CLAIM_STUDENT_ID),
+            child_ids=claims.get(CLAIM_CHILD_IDS) or (),
+        )
+
+
+def principal_cache_key(user_id):
+    return f'principal:{user_id}'
+
+
+def version_cache_key(user_id):
+    return f'principal:version:{user_id}'
+
+
+def get_principal_version(user_id):
+    """读取用户当前的主体版本号，缓存未命中时查询数据库；用户不存在时返回 None"""
+    key = version_cache_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        version = User.objects.filter(id=user_id).values_list('principal_version', flat=True).first()
+        if version is not None:
+            cache.set(key, version, PRINCIPAL_CACHE_TIMEOUT)
+    return version
+
+
+def load_principal(user, version=None):
+    """从数据库加载用户的主体信息，并写入共享缓存
+
+    参数:
+        version: 查询之前读取的主体版本号；先读版本再查询，查询期间发生的变化会使缓存的结果失效
+    """
+    if version is None:
+        version = get_principal_version(user.id)
+    student_id = None
+    child_ids = ()
+    if user.user_type == 'student':
+        student_id = Student.objects.filter(user_id=user.id).values_list('id', flat=True).first()
+    elif user.user_type == 'parent':
+        child_ids = Student.objects.filter(parent_id=user.id).order_by('id').values_list('id', flat=True)
+    principal = Principal(user.id, user.user_type, student_id, child_ids)
+    cache.set(principal_cache_key(user.id), (version, principal.to_claims()), PRINCIPAL_CACHE_TIMEOUT)
+    return principal
+
+
+def _cached_principal(user_id):
+    """读取共享缓存中的主体，版本号不是最新时视为未命中"""
+    entry = cache.get(principal_cache_key(user_id))
+    if entry is None or entry[0] != get_principal_version(user_id):
+        return None
+    return Principal.from_claims(user_id, entry[1])
+
+
+def invalidate_principal(*user_ids):
+    """学生档案或家长关系变化时递增用户的主体版本号，使缓存的主体和已签发的访问令牌失效
+
+    应在修改学生档案或家长关系的同一事务中调用。缓存立即删除一次，事务提交后再删除一次，
+    避免其他请求在提交前把旧版本号重新写入缓存。
+    """
+    user_ids = [user_id for user_id in user_ids if user_id is not None]
+    if not user_ids:
+        return
+    User.objects.filter(id__in=user_ids).update(principal_version=F('principal_version') + 1)
+    forget_principal(*user_ids)
+
+
+def forget_principal(*user_ids):
+    """删除缓存的主体和主体版本号（版本号变化或用户被删除时调用）"""
+    keys = [key for user_id in user_ids for key in (principal_cache_key(user_id), version_cache_key(user_id))]
+    cache.delete_many(keys)
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def get_principal(request):
+    """获取当前请求的主体，每个请求最多解析一次"""
+    principal = getattr(request, '_fitness_principal', None)
+    if principal is not None:
+        return principal
+
+    user = request.user
+    auth = getattr(request, 'auth', None)
+    payload = getattr(auth, 'payload', None)
+    if payload:
+        principal = Principal.from_claims(user.id, payload)
+    if principal is None:
+        principal = _cached_principal(user.id) or load_principal(user)
+
+    request._fitness_principal = principal
+    return principal
+
+
+def apply_claims(token, user):
+    """把用户当前的主体、主体版本号和基本属性写入令牌声明（签发和刷新令牌时调用）"""
+    from .authentication import user_claims
+    if not getattr(settings, 'FITNESS_PRINCIPAL_TOKEN_CLAIMS', True):
+        return token
+    version = get_principal_version(user.id)
+    claims = load_principal(user, version).to_claims()
+    claims[CLAIM_PRINCIPAL_VERSION] = version
+    claims.update(user_claims(user))
+    for claim, value in claims.items():
+        token[claim] = value
+    return token
+
+
+def token_for_user(user):
+    """为用户签发刷新令牌，按配置在令牌中携带主体声明和用户基本属性"""
+    from .authentication import FitnessRefreshToken
+    return apply_claims(FitnessRefreshToken.for_user(user), user)
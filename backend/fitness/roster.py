@@ -0,0 +1,360 @@
+"""学生名册批量导入
+
+逐行流式读取 CSV/XLSX 名册，按块批量创建或更新 ``User``、``Student`` 及家长账号：
+
+- 以学号(student_id)为键幂等导入：已存在的学生更新姓名、性别、班级和家长，不重置账号密码
+- 新账号的密码按 ``PASSWORD_HASH_ALGORITHM`` 在进程池中计算哈希（hash_workers 为 1 时在当前进程中计算）
+- 试运行(dry_run)模式执行全部校验和写入后回滚，并跳过密码哈希
+- 每一行的错误记录在报告中，不影响其他行导入
+
+通过接口上传的名册由 ``start_import_job`` 保存后交给后台的 ``import_roster`` 管理命令导入，
+请求进程中不计算密码哈希；``read_import_job`` 读取任务状态和导入报告。
+"""
+import csv
+import io
+import json
+import os
+import re
+import subprocess
+import sys
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from django.conf import settings
+from django.contrib.auth.hashers import Argon2PasswordHasher, ScryptPasswordHasher, make_password
+from django.db import transaction
+from .models import User, Student
+from .principal import invalidate_principal
+
+# 名册表头（支持中英文）-> 字段名
+HEADER_ALIASES = {
+    'student_id': 'student_id', '学号': 'student_id',
+    'name': 'name', '姓名': 'name',
+    'gender': 'gender', '性别': 'gender',
+    'class_name': 'class_name', '班级': 'class_name',
+    'username': 'username', '用户名': 'username',
+    'password': 'password', '密码': 'password',
+    'email': 'email', '邮箱': 'email',
+    'phone': 'phone', '手机号': 'phone',
+    'parent_username': 'parent_username', '家长用户名': 'parent_username',
+    'parent_phone': 'parent_phone', '家长手机号': 'parent_phone',
+}
+
+REQUIRED_FIELDS = ('student_id', 'name', 'class_name')
+
+# 性别取值（不区分大小写，查找前转为小写）
+GENDER_VALUES = {'m': 'M', 'f': 'F', '男': 'M', '女': 'F', 'male': 'M', 'female': 'F'}
+
+# PASSWORD_HASH_ALGORITHM -> 导入时计算初始密码哈希的哈希器
+INITIAL_HASHERS = {'scrypt': ScryptPasswordHasher, 'argon2': Argon2PasswordHasher}
+
+# 初始哈希代价（initial_hash_cost）对应的参数
+INITIAL_COST_PARAMS = {'scrypt': 'work_factor', 'argon2': 'time_cost'}
+
+DEFAULT_CHUNK_SIZE = 2000
+
+
+def _normalize_header(header):
+    fields = []
+    for name in header:
+        name = str(name or '').strip()
+        fields.append(HEADER_ALIASES.get(name) or HEADER_ALIASES.get(name.lower()))
+    return fields
+
+
+def _iter_csv(stream):
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    try:
+        reader = csv.reader(text)
+        header = next(reader, None)
+        if header is None:
+            return
+        fields = _normalize_header(header)
+        for row in reader:
+            if not any(row):
+                continue
+            yield dict(zip(fields, row))
+    finally:
+        # 分离包装器，避免回收时关闭调用方的文件
+        text.detach()
+
+
+def _iter_xlsx(stream):
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise ValueError('读取XLSX名册需要安装 openpyxl')
+    # 只读模式按行读取，不会把整个工作表加载到内存
+    workbook = load_workbook(stream, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        fields = _normalize_header(header)
+        for row in rows:
+            if row is None or all(value is None for value in row):
+                continue
+            yield {field: '' if value is None else str(value) for field, value in zip(fields, row)}
+    finally:
+        workbook.close()
+
+
+def read_roster(stream, filename):
+    """按行读取名册
+
+    参数:
+        stream: 以二进制模式打开的文件对象
+        filename: 文件名，根据扩展名区分 CSV 和 XLSX
+
+    返回:
+        (行号, 字段字典) 迭代器，第1行为表头
+    """
+    if filename.lower().endswith('.xlsx'):
+        rows = _iter_xlsx(stream)
+    else:
+        rows = _iter_csv(stream)
+    for line_no, row in enumerate(rows, start=2):
+        row.pop(None, None)
+        yield line_no, {key: (value or '').strip() for key, value in row.items()}
+
+
+def limit_rows(rows, max_rows):
+    """逐行转发名册，超过 max_rows 行时抛出 ValueError"""
+    for count, item in enumerate(rows, start=1):
+        if count > max_rows:
+            raise ValueError(f'名册超过接口上限 {max_rows} 行，请使用 manage.py import_roster 命令导入')
+        yield item
+
+
+def _hash_passwords(passwords, algorithm, params):
+    """在子进程中批量计算哈希，代价参数直接设置在哈希器实例上，子进程不需要读取 Django 配置"""
+    hasher = INITIAL_HASHERS[algorithm]()
+    for name, value in params.items():
+        setattr(hasher, name, value)
+    return [hasher.encode(password, hasher.salt()) for password in passwords]
+
+
+class RosterImporter:
+    """名册导入器
+
+    参数:
+        dry_run: 试运行，只校验并统计，不保存任何数据
+        chunk_size: 每个事务处理的行数
+        hash_workers: 计算密码哈希的进程数，为 1 时不创建进程池
+        initial_hash_cost: 初始密码的哈希代价（scrypt 的 work factor 或 argon2 的 time_cost），
+            为空时使用当前首选哈希配置；较低的代价可以加快导入，用户首次登录时会自动升级为首选配置
+    """
+
+    def __init__(self, dry_run=False, chunk_size=DEFAULT_CHUNK_SIZE, hash_workers=None, initial_hash_cost=None):
+        self.dry_run = dry_run
+        self.chunk_size = chunk_size
+        self.hash_workers = hash_workers or os.cpu_count() or 2
+        self.initial_hash_cost = initial_hash_cost
+        self.report = {'created': 0, 'updated': 0, 'parents_created': 0, 'errors': []}
+        self._seen_student_ids = set()
+        self._executor = None
+
+    def run(self, rows):
+        """导入名册行，返回报告字典"""
+        try:
+            chunk = []
+            for line_no, row in rows:
+                chunk.append((line_no, row))
+                if len(chunk) >= self.chunk_size:
+                    self._import_chunk(chunk)
+                    chunk = []
+            if chunk:
+                self._import_chunk(chunk)
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown()
+        return self.report
+
+    def _error(self, line_no, message):
+        self.report['errors'].append({'row': line_no, 'error': message})
+
+    def _validate(self, line_no, row):
+        for field in REQUIRED_FIELDS:
+            if not row.get(field):
+                self._error(line_no, f'缺少必填字段 {field}')
+                return None
+        gender = GENDER_VALUES.get((row.get('gender') or 'M').lower())
+        if gender is None:
+            self._error(line_no, f'无效的性别 {row["gender"]}')
+            return None
+        if row['student_id'] in self._seen_student_ids:
+            self._error(line_no, f'学号 {row["student_id"]} 在名册中重复')
+            return None
+        self._seen_student_ids.add(row['student_id'])
+        row['gender'] = gender
+        row['username'] = row.get('username') or row['student_id']
+        return row
+
+    def _import_chunk(self, chunk):
+        valid = []
+        for line_no, row in chunk:
+            row = self._validate(line_no, row)
+            if row is not None:
+                valid.append((line_no, row))
+        if not valid:
+            return
+
+        with transaction.atomic():
+            parents = self._ensure_parents(valid)
+            existing = Student.objects.in_bulk(
+                [row['student_id'] for _, row in valid], field_name='student_id'
+            )
+
+            to_update = []
+            new_rows = []
+            previous_parent_ids = set()
+            for line_no, row in valid:
+                parent = parents.get(row.get('parent_username'))
+                student = existing.get(row['student_id'])
+                if student is not None:
+                    student.name = row['name']
+                    student.gender = row['gender']
+                    student.class_name = row['class_name']
+                    if parent is not None and parent != student.parent_id:
+                        if student.parent_id is not None:
+                            previous_parent_ids.add(student.parent_id)
+                        student.parent_id = parent
+                    to_update.append(student)
+                else:
+                    new_rows.append((line_no, row, parent))
+
+            if to_update:
+                Student.objects.bulk_update(to_update, ['name', 'gender', 'class_name', 'parent'])
+            created = self._create_students(new_rows)
+
+            self.report['updated'] += len(to_update)
+            self.report['created'] += created
+            if self.dry_run:
+                transaction.set_rollback(True)
+            else:
+                # bulk 操作不触发信号，在同一事务中递增家长的主体版本号；换了家长的学生，原家长的 child_ids 也要失效
+                invalidate_principal(*previous_parent_ids.union(parents.values()))
+
+    def _ensure_parents(self, valid):
+        """获取或创建名册中引用的家长账号，返回 {用户名: 用户ID}"""
+        phones = {}
+        for _, row in valid:
+            if row.get('parent_username'):
+                phones.setdefault(row['parent_username'], row.get('parent_phone', ''))
+        if not phones:
+            return {}
+
+        parents = dict(User.objects.filter(username__in=phones).values_list('username', 'id'))
+        missing = [username for username in phones if username not in parents]
+        if missing:
+            # 家长账号不设置可用密码，需要由管理员重置后登录
+            User.objects.bulk_create([
+                User(username=username, user_type='parent', phone=phones[username][:15],
+                     password=make_password(None))
+                for username in missing
+            ])
+            # MySQL 的 bulk_create 不回填主键，重新查询
+            parents.update(User.objects.filter(username__in=missing).values_list('username', 'id'))
+            self.report['parents_created'] += len(missing)
+        return parents
+
+    def _create_students(self, new_rows):
+        if not new_rows:
+            return 0
+        usernames = [row['username'] for _, row, _ in new_rows]
+        taken = set(User.objects.filter(username__in=usernames).values_list('username', flat=True))
+        rows = []
+        for line_no, row, parent in new_rows:
+            if row['username'] in taken:
+                self._error(line_no, f'用户名 {row["username"]} 已被其他账号使用')
+            else:
+                taken.add(row['username'])
+                rows.append((row, parent))
+        if not rows:
+            return 0
+
+        # 未提供密码时，初始密码为学号
+        hashes = self._hash([row.get('password') or row['student_id'] for row, _ in rows])
+        User.objects.bulk_create([
+            User(username=row['username'], password=encoded, user_type='student',
+                 first_name=row['name'][:150], email=row.get('email', ''), phone=row.get('phone', '')[:15])
+            for (row, _), encoded in zip(rows, hashes)
+        ])
+        user_ids = dict(
+            User.objects.filter(username__in=[row['username'] for row, _ in rows]).values_list('username', 'id')
+        )
+        Student.objects.bulk_create([
+            Student(user_id=user_ids[row['username']], student_id=row['student_id'], name=row['name'],
+                    gender=row['gender'], class_name=row['class_name'], parent_id=parent)
+            for row, parent in rows
+        ])
+        return len(rows)
+
+    def _hash(self, passwords):
+        if self.dry_run:
+            # 试运行不保存数据，不需要计算哈希
+            return [make_password(None)] * len(passwords)
+
+        algorithm = getattr(settings, 'PASSWORD_HASH_ALGORITHM', 'scrypt')
+        params = dict(getattr(settings, 'FITNESS_PASSWORD_PROFILE', {}).get(algorithm, {}))
+        if self.initial_hash_cost:
+            params[INITIAL_COST_PARAMS[algorithm]] = self.initial_hash_cost
+
+        if self.hash_workers <= 1:
+            return _hash_passwords(passwords, algorithm, params)
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.hash_workers)
+        size = max(1, len(passwords) // (self.hash_workers * 4) + 1)
+        batches = [passwords[i:i + size] for i in range(0, len(passwords), size)]
+        futures = [
+            self._executor.submit(_hash_passwords, batch, algorithm, params)
+            for batch in batches
+        ]
+        return [encoded for future in futures for encoded in future.result()]
+
+
+_JOB_ID = re.compile(r'^[0-9a-f]{32}$')
+
+
+def _job_path(job_id, suffix):
+    return Path(settings.FITNESS_ROSTER_JOB_DIR) / f'{job_id}{suffix}'
+
+
+def start_import_job(upload):
+    """保存上传的名册，在后台进程中运行 import_roster 命令导入，返回任务ID
+
+    命令完成后写入 ``<任务ID>.json`` 报告并删除保存的名册，输出记录在 ``<任务ID>.log`` 中。
+    """
+    job_id = uuid.uuid4().hex
+    Path(settings.FITNESS_ROSTER_JOB_DIR).mkdir(parents=True, exist_ok=True)
+    source = _job_path(job_id, '.xlsx' if upload.name.lower().endswith('.xlsx') else '.csv')
+    with open(source, 'wb') as f:
+        for chunk in upload.chunks():
+            f.write(chunk)
+    command = [
+        sys.executable, str(Path(settings.BASE_DIR) / 'manage.py'), 'import_roster', str(source),
+        '--report', str(_job_path(job_id, '.json')), '--delete-source',
+    ]
+    with open(_job_path(job_id, '.log'), 'wb') as log:
+        subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL,
+                         start_new_session=True)
+    return job_id
+
+
+def read_import_job(job_id):
+    """读取导入任务的状态，任务不存在时返回 None
+
+    返回:
+        {'status': 'running'}、{'status': 'done', **报告} 或 {'status': 'failed', 'error': 错误信息}
+    """
+    if not _JOB_ID.match(job_id or ''):
+        return None
+    report_path = _job_path(job_id, '.json')
+    if report_path.exists():
+        with open(report_path, encoding='utf-8') as f:
+            report = json.load(f)
+        return dict(report, status='failed' if 'error' in report else 'done')
+    if _job_path(job_id, '.csv').exists() or _job_path(job_id, '.xlsx').exists():
+        return {'status': 'running'}
+    return None
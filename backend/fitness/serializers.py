@@ -40,8 +40,12 @@ class TestResultSerializer(serializers.ModelSerializer):
                   'is_makeup', 'is_passed')
         
     def get_is_passed(self, obj):
-        # 直接调用模型的is_passed方法，保持逻辑统一
-        return obj.is_passed
+        # 复用模型的及格判断逻辑；体测标准每次序列化只加载一次，避免逐行查询
+        standards = self.context.get('physical_standards')
+        if standards is None:
+            standards = {standard.gender: standard for standard in PhysicalStandard.objects.all()}
+            self.context['physical_standards'] = standards
+        return obj.passes_standard(standards.get(obj.student.gender))
 
 class CommentSerializer(serializers.ModelSerializer):
     class Meta:
@@ -57,12 +61,16 @@ class SportsNewsSerializer(serializers.ModelSerializer):
     class Meta:
         model = SportsNews
         fields = '__all__'
+        read_only_fields = ('approved_comment_count', 'latest_comment_content',
+                            'latest_comment_student_name', 'latest_comment_at')
         
 class SportsNewsListSerializer(serializers.ModelSerializer):
     """简化版的新闻序列化器，用于列表显示"""
     class Meta:
         model = SportsNews
-        fields = ('id', 'title', 'pub_date', 'featured_image', 'source_name', 'is_featured', 'views')
+        fields = ('id', 'title', 'pub_date', 'featured_image', 'source_name', 'is_featured', 'views',
+                  'approved_comment_count', 'latest_comment_content', 'latest_comment_student_name',
+                  'latest_comment_at')
 
 class NewsCommentSerializer(serializers.ModelSerializer):
     student_name = serializers.CharField(source='student.name', read_only=True)
@@ -1,3 +1,381 @@
-from django.test import TestCase
+import importlib.util
+import io
+import os
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+from django.conf import settings
+from django.contrib.auth.signals import user_login_failed
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.token_blacklist.models import OutstandingToken
+from rest_framework_simplejwt.tokens import AccessToken
+from .models import User, Student, PhysicalStandard, TestPlan, TestResult, MakeupNotification, SportsNews, NewsComment
+from .authentication import ClaimsUser, RevokedTokenCache
+from .principal import get_principal, get_principal_version, load_principal, token_for_user
+from . import columnar
+from .roster import RosterImporter
 
-# Create your tests here.
+
+def create_student(username, parent=None, gender='M'):
+    user = User.objects.create_user(username, password='x', user_type='student')
+    return Student.objects.create(user=user, student_id=username.upper(), name=username, gender=gender,
+                                  class_name='一班', parent=parent)
+
+
+def local_datetime(*args):
+    """项目配置 USE_TZ=False，测试配置 USE_TZ=True，按当前配置返回无时区或带时区的时间"""
+    value = datetime(*args)
+    return timezone.make_aware(value) if settings.USE_TZ else value
+
+
+def create_plan(title='春季体测', plan_type='regular'):
+    return TestPlan.objects.create(title=title, test_date=local_datetime(2025, 3, 1),
+                                   location='操场', description='体测', plan_type=plan_type)
+
+
+def create_result(student, plan, **scores):
+    values = dict(bmi=20, vital_capacity=3000, run_50m=8, sit_and_reach=12, standing_jump=200,
+                  run_800m=230, total_score=70)
+    values.update(scores)
+    return TestResult.objects.create(student=student, test_plan=plan, **values)
+
+
+class FitnessTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        PhysicalStandard.objects.create(
+            gender='M', bmi_min=18.5, bmi_max=23.9, vital_capacity_excellent=4000, run_50m_excellent=7,
+            sit_and_reach_excellent=20, standing_jump_excellent=250, run_800m_excellent=200,
+        )
+
+    def client_for(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+
+class UnreadCountTests(FitnessTestCase):
+    def test_filtered_list_does_not_change_cached_badge(self):
+        student = create_student('s1')
+        plan = create_plan()
+        create_result(student, plan, total_score=50)
+        create_result(student, plan, total_score=40)
+        MakeupNotification.objects.update(sent_at=timezone.now() - timedelta(days=2))
+        client = self.client_for(student.user)
+
+        since = (timezone.now() - timedelta(days=1)).isoformat()
+        response = client.get('/api/notifications/unread_count/', {'since': since})
+        self.assertEqual(response.data['unread_count'], 2)
+        response = client.get('/api/notifications/unread_count/')
+        self.assertEqual(response.data['unread_count'], 2)
+
+
+class TokenTestCase(FitnessTestCase):
+    def login(self, user):
+        refresh = token_for_user(user)
+        return str(refresh), str(refresh.access_token)
+
+    def bearer(self, access):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+        return client
+
+
+class PrincipalVersionTests(TokenTestCase):
+    def test_linking_child_rejects_old_access_token_and_refresh_reloads_children(self):
+        parent = User.objects.create_user('p1', password='x', user_type='parent')
+        refresh, access = self.login(parent)
+        self.assertEqual(AccessToken(access)['child_ids'], [])
+        self.assertEqual(self.bearer(access).get('/api/notifications/unread_count/').status_code, 200)
+
+        child = create_student('s1', parent=parent)
+
+        self.assertEqual(self.bearer(access).get('/api/notifications/unread_count/').status_code, 401)
+        response = APIClient().post('/api/auth/refresh/', {'refresh': refresh}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(AccessToken(response.data['access'])['child_ids'], [child.id])
+        self.assertEqual(self.bearer(response.data['access']).get('/api/notifications/unread_count/').status_code, 200)
+
+    def test_moving_child_invalidates_previous_parent(self):
+        old_parent = User.objects.create_user('p1', password='x', user_type='parent')
+        new_parent = User.objects.create_user('p2', password='x', user_type='parent')
+        child = create_student('s1', parent=old_parent)
+        self.assertEqual(load_principal(old_parent).child_ids, (child.id,))
+
+        version = get_principal_version(old_parent.id)
+        child.parent = new_parent
+        child.save()
+        self.assertGreater(get_principal_version(old_parent.id), version)
+        request = type('Request', (), {'user': old_parent, 'auth': None})()
+        self.assertEqual(get_principal(request).child_ids, ())
+
+    def test_version_survives_cache_eviction(self):
+        parent = User.objects.create_user('p1', password='x', user_type='parent')
+        _, access = self.login(parent)
+        create_student('s1', parent=parent)
+
+        cache.clear()
+        self.assertEqual(get_principal_version(parent.id), 1)
+        self.assertEqual(self.bearer(access).get('/api/notifications/unread_count/').status_code, 401)
+
+    def test_full_save_does_not_roll_back_version(self):
+        parent = User.objects.create_user('p1', password='x', user_type='parent')
+        create_student('s1', parent=parent)
+        parent.phone = '13800000000'
+        parent.save()
+        parent.refresh_from_db()
+        self.assertEqual(parent.principal_version, 2)
+
+    def test_token_of_deleted_user_is_rejected(self):
+        parent = User.objects.create_user('p1', password='x', user_type='parent')
+        _, access = self.login(parent)
+        user_id = parent.id
+        parent.delete()
+        self.assertIsNone(get_principal_version(user_id))
+        self.assertEqual(self.bearer(access).get('/api/notifications/unread_count/').status_code, 401)
+
+
+class TokenRefreshTests(TokenTestCase):
+    def test_refresh_rebuilds_staff_claim(self):
+        admin = User.objects.create_user('a1', password='x', user_type='admin', is_staff=True)
+        refresh, access = self.login(admin)
+        self.assertTrue(AccessToken(access)['is_staff'])
+
+        admin.is_staff = False
+        admin.save()
+
+        self.assertEqual(self.bearer(access).get('/api/notifications/unread_count/').status_code, 401)
+        response = APIClient().post('/api/auth/refresh/', {'refresh': refresh}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(AccessToken(response.data['access'])['is_staff'])
+
+    def test_deactivated_user_cannot_refresh_or_use_access_token(self):
+        student = create_student('s1')
+        refresh, access = self.login(student.user)
+
+        student.user.is_active = False
+        student.user.save()
+
+        self.assertEqual(self.bearer(access).get('/api/notifications/unread_count/').status_code, 401)
+        response = APIClient().post('/api/auth/refresh/', {'refresh': refresh}, format='json')
+        self.assertEqual(response.status_code, 401)
+
+    def test_claims_user_reads_is_active_from_database(self):
+        student = create_student('s1')
+        _, access = self.login(student.user)
+        User.objects.filter(id=student.user_id).update(is_active=False)
+        self.assertFalse(ClaimsUser(AccessToken(access)).is_active)
+
+    def test_login_does_not_invalidate_tokens(self):
+        student = create_student('s1')
+        _, access = self.login(student.user)
+        student.user.save(update_fields=['last_login'])
+        self.assertEqual(self.bearer(access).get('/api/notifications/unread_count/').status_code, 200)
+
+
+class LoginTests(FitnessTestCase):
+    def test_login_goes_through_authentication_backends(self):
+        User.objects.create_user('s1', password='secret', user_type='student')
+        failures = []
+        handler = lambda sender, credentials, request, **kwargs: failures.append(credentials['username'])
+        user_login_failed.connect(handler)
+        self.addCleanup(user_login_failed.disconnect, handler)
+
+        response = APIClient().post('/api/auth/login/', {'username': 's1', 'password': 'wrong'}, format='json')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(failures, ['s1'])
+        response = APIClient().post('/api/auth/login/', {'username': 's1', 'password': 'secret'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(failures, ['s1'])
+
+
+class RevokedTokenCacheTests(TokenTestCase):
+    def test_reload_adds_new_entries_and_drops_expired(self):
+        student = create_student('s1')
+        revoked = RevokedTokenCache()
+        first = token_for_user(student.user)
+        first.blacklist()
+        OutstandingToken.objects.filter(jti=first['jti']).update(expires_at=timezone.now() + timedelta(minutes=1))
+        revoked.reload()
+        self.assertTrue(revoked.is_revoked(first['jti']))
+
+        second = token_for_user(student.user)
+        second.blacklist()
+        later = timezone.now() + timedelta(minutes=2)
+        with self.assertNumQueries(1), mock.patch('fitness.authentication.timezone.now', return_value=later):
+            revoked.reload()
+        self.assertTrue(revoked.is_revoked(second['jti']))
+        self.assertFalse(revoked.is_revoked(first['jti']))
+
+
+class RosterImportTests(TokenTestCase):
+    def roster(self, *rows):
+        lines = ['学号,姓名,性别,班级,家长用户名', *[','.join(row) for row in rows]]
+        return [(line_no, dict(zip(('student_id', 'name', 'gender', 'class_name', 'parent_username'), row)))
+                for line_no, row in enumerate(rows, start=2)], '\n'.join(lines).encode('utf-8')
+
+    def test_reparenting_invalidates_previous_parent(self):
+        old_parent = User.objects.create_user('p1', password='x', user_type='parent')
+        child = create_student('s1', parent=old_parent)
+        _, access = self.login(old_parent)
+        self.assertEqual(AccessToken(access)['child_ids'], [child.id])
+
+        rows, _ = self.roster(('S1', 's1', 'M', '一班', 'p2'))
+        with self.captureOnCommitCallbacks(execute=True):
+            report = RosterImporter(hash_workers=1).run(rows)
+        self.assertEqual(report['updated'], 1)
+
+        self.assertEqual(self.bearer(access).get('/api/notifications/unread_count/').status_code, 401)
+        self.assertEqual(load_principal(old_parent).child_ids, ())
+        new_parent = User.objects.get(username='p2')
+        self.assertEqual(load_principal(new_parent).child_ids, (child.id,))
+
+    @override_settings(FITNESS_ROSTER_UPLOAD_MAX_ROWS=1)
+    def test_dry_run_upload_rejects_large_roster(self):
+        admin = User.objects.create_user('a1', password='x', user_type='admin', is_staff=True)
+        _, content = self.roster(('S1', 's1', 'M', '一班', ''), ('S2', 's2', 'F', '一班', ''))
+        upload = SimpleUploadedFile('roster.csv', content, content_type='text/csv')
+        response = self.client_for(admin).post('/api/students/import_roster/', {'file': upload, 'dry_run': 'true'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('import_roster', response.data['error'])
+        self.assertFalse(Student.objects.exists())
+
+    def test_upload_is_imported_by_background_command(self):
+        admin = User.objects.create_user('a1', password='x', user_type='admin', is_staff=True)
+        client = self.client_for(admin)
+        _, content = self.roster(('S1', 's1', 'm', '一班', ''))
+        with tempfile.TemporaryDirectory() as job_dir, override_settings(FITNESS_ROSTER_JOB_DIR=job_dir), \
+                mock.patch('fitness.roster.subprocess.Popen') as popen:
+            upload = SimpleUploadedFile('roster.csv', content, content_type='text/csv')
+            response = client.post('/api/students/import_roster/', {'file': upload})
+            self.assertEqual(response.status_code, 202)
+            self.assertFalse(Student.objects.exists())
+            job_id = response.data['job_id']
+            status_url = '/api/students/import_roster_status/'
+            self.assertEqual(client.get(status_url, {'job_id': job_id}).data['status'], 'running')
+
+            # 在当前进程中执行后台进程的命令
+            command = popen.call_args.args[0]
+            self.assertEqual(command[2], 'import_roster')
+            call_command(*command[2:], workers=1, stdout=io.StringIO(), stderr=io.StringIO())
+            response = client.get(status_url, {'job_id': job_id})
+            self.assertEqual(response.data['status'], 'done')
+            self.assertEqual(response.data['created'], 1)
+            self.assertEqual(sorted(os.listdir(job_dir)), [f'{job_id}.json', f'{job_id}.log'])
+        self.assertEqual(Student.objects.get().gender, 'M')
+        self.assertTrue(User.objects.get(username='S1').check_password('S1'))
+        self.assertEqual(client.get(status_url, {'job_id': '../x'}).status_code, 404)
+
+    @override_settings(PASSWORD_HASH_ALGORITHM='scrypt', FITNESS_PASSWORD_PROFILE={'scrypt': {'work_factor': 2 ** 10}})
+    def test_initial_password_uses_configured_algorithm(self):
+        rows, _ = self.roster(('S1', 's1', 'F', '一班', ''))
+        RosterImporter(hash_workers=1).run(rows)
+        encoded = User.objects.get(username='S1').password
+        self.assertTrue(encoded.startswith('scrypt$'))
+        self.assertEqual(encoded.split('$')[1], str(2 ** 10))
+
+    @unittest.skipUnless(importlib.util.find_spec('argon2'), '需要安装 argon2-cffi')
+    @override_settings(PASSWORD_HASH_ALGORITHM='argon2', FITNESS_PASSWORD_PROFILE={'argon2': {'time_cost': 1}})
+    def test_initial_password_uses_argon2_when_configured(self):
+        rows, _ = self.roster(('S1', 's1', 'F', '一班', ''))
+        RosterImporter(hash_workers=1).run(rows)
+        self.assertTrue(User.objects.get(username='S1').password.startswith('argon2$'))
+
+    def test_dry_run_upload_validates_in_request(self):
+        admin = User.objects.create_user('a1', password='x', user_type='admin', is_staff=True)
+        _, content = self.roster(('S1', 's1', 'M', '一班', ''), ('S2', 's2', 'X', '一班', ''))
+        upload = SimpleUploadedFile('roster.csv', content, content_type='text/csv')
+        response = self.client_for(admin).post('/api/students/import_roster/', {'file': upload, 'dry_run': 'true'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['created'], 1)
+        self.assertEqual(response.data['errors'], [{'row': 3, 'error': '无效的性别 X'}])
+        self.assertFalse(Student.objects.exists())
+
+
+class GenerateScaleDataTests(FitnessTestCase):
+    def test_bulk_generated_notifications_update_cached_badge(self):
+        admin = User.objects.create_user('a1', password='x', user_type='admin', is_staff=True)
+        client = self.client_for(admin)
+        self.assertEqual(client.get('/api/notifications/unread_count/').data['unread_count'], 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('generate_scale_data', students=40, plans=2, stdout=io.StringIO(), stderr=io.StringIO())
+
+        unread = MakeupNotification.objects.filter(is_read=False).count()
+        self.assertGreater(unread, 0)
+        self.assertEqual(client.get('/api/notifications/unread_count/').data['unread_count'], unread)
+
+
+class NewsCommentStatsTests(FitnessTestCase):
+    def test_moving_comment_refreshes_both_news(self):
+        student = create_student('s1')
+        first = SportsNews.objects.create(title='校运会', content='报名开始')
+        second = SportsNews.objects.create(title='篮球赛', content='决赛')
+        comment = NewsComment.objects.create(news=first, student=student, content='加油', is_approved=True)
+        first.refresh_from_db()
+        self.assertEqual(first.approved_comment_count, 1)
+
+        comment.news = second
+        comment.save()
+
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual((first.approved_comment_count, first.latest_comment_content), (0, ''))
+        self.assertEqual((second.approved_comment_count, second.latest_comment_content), (1, '加油'))
+
+
+class ParentAccessTests(FitnessTestCase):
+    def test_parent_can_read_but_not_modify_children_records(self):
+        parent = User.objects.create_user('p1', password='x', user_type='parent')
+        child = create_student('s1', parent=parent)
+        result = create_result(child, create_plan(), total_score=50)
+        notification = MakeupNotification.objects.get(student=child)
+        client = self.client_for(parent)
+
+        self.assertEqual(client.get(f'/api/test-results/{result.id}/').status_code, 200)
+        self.assertEqual(client.get(f'/api/notifications/{notification.id}/').status_code, 200)
+        self.assertEqual(client.patch(f'/api/test-results/{result.id}/', {'total_score': 90}).status_code, 403)
+        self.assertEqual(client.delete(f'/api/test-results/{result.id}/').status_code, 403)
+        self.assertEqual(client.delete(f'/api/notifications/{notification.id}/').status_code, 403)
+        self.assertEqual(client.post(f'/api/notifications/{notification.id}/mark_as_read/').status_code, 403)
+        result.refresh_from_db()
+        self.assertEqual(result.total_score, 50)
+        self.assertTrue(MakeupNotification.objects.filter(id=notification.id, is_read=False).exists())
+
+    def test_student_can_still_mark_own_notification_read(self):
+        student = create_student('s1')
+        create_result(student, create_plan(), total_score=50)
+        notification = MakeupNotification.objects.get(student=student)
+        response = self.client_for(student.user).post(f'/api/notifications/{notification.id}/mark_as_read/')
+        self.assertEqual(response.status_code, 200)
+
+
+class ExportTests(FitnessTestCase):
+    def test_plan_must_be_integer(self):
+        admin = User.objects.create_user('a1', password='x', user_type='admin', is_staff=True)
+        plan = create_plan()
+        create_result(create_student('s1'), plan)
+        client = self.client_for(admin)
+        response = client.get('/api/test-results/export/', {'plan': 'abc'})
+        self.assertEqual(response.status_code, 400)
+        response = client.get('/api/test-results/export/', {'plan': plan.id})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(b''.join(response.streaming_content).decode('utf-8-sig').splitlines()), 2)
+
+    @unittest.skipUnless(importlib.util.find_spec('pyarrow'), '需要安装 pyarrow')
+    def test_columnar_load_does_not_mix_formats(self):
+        plan = create_plan()
+        create_result(create_student('s1'), plan)
+        with tempfile.TemporaryDirectory() as output_dir:
+            for file_format in columnar.FORMATS:
+                columnar.export_columnar(TestResult.objects.all(), output_dir, file_format)
+            with self.assertRaises(ValueError):
+                columnar.load_results(output_dir)
+            self.assertEqual(columnar.load_results(output_dir, file_format='arrow').num_rows, 1)
+            self.assertEqual(columnar.load_results(output_dir, file_format='parquet').num_rows, 1)
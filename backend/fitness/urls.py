@@ -13,6 +13,7 @@ router.register(r'health-reports', views.HealthReportViewSet)
 router.register(r'news', views.SportsNewsViewSet)
 router.register(r'news-comments', views.NewsCommentViewSet)
 router.register(r'notifications', views.NotificationViewSet)
+router.register(r'moderation', views.ModerationViewSet, basename='moderation')
 
 urlpatterns = [
     path('', include(router.urls)),
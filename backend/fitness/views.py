@@ -3,9 +3,14 @@ from rest_framework import viewsets, permissions
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework import status
-from django.db.models import Q
+from rest_framework.exceptions import ValidationError
+from rest_framework.parsers import MultiPartParser
+from django.conf import settings
 from django.contrib.auth import authenticate
-from rest_framework_simplejwt.tokens import RefreshToken
+from django.db import transaction
+from django.db.models import F, Q
+from django.http import StreamingHttpResponse, FileResponse
+from django.utils.dateparse import parse_date, parse_datetime
 from .models import User, Student, PhysicalStandard, TestPlan, TestResult, Comment, HealthReport, SportsNews, NewsComment, MakeupNotification
 from .serializers import (
     UserSerializer, StudentSerializer, PhysicalStandardSerializer,
@@ -13,9 +18,21 @@ from .serializers import (
     SportsNewsSerializer, SportsNewsListSerializer, NewsCommentSerializer,
     MakeupNotificationSerializer
 )
+from .principal import get_principal, token_for_user
+from .login import LoginBusy
+from .roster import RosterImporter, limit_rows, read_roster, read_import_job, start_import_job
+from .moderation import MODERATION_MODELS, pending_queue, bulk_moderate
+from . import export, inbox
 
 # Create your views here.
 
+class ParentReadOnly(permissions.BasePermission):
+    """家长只能查看子女的数据，不能修改或删除"""
+    message = '家长只能查看子女的数据'
+
+    def has_permission(self, request, view):
+        return request.method in permissions.SAFE_METHODS or not get_principal(request).is_parent
+
 class UserViewSet(viewsets.ModelViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
@@ -24,10 +41,13 @@ class UserViewSet(viewsets.ModelViewSet):
     def login(self, request):
         username = request.data.get('username')
         password = request.data.get('password')
-        user = authenticate(username=username, password=password)
+        try:
+            user = authenticate(request, username=username, password=password)
+        except LoginBusy as e:
+            return Response({'error': str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
         if user:
             # 使用JWT认证，生成access和refresh token
-            refresh = RefreshToken.for_user(user)
+            refresh = token_for_user(user)
             return Response({
                 'refresh': str(refresh),
                 'access': str(refresh.access_token),
@@ -40,11 +60,46 @@ class StudentViewSet(viewsets.ModelViewSet):
     queryset = Student.objects.all()
     serializer_class = StudentSerializer
     
+    @action(detail=False, methods=['post'], parser_classes=[MultiPartParser])
+    def import_roster(self, request):
+        """上传CSV/XLSX名册批量导入学生
+
+        dry_run=true 时在请求中只校验不保存，直接返回报告；否则保存名册交给后台导入任务，
+        返回 202 和任务ID，通过 import_roster_status 查询进度和报告。
+        """
+        if get_principal(request).user_type != 'admin':
+            return Response({'error': '没有权限'}, status=status.HTTP_403_FORBIDDEN)
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({'error': '请上传名册文件'}, status=status.HTTP_400_BAD_REQUEST)
+        dry_run = str(request.data.get('dry_run', 'false')).lower() == 'true'
+        if not dry_run:
+            # 新账号的密码哈希代价很高，不在请求进程中计算
+            job_id = start_import_job(upload)
+            return Response({'job_id': job_id, 'status': 'running'}, status=status.HTTP_202_ACCEPTED)
+        try:
+            rows = limit_rows(read_roster(upload, upload.name), settings.FITNESS_ROSTER_UPLOAD_MAX_ROWS)
+            report = RosterImporter(dry_run=True, hash_workers=1).run(rows)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(dict(report, dry_run=True))
+
+    @action(detail=False, methods=['get'])
+    def import_roster_status(self, request):
+        """查询名册导入任务的状态，完成后返回导入报告"""
+        if get_principal(request).user_type != 'admin':
+            return Response({'error': '没有权限'}, status=status.HTTP_403_FORBIDDEN)
+        job = read_import_job(request.query_params.get('job_id'))
+        if job is None:
+            return Response({'error': '导入任务不存在'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(job)
+    
     def get_queryset(self):
-        if self.request.user.user_type == 'admin':
+        principal = get_principal(self.request)
+        if principal.is_admin:
             return Student.objects.all()
-        elif self.request.user.user_type == 'student':
-            return Student.objects.filter(user=self.request.user)
+        elif principal.is_student:
+            return Student.objects.filter(id=principal.student_id)
         return Student.objects.none()
 
 class PhysicalStandardViewSet(viewsets.ModelViewSet):
@@ -61,8 +116,10 @@ class TestPlanViewSet(viewsets.ModelViewSet):
     serializer_class = TestPlanSerializer
     
     def get_queryset(self):
+        principal = get_principal(self.request)
+        
         # 管理员可以查看所有测试计划
-        if self.request.user.user_type == 'admin':
+        if principal.is_admin:
             return TestPlan.objects.all()
             
         # 处理请求参数
@@ -70,15 +127,15 @@ class TestPlanViewSet(viewsets.ModelViewSet):
         student_filter = self.request.query_params.get('student', 'false').lower() == 'true'
         
         # 家长用户
-        if self.request.user.user_type == 'parent' or parent_filter:
+        if principal.is_parent or parent_filter:
             try:
                 # 获取家长关联的学生
-                students = Student.objects.filter(parent_id=self.request.user.id)
-                student_ids = [student.id for student in students]
+                student_ids = principal.child_ids
                 
                 # 只返回常规计划和该家长子女的补考计划
-                makeup_notifications = MakeupNotification.objects.filter(student_id__in=student_ids)
-                makeup_plan_ids = [notification.test_plan_id for notification in makeup_notifications]
+                makeup_plan_ids = MakeupNotification.objects.filter(
+                    student_id__in=student_ids
+                ).values_list('test_plan_id', flat=True)
                 
                 # 返回常规计划和该家长子女的补考计划
                 return TestPlan.objects.filter(
@@ -89,15 +146,16 @@ class TestPlanViewSet(viewsets.ModelViewSet):
                 return TestPlan.objects.filter(plan_type='regular')  # 默认只返回常规计划
         
         # 学生用户
-        elif self.request.user.user_type == 'student' or student_filter:
+        elif principal.is_student or student_filter:
             try:
                 # 获取学生的ID
-                student_id = self.request.user.student_profile.id if hasattr(self.request.user, 'student_profile') else None
+                student_id = principal.student_id
                 
                 if student_id:
                     # 获取该学生相关的补考通知
-                    makeup_notifications = MakeupNotification.objects.filter(student_id=student_id)
-                    makeup_plan_ids = [notification.test_plan_id for notification in makeup_notifications]
+                    makeup_plan_ids = MakeupNotification.objects.filter(
+                        student_id=student_id
+                    ).values_list('test_plan_id', flat=True)
                     
                     # 返回常规计划和该学生的补考计划
                     return TestPlan.objects.filter(
@@ -120,12 +178,18 @@ class TestPlanViewSet(viewsets.ModelViewSet):
 class TestResultViewSet(viewsets.ModelViewSet):
     queryset = TestResult.objects.all()
     serializer_class = TestResultSerializer
+    permission_classes = [permissions.IsAuthenticated, ParentReadOnly]
     
     def get_queryset(self):
-        if self.request.user.user_type == 'admin':
-            return TestResult.objects.all()
-        elif self.request.user.user_type == 'student':
-            return TestResult.objects.filter(student__user=self.request.user)
+        principal = get_principal(self.request)
+        queryset = TestResult.objects.select_related('student', 'test_plan')
+        if principal.is_admin:
+            return queryset
+        elif principal.is_student:
+            return queryset.filter(student_id=principal.student_id)
+        elif principal.is_parent:
+            # 家长可以查看自己孩子的成绩
+            return queryset.filter(student_id__in=principal.child_ids)
         return TestResult.objects.none()
     
     @action(detail=False, methods=['get'])
@@ -133,27 +197,69 @@ class TestResultViewSet(viewsets.ModelViewSet):
         queryset = self.get_queryset().filter(total_score__lt=60, is_makeup=False)
         serializer = self.get_serializer(queryset, many=True)
         return Response(serializer.data)
+    
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """流式导出成绩
+
+        查询参数: file_format (csv 或 xlsx，默认 csv)、plan、class_name、date_from、date_to (YYYY-MM-DD)
+        """
+        params = request.query_params
+        file_format = params.get('file_format', 'csv')
+        if file_format not in export.CONTENT_TYPES:
+            return Response({'error': '不支持的导出格式'}, status=status.HTTP_400_BAD_REQUEST)
+        dates = {}
+        for name in ('date_from', 'date_to'):
+            if params.get(name):
+                try:
+                    dates[name] = parse_date(params[name])
+                except ValueError:
+                    dates[name] = None
+                if dates[name] is None:
+                    return Response({'error': f'{name} 日期格式错误'}, status=status.HTTP_400_BAD_REQUEST)
+        plan = params.get('plan')
+        if plan:
+            try:
+                plan = int(plan)
+            except ValueError:
+                return Response({'error': 'plan 必须是整数'}, status=status.HTTP_400_BAD_REQUEST)
+        queryset = export.filter_results(
+            self.get_queryset(), plan=plan, class_name=params.get('class_name'), **dates
+        )
+        
+        filename = f'test_results.{file_format}'
+        if file_format == 'csv':
+            response = StreamingHttpResponse(
+                export.stream_csv(export.iter_rows(queryset)), content_type=export.CONTENT_TYPES['csv']
+            )
+            response['Content-Disposition'] = f'attachment; filename="{filename}"'
+            return response
+        try:
+            output = export.xlsx_tempfile(export.iter_rows(queryset))
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return FileResponse(
+            output, as_attachment=True, filename=filename, content_type=export.CONTENT_TYPES['xlsx']
+        )
 
 class CommentViewSet(viewsets.ModelViewSet):
     queryset = Comment.objects.all()
     serializer_class = CommentSerializer
     
     def perform_create(self, serializer):
-        if self.request.user.user_type != 'student':
+        principal = get_principal(self.request)
+        if not principal.is_student:
             raise permissions.PermissionDenied("只有学生可以发表评论")
-        try:
-            student = Student.objects.get(user=self.request.user)
-            serializer.save(student=student)
-        except Student.DoesNotExist:
-            raise serializers.ValidationError("用户没有关联的学生信息")
+        if principal.student_id is None:
+            raise ValidationError("用户没有关联的学生信息")
+        serializer.save(student_id=principal.student_id)
     
     @action(detail=True, methods=['post'])
     def approve(self, request, pk=None):
         if request.user.user_type != 'admin':
             return Response({'error': '没有权限'}, status=status.HTTP_403_FORBIDDEN)
         comment = self.get_object()
-        comment.is_approved = True
-        comment.save()
+        bulk_moderate({'comment': [comment.id]}, approve=True)
         return Response({'status': '评论已审核通过'})
 
 class HealthReportViewSet(viewsets.ModelViewSet):
@@ -161,17 +267,17 @@ class HealthReportViewSet(viewsets.ModelViewSet):
     serializer_class = HealthReportSerializer
     
     def get_queryset(self):
-        if self.request.user.user_type == 'admin':
+        principal = get_principal(self.request)
+        if principal.is_admin:
             return HealthReport.objects.all()
-        elif self.request.user.user_type in ['student', 'parent']:
+        elif principal.is_student or principal.is_parent:
             # 学生只能查看自己的报告，家长可以查看自己孩子的报告
-            if self.request.user.user_type == 'student':
-                student = Student.objects.filter(user=self.request.user).first()
-                if student:
-                    return HealthReport.objects.filter(test_result__student=student)
+            if principal.is_student:
+                if principal.student_id:
+                    return HealthReport.objects.filter(test_result__student_id=principal.student_id)
                 return HealthReport.objects.none()  # 学生用户没有关联学生档案时返回空查询集
             else:  # 家长
-                return HealthReport.objects.filter(test_result__student__parent=self.request.user)
+                return HealthReport.objects.filter(test_result__student_id__in=principal.child_ids)
         return HealthReport.objects.none()
 
 class SportsNewsViewSet(viewsets.ModelViewSet):
@@ -192,15 +298,15 @@ class SportsNewsViewSet(viewsets.ModelViewSet):
     def increment_views(self, request, pk=None):
         """增加浏览次数"""
         news = self.get_object()
-        news.views += 1
-        news.save()
+        # 原子累加，不触发 post_save（保存整条新闻会重建它的检索索引）
+        SportsNews.objects.filter(pk=news.pk).update(views=F('views') + 1)
         return Response({'status': 'views updated'})
     
     @action(detail=True, methods=['get'])
     def comments(self, request, pk=None):
         """获取新闻评论"""
         news = self.get_object()
-        comments = NewsComment.objects.filter(news=news, is_approved=True)
+        comments = NewsComment.objects.filter(news=news, is_approved=True).select_related('student')
         serializer = NewsCommentSerializer(comments, many=True)
         return Response(serializer.data)
 
@@ -214,49 +320,146 @@ class NewsCommentViewSet(viewsets.ModelViewSet):
         return [permissions.IsAuthenticated()]
     
     def get_queryset(self):
-        if self.request.user.user_type == 'admin':
+        principal = get_principal(self.request)
+        if principal.is_admin:
             return NewsComment.objects.all()
-        return NewsComment.objects.filter(student__user=self.request.user, is_approved=True)
+        return NewsComment.objects.filter(student_id=principal.student_id, is_approved=True)
     
     # 确保只有学生可以创建评论，并且评论与当前登录的学生关联
     def perform_create(self, serializer):
-        if self.request.user.user_type != 'student':
+        principal = get_principal(self.request)
+        if not principal.is_student:
             raise permissions.PermissionDenied("只有学生可以发表评论")
-        try:
-            student = Student.objects.get(user=self.request.user)
-            serializer.save(student=student)
-        except Student.DoesNotExist:
-            raise serializers.ValidationError("用户没有关联的学生信息")
+        if principal.student_id is None:
+            raise ValidationError("用户没有关联的学生信息")
+        # 评论与新闻的评论统计在同一事务中写入（见 models 中的信号）
+        with transaction.atomic():
+            serializer.save(student_id=principal.student_id)
+    
+    def perform_update(self, serializer):
+        with transaction.atomic():
+            serializer.save()
+    
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            instance.delete()
     
     # 审核评论
     @action(detail=True, methods=['post'])
     def approve(self, request, pk=None):
         comment = self.get_object()
-        comment.is_approved = True
-        comment.save()
+        bulk_moderate({'news_comment': [comment.id]}, approve=True)
         return Response({'status': 'success'})
 
 # 添加新的 NotificationViewSet 用于处理通知
 class NotificationViewSet(viewsets.ModelViewSet):
     queryset = MakeupNotification.objects.all()
     serializer_class = MakeupNotificationSerializer
+    permission_classes = [permissions.IsAuthenticated, ParentReadOnly]
     
-    def get_queryset(self):
-        # 只显示当前用户的通知
-        if self.request.user.user_type == 'admin':
+    def _visible_notifications(self):
+        """当前用户可见的全部通知，不应用查询参数中的过滤条件"""
+        principal = get_principal(self.request)
+        if principal.is_admin:
             return MakeupNotification.objects.all()
-        elif self.request.user.user_type == 'student':
-            try:
-                student = Student.objects.get(user=self.request.user)
-                return MakeupNotification.objects.filter(student=student)
-            except Student.DoesNotExist:
-                return MakeupNotification.objects.none()
+        elif principal.is_student:
+            return MakeupNotification.objects.filter(student_id=principal.student_id)
+        elif principal.is_parent:
+            # 家长可以查看自己孩子的通知
+            return MakeupNotification.objects.filter(student_id__in=principal.child_ids)
         return MakeupNotification.objects.none()
     
+    def get_queryset(self):
+        # 只显示当前用户的通知
+        queryset = self._visible_notifications()
+        
+        # 增量同步：只返回指定时间之后发送的通知
+        since = self.request.query_params.get('since')
+        if since:
+            since_dt = parse_datetime(since)
+            if since_dt is None:
+                raise ValidationError({'since': '无效的时间格式'})
+            queryset = queryset.filter(sent_at__gt=since_dt)
+        if self.request.query_params.get('unread', 'false').lower() == 'true':
+            queryset = queryset.filter(is_read=False)
+        return queryset.select_related('student', 'test_plan').order_by('-sent_at')
+    
     # 标记通知为已读
     @action(detail=True, methods=['post'])
     def mark_as_read(self, request, pk=None):
         notification = self.get_object()
-        notification.is_read = True
-        notification.save()
+        inbox.mark_read(MakeupNotification.objects.filter(pk=notification.pk))
         return Response({'status': 'success'})
+    
+    # 将当前用户的所有通知标记为已读
+    @action(detail=False, methods=['post'])
+    def mark_all_read(self, request):
+        updated = inbox.mark_read(self.get_queryset())
+        return Response({'status': 'success', 'updated': updated})
+    
+    # 未读通知数，用于角标轮询
+    @action(detail=False, methods=['get'])
+    def unread_count(self, request):
+        if request.user.user_type not in ('admin', 'student', 'parent'):
+            return Response({'unread_count': 0})
+        # 未读数按用户缓存，必须按全部可见通知统计，不能使用带 since/unread 过滤的列表查询集
+        count = inbox.get_unread_count(request.user, self._visible_notifications())
+        return Response({'unread_count': count})
+
+class ModerationViewSet(viewsets.ViewSet):
+    """评论审核队列，统一处理成绩评论和新闻评论"""
+
+    def _check_admin(self, request):
+        if request.user.user_type != 'admin':
+            return Response({'error': '没有权限'}, status=status.HTTP_403_FORBIDDEN)
+        return None
+
+    def _parse_ids(self, request):
+        """从请求中读取 comment_ids / news_comment_ids"""
+        ids_by_kind = {}
+        for kind in MODERATION_MODELS:
+            ids = request.data.get(f'{kind}_ids', [])
+            if not isinstance(ids, list):
+                raise ValueError(f'{kind}_ids 必须是列表')
+            ids_by_kind[kind] = [int(pk) for pk in ids]
+        if not any(ids_by_kind.values()):
+            raise ValueError('请提供需要审核的评论ID')
+        return ids_by_kind
+
+    def list(self, request):
+        """待审核评论列表，使用 cursor 参数翻页"""
+        denied = self._check_admin(request)
+        if denied:
+            return denied
+        kind = request.query_params.get('kind')
+        if kind and kind not in MODERATION_MODELS:
+            return Response({'error': '无效的评论类型'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            items, next_cursor = pending_queue(
+                cursor=request.query_params.get('cursor'),
+                limit=request.query_params.get('limit', 50),
+                kinds=[kind] if kind else None,
+            )
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'results': items, 'next_cursor': next_cursor})
+
+    def _moderate(self, request, approve):
+        denied = self._check_admin(request)
+        if denied:
+            return denied
+        try:
+            ids_by_kind = self._parse_ids(request)
+        except (TypeError, ValueError) as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'status': 'success', 'processed': bulk_moderate(ids_by_kind, approve=approve)})
+
+    @action(detail=False, methods=['post'])
+    def bulk_approve(self, request):
+        """批量通过评论"""
+        return self._moderate(request, approve=True)
+
+    @action(detail=False, methods=['post'])
+    def bulk_reject(self, request):
+        """批量拒绝（删除）评论"""
+        return self._moderate(request, approve=False)
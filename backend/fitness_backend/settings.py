@@ -48,6 +48,7 @@ INSTALLED_APPS = [
     'fitness',
     'ai_chat',  # 新增AI聊天应用
     'rest_framework_simplejwt',
+    'rest_framework_simplejwt.token_blacklist',
     'channels',
 ]
 
@@ -90,6 +91,24 @@ CHANNEL_LAYERS = {
     },
 }
 
+# 缓存：通知未读数、请求主体、AI档案摘要和用量计数保存在缓存中，多个进程之间必须共享。
+# 部署时通过 REDIS_URL 配置 Redis（例如 redis://127.0.0.1:6379/1）；未配置时使用进程内缓存，
+# 只适合单进程的开发环境（manage.py check --deploy 会给出警告）
+REDIS_URL = os.environ.get('REDIS_URL', '')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+    }
+
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
@@ -118,7 +137,7 @@ CORS_ALLOW_CREDENTIALS = True
 # Rest framework settings
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'fitness.authentication.PrincipalJWTAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
@@ -126,7 +145,8 @@ REST_FRAMEWORK = {
 }
 
 SIMPLE_JWT = {
-    'ACCESS_TOKEN_LIFETIME': timedelta(days=1),
+    # 访问令牌为无状态认证，声明在有效期内不会更新，因此保持较短的有效期
+    'ACCESS_TOKEN_LIFETIME': timedelta(minutes=15),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=7),
     'ROTATE_REFRESH_TOKENS': True,
     'BLACKLIST_AFTER_ROTATION': True,
@@ -138,8 +158,12 @@ SIMPLE_JWT = {
     'USER_ID_CLAIM': 'user_id',
     'AUTH_TOKEN_CLASSES': ('rest_framework_simplejwt.tokens.AccessToken',),
     'TOKEN_TYPE_CLAIM': 'token_type',
+    'TOKEN_REFRESH_SERIALIZER': 'fitness.authentication.FitnessTokenRefreshSerializer',
 }
 
+# 是否在JWT中携带用户类型、学生ID和子女ID，视图据此确定数据范围而无需查询数据库
+FITNESS_PRINCIPAL_TOKEN_CLAIMS = True
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -159,6 +183,50 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+# 密码哈希：首选算法由 PASSWORD_HASH_ALGORITHM 选择（scrypt 或 argon2，argon2 需要 argon2-cffi），
+# 代价参数见 FITNESS_PASSWORD_PROFILE。旧算法或旧参数的哈希会在用户下次登录时自动升级。
+PASSWORD_HASH_ALGORITHM = os.environ.get('PASSWORD_HASH_ALGORITHM', 'scrypt')
+
+FITNESS_PASSWORD_PROFILE = {
+    'scrypt': {
+        'work_factor': int(os.environ.get('SCRYPT_WORK_FACTOR', 2 ** 14)),
+        'block_size': 8,
+        'parallelism': 1,
+    },
+    'argon2': {
+        'time_cost': int(os.environ.get('ARGON2_TIME_COST', 2)),
+        'memory_cost': int(os.environ.get('ARGON2_MEMORY_COST', 65536)),
+        'parallelism': 1,
+    },
+}
+
+_PROFILE_HASHERS = {
+    'scrypt': 'fitness.hashers.ProfileScryptPasswordHasher',
+    'argon2': 'fitness.hashers.ProfileArgon2PasswordHasher',
+}
+
+PASSWORD_HASHERS = [
+    _PROFILE_HASHERS[PASSWORD_HASH_ALGORITHM],
+    *[hasher for name, hasher in _PROFILE_HASHERS.items() if name != PASSWORD_HASH_ALGORITHM],
+    'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+]
+
+# 用户名密码认证：与 ModelBackend 相同，密码哈希限制并发（见 fitness.login）
+AUTHENTICATION_BACKENDS = ['fitness.login.HashLimitedModelBackend']
+
+# 登录时同时计算密码哈希的数量、等待的请求数量和等待超时（秒）
+FITNESS_LOGIN_HASH_WORKERS = int(os.environ.get('LOGIN_HASH_WORKERS', os.cpu_count() or 2))
+FITNESS_LOGIN_QUEUE_SIZE = FITNESS_LOGIN_HASH_WORKERS * 4
+FITNESS_LOGIN_QUEUE_TIMEOUT = 5
+
+# 通过接口试运行（dry_run）名册时的最多行数，试运行在请求进程内校验全部行
+FITNESS_ROSTER_UPLOAD_MAX_ROWS = int(os.environ.get('ROSTER_UPLOAD_MAX_ROWS', 2000))
+
+# 接口上传的名册保存在此目录，由后台的 manage.py import_roster 命令导入，报告和输出也写在这里
+FITNESS_ROSTER_JOB_DIR = os.environ.get('ROSTER_JOB_DIR', str(BASE_DIR / 'roster_jobs'))
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/5.1/topics/i18n/
 
@@ -186,3 +254,15 @@ OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY', '')
 USE_OLLAMA_BY_DEFAULT = os.environ.get('USE_OLLAMA_BY_DEFAULT', 'False').lower() == 'true'
 OLLAMA_BASE_URL = os.environ.get('OLLAMA_BASE_URL', 'http://localhost:11434')
 DEEPSEEK_API_KEY = os.environ.get('DEEPSEEK_API_KEY', '')
+
+# 每个用户每天可使用的AI token 数（提示词和回复合计），为 0 时不限制
+AI_DAILY_TOKEN_QUOTA = int(os.environ.get('AI_DAILY_TOKEN_QUOTA', 0))
+
+# 每次请求发送给模型的提示词 token 预算（系统提示词、记忆摘要、历史消息和当前消息合计）
+AI_CONTEXT_TOKEN_BUDGET = int(os.environ.get('AI_CONTEXT_TOKEN_BUDGET', 8000))
+
+# 体育新闻和体测标准的本地检索索引目录（由 build_retrieval_index 命令建立，新闻保存时增量更新）
+AI_RETRIEVAL_INDEX_DIR = os.environ.get('AI_RETRIEVAL_INDEX_DIR', str(BASE_DIR / 'retrieval_index'))
+
+# 每次提问附加到系统提示词中的参考段落数，为 0 时不检索
+AI_RETRIEVAL_TOP_K = int(os.environ.get('AI_RETRIEVAL_TOP_K', 3))
@@ -3,12 +3,17 @@
 支持纯Python实现，不依赖mysqldump和mysql命令行工具
 """
 import os
+import io
 import sys
+import json
 import subprocess
 import argparse
 import pymysql
 import time
 import re
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from pymysql.converters import escape_item
 from dotenv import load_dotenv
 from pathlib import Path
 
@@ -37,6 +42,11 @@ def parse_args():
     parser.add_argument("--local-only", action="store_true", help="仅模拟本地迁移测试")
     parser.add_argument("--update-settings", action="store_true", help="更新Django设置文件")
     parser.add_argument("--pure-python", action="store_true", help="使用纯Python方法，不依赖mysqldump")
+    parser.add_argument("--dump-dir", default="db_dump", help="纯Python导出的目录（每张表一个文件和manifest.json）")
+    parser.add_argument("--workers", type=int, default=None, help="并行导出的进程数，默认为CPU核数")
+    parser.add_argument("--compress", choices=["gzip", "zstd"], default=None, help="压缩导出的SQL文件")
+    parser.add_argument("--batch-rows", type=int, default=DUMP_BATCH_ROWS, help="每条INSERT语句最多包含的行数")
+    parser.add_argument("--incremental-from", default=None, help="增量备份：上一次全量或增量备份的目录")
     
     return parser.parse_args()
 
@@ -106,88 +116,256 @@ def dump_database(host, port, user, password, database, dump_file):
         print(f"使用mysqldump导出出错: {e}")
         return False
 
-def dump_database_python(host, port, user, password, database, dump_file):
-    """使用纯Python方法将数据库导出到SQL文件"""
+# 纯Python导出的默认参数
+DUMP_BATCH_ROWS = 1000                 # 每条INSERT语句最多包含的行数
+DUMP_MAX_STATEMENT_BYTES = 1024 * 1024  # 每条INSERT语句的最大字节数，需小于目标库的 max_allowed_packet
+DUMP_PROGRESS_ROWS = 100000            # 每导出多少行打印一次进度
+MANIFEST_FILE = "manifest.json"
+
+# 支持增量备份的表 -> 记录创建时间的列。只有只追加写入的表才能加入：时间列是 auto_now_add，
+# 与自增主键同序，增量备份按主键高水位做范围扫描导出新增的行，时间高水位一并记录在 manifest 中。
+# 对已有行的修改和删除不会进入增量备份。目前没有满足条件的表：test_result（成绩可修改、删除）、
+# ai_chat_message（流式回复逐段写入内容）和 news_comment（审核修改状态）的已有行都会变化，
+# 又没有修改时间列和删除记录可以定位，因此每次都全量导出
+INCREMENTAL_TABLES = {}
+
+# 压缩方式 -> 文件扩展名
+COMPRESSION_SUFFIXES = {None: ".sql", "gzip": ".sql.gz", "zstd": ".sql.zst"}
+
+
+def open_dump_file(path, mode):
+    """按扩展名打开（可能压缩的）SQL转储文件，mode 为 'r' 或 'w'，返回文本流"""
+    if path.endswith(".gz"):
+        import gzip
+        return gzip.open(path, mode + "t", encoding="utf8")
+    if path.endswith(".zst"):
+        try:
+            import zstandard
+        except ImportError:
+            raise RuntimeError("读写zstd压缩文件需要安装 zstandard")
+        raw = open(path, mode + "b")
+        if mode == "w":
+            stream = zstandard.ZstdCompressor().stream_writer(raw)
+        else:
+            stream = zstandard.ZstdDecompressor().stream_reader(raw)
+        return io.TextIOWrapper(stream, encoding="utf8")
+    return open(path, mode, encoding="utf8")
+
+
+def write_insert_batches(f, table_name, columns, rows, literal,
+                         batch_rows=DUMP_BATCH_ROWS, max_statement_bytes=DUMP_MAX_STATEMENT_BYTES,
+                         verb="INSERT"):
+    """将行迭代器写成多条有界的多行 INSERT 语句
+
+    参数:
+        f: 输出文本流
+        table_name: 表名
+        columns: 列名列表
+        rows: 行元组迭代器
+        literal: 将Python值转换为SQL字面量的函数
+        batch_rows: 每条语句最多包含的行数
+        max_statement_bytes: 每条语句的近似最大字节数（单行超过该值时单独成句）
+        verb: INSERT 或 REPLACE（增量备份使用 REPLACE，重复回放也不会冲突）
+
+    返回:
+        写入的行数
+    """
+    header = f"{verb} INTO `{table_name}` (`{'`, `'.join(columns)}`) VALUES\n"
+    batch = []
+    size = 0
+    count = 0
+    for row in rows:
+        values = f"({', '.join(literal(value) for value in row)})"
+        if batch and (len(batch) >= batch_rows or size + len(values) > max_statement_bytes):
+            f.write(header + ",\n".join(batch) + ";\n")
+            batch = []
+            size = 0
+        batch.append(values)
+        # 按UTF-8估算字节数，中文字符按3字节计
+        size += len(values.encode("utf8")) + 2
+        count += 1
+    if batch:
+        f.write(header + ",\n".join(batch) + ";\n")
+    return count
+
+
+def _dump_table(connect_kwargs, table_name, path, batch_rows, max_statement_bytes, since=None):
+    """在子进程中导出一张表
+
+    全量导出写入表结构和分批的 INSERT 语句；指定 since（上次备份的高水位）时为增量导出，
+    只写入主键或时间列超过高水位的行，使用 REPLACE 语句且不重建表。
+    """
+    started = time.time()
+    connection = pymysql.connect(**connect_kwargs)
     try:
-        print("使用纯Python方法导出数据库...")
-        connection = pymysql.connect(
-            host=host,
-            port=port,
-            user=user,
-            password=password,
-            database=database,
-            charset='utf8mb4'
-        )
-        
         with connection.cursor() as cursor:
-            # 获取所有表
-            cursor.execute("SHOW TABLES")
-            tables = cursor.fetchall()
-            
-            with open(dump_file, 'w', encoding='utf8') as f:
-                # 写入SQL文件头部
-                f.write("-- 由Python生成的数据库转储\n")
-                f.write(f"-- 数据库: {database}\n")
-                f.write(f"-- 日期: {time.strftime('%Y-%m-%d %H:%M:%S')}\n\n")
-                
-                f.write("SET NAMES utf8mb4;\n")
-                f.write("SET FOREIGN_KEY_CHECKS = 0;\n\n")
-                
-                # 处理每个表
-                for table in tables:
-                    table_name = table[0]
-                    print(f"处理表: {table_name}")
-                    
-                    # 获取表结构
-                    cursor.execute(f"SHOW CREATE TABLE `{table_name}`")
-                    table_structure = cursor.fetchone()[1]
-                    
-                    f.write(f"-- 表结构 `{table_name}`\n")
-                    f.write(f"DROP TABLE IF EXISTS `{table_name}`;\n")
-                    f.write(f"{table_structure};\n\n")
-                    
-                    # 获取表数据
-                    cursor.execute(f"SELECT * FROM `{table_name}`")
-                    rows = cursor.fetchall()
-                    
-                    if rows:
-                        # 获取列名
-                        cursor.execute(f"SHOW COLUMNS FROM `{table_name}`")
-                        columns = [column[0] for column in cursor.fetchall()]
-                        
-                        f.write(f"-- 表数据 `{table_name}`\n")
-                        f.write(f"INSERT INTO `{table_name}` (`{'`, `'.join(columns)}`) VALUES\n")
-                        
-                        # 写入数据行
-                        row_values = []
-                        for row in rows:
-                            values = []
-                            for value in row:
-                                if value is None:
-                                    values.append("NULL")
-                                elif isinstance(value, (int, float)):
-                                    values.append(str(value))
-                                elif isinstance(value, bytes):
-                                    # 处理二进制数据
-                                    values.append(f"0x{value.hex()}")
-                                else:
-                                    # 转义字符串
-                                    escaped = str(value).replace("'", "''").replace("\\", "\\\\")
-                                    values.append(f"'{escaped}'")
-                            row_values.append(f"({', '.join(values)})")
-                        
-                        f.write(",\n".join(row_values))
-                        f.write(";\n\n")
-                
-                f.write("SET FOREIGN_KEY_CHECKS = 1;\n")
-        
+            cursor.execute(f"SHOW CREATE TABLE `{table_name}`")
+            table_structure = cursor.fetchone()[1]
+
+        def literal(value):
+            return escape_item(value, "utf8mb4")
+
+        # SSCursor 是服务器端游标，逐批从服务器读取，不会把整张表加载到内存
+        with connection.cursor(pymysql.cursors.SSCursor) as cursor, open_dump_file(path, "w") as f:
+            f.write(f"-- 表 `{table_name}`" + ("（增量）" if since else "") + "\n")
+            f.write("SET NAMES utf8mb4;\n")
+            f.write("SET FOREIGN_KEY_CHECKS = 0;\n")
+            if since:
+                # 按主键范围扫描，不需要时间列上的索引
+                cursor.execute(f"SELECT * FROM `{table_name}` WHERE `id` > %s", (since["id"],))
+            else:
+                f.write(f"DROP TABLE IF EXISTS `{table_name}`;\n")
+                f.write(f"{table_structure};\n")
+                cursor.execute(f"SELECT * FROM `{table_name}`")
+            columns = [column[0] for column in cursor.description]
+
+            def rows():
+                total = 0
+                while True:
+                    chunk = cursor.fetchmany(batch_rows)
+                    if not chunk:
+                        return
+                    for row in chunk:
+                        yield row
+                    previous, total = total, total + len(chunk)
+                    if total // DUMP_PROGRESS_ROWS > previous // DUMP_PROGRESS_ROWS:
+                        print(f"  {table_name}: 已导出 {total} 行", flush=True)
+
+            row_count = write_insert_batches(f, table_name, columns, rows(), literal,
+                                             batch_rows, max_statement_bytes,
+                                             verb="REPLACE" if since else "INSERT")
+    finally:
         connection.close()
-        print(f"数据库已成功使用Python导出到 {dump_file}")
+    return {
+        "name": table_name,
+        "file": os.path.basename(path),
+        "rows": row_count,
+        "incremental": bool(since),
+        "bytes": os.path.getsize(path),
+        "seconds": round(time.time() - started, 2),
+    }
+
+
+def read_manifest(dump_dir):
+    with open(os.path.join(dump_dir, MANIFEST_FILE), encoding="utf8") as f:
+        return json.load(f)
+
+
+def _high_water_marks(cursor, tables):
+    """在导出前读取增量表当前的最大主键和最大时间"""
+    marks = {}
+    for table_name in tables:
+        column = INCREMENTAL_TABLES.get(table_name)
+        if column is None:
+            continue
+        cursor.execute(f"SELECT MAX(`id`), MAX(`{column}`) FROM `{table_name}`")
+        max_id, max_time = cursor.fetchone()
+        marks[table_name] = {
+            "column": column,
+            "id": max_id or 0,
+            "timestamp": str(max_time) if max_time is not None else "1970-01-01 00:00:00",
+        }
+    return marks
+
+
+def dump_database_python(host, port, user, password, database, dump_dir, workers=None,
+                         compression=None, batch_rows=DUMP_BATCH_ROWS,
+                         max_statement_bytes=DUMP_MAX_STATEMENT_BYTES, incremental_from=None):
+    """使用纯Python方法将数据库导出到目录，每张表一个SQL文件，并写入 manifest.json
+
+    各表在进程池中并行导出，每张表使用服务器端游标流式读取，并写成有界的多行INSERT语句。
+    注意：各表在不同连接中导出，只保证单表内一致；需要全库一致快照时请在停写期间导出。
+
+    指定 incremental_from（上一次全量或增量备份的目录）时做增量备份：INCREMENTAL_TABLES
+    中的表只导出上次高水位之后的新行，其余表仍全量导出。manifest 记录本次的高水位和
+    上一次备份的路径，导入时按 全量 -> 增量 的链依次回放。
+    """
+    try:
+        print("使用纯Python方法导出数据库...")
+        if compression not in COMPRESSION_SUFFIXES:
+            print(f"不支持的压缩方式: {compression}")
+            return False
+        connect_kwargs = dict(host=host, port=port, user=user, password=password,
+                              database=database, charset="utf8mb4")
+        previous_marks = {}
+        if incremental_from:
+            if os.path.abspath(incremental_from) == os.path.abspath(dump_dir):
+                print("增量备份的目录不能与上一次备份相同")
+                return False
+            previous_marks = read_manifest(incremental_from).get("high_water_marks", {})
+
+        connection = pymysql.connect(**connect_kwargs)
+        try:
+            with connection.cursor() as cursor:
+                # 只导出基础表，按数据量从大到小排列，让最大的表最先开始
+                cursor.execute(
+                    "SELECT TABLE_NAME FROM information_schema.TABLES "
+                    "WHERE TABLE_SCHEMA = %s AND TABLE_TYPE = 'BASE TABLE' "
+                    "ORDER BY DATA_LENGTH DESC, TABLE_NAME",
+                    (database,)
+                )
+                tables = [row[0] for row in cursor.fetchall()]
+                # 必须在导出数据之前记录高水位，导出期间新增的行会在下次增量中再次导出（REPLACE 幂等）
+                high_water_marks = _high_water_marks(cursor, tables)
+        finally:
+            connection.close()
+
+        os.makedirs(dump_dir, exist_ok=True)
+        suffix = COMPRESSION_SUFFIXES[compression]
+        started = time.time()
+        results = []
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(_dump_table, connect_kwargs, table_name,
+                                os.path.join(dump_dir, table_name + suffix),
+                                batch_rows, max_statement_bytes,
+                                previous_marks.get(table_name)): table_name
+                for table_name in tables
+            }
+            for future in as_completed(futures):
+                result = future.result()
+                results.append(result)
+                print(f"[{len(results)}/{len(tables)}] {result['name']}: {result['rows']} 行, "
+                      f"{result['bytes'] / 1024 / 1024:.1f} MB, {result['seconds']}s")
+
+        order = {table_name: index for index, table_name in enumerate(sorted(tables))}
+        manifest = {
+            "format_version": 1,
+            "type": "incremental" if incremental_from else "full",
+            "parent": os.path.relpath(incremental_from, dump_dir) if incremental_from else None,
+            "database": database,
+            "created_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "compression": compression,
+            "high_water_marks": high_water_marks,
+            "tables": sorted(results, key=lambda result: order[result["name"]]),
+        }
+        with open(os.path.join(dump_dir, MANIFEST_FILE), "w", encoding="utf8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+        total_rows = sum(result["rows"] for result in results)
+        print(f"数据库已成功使用Python导出到 {dump_dir}（{len(tables)} 张表, {total_rows} 行, "
+              f"耗时 {time.time() - started:.1f}s）")
         return True
     except Exception as e:
         print(f"Python导出数据库错误: {e}")
         return False
 
+
+def dump_sql_files(dump_path):
+    """列出转储中的SQL文件
+
+    单个文件直接返回；目录按 manifest 顺序返回各表文件，增量备份先递归列出
+    上一次备份（直到全量备份）的文件，保证按 全量 -> 增量 的顺序回放。
+    """
+    if not os.path.isdir(dump_path):
+        return [dump_path]
+    manifest = read_manifest(dump_path)
+    files = []
+    if manifest.get("parent"):
+        files.extend(dump_sql_files(os.path.normpath(os.path.join(dump_path, manifest["parent"]))))
+    files.extend(os.path.join(dump_path, table["file"]) for table in manifest["tables"])
+    return files
+
 def import_database(host, port, user, password, database, dump_file):
     """从SQL文件导入数据库"""
     try:
@@ -214,51 +392,300 @@ def import_database(host, port, user, password, database, dump_file):
         print(f"使用mysql命令导入出错: {e}")
         return False
 
-def import_database_python(host, port, user, password, database, dump_file):
-    """使用纯Python方法从SQL文件导入数据库"""
-    try:
-        print("使用纯Python方法导入数据库...")
-        connection = pymysql.connect(
-            host=host,
-            port=port,
-            user=user,
-            password=password,
-            database=database,
-            charset='utf8mb4'
-        )
-        
-        # 读取SQL文件
-        with open(dump_file, 'r', encoding='utf8') as f:
-            sql_content = f.read()
-        
-        # 将SQL文件分割成单独的语句
-        # 这里的分割逻辑比较简单，可能需要根据具体SQL文件结构调整
-        statements = re.split(r';\s*\n', sql_content)
-        
+# 纯Python导入的默认参数
+LOAD_BATCH_STATEMENTS = 50              # 每个事务最多执行的INSERT语句数
+LOAD_BATCH_BYTES = 8 * 1024 * 1024      # 每个事务的INSERT语句总字节数上限（近似）
+
+# 普通文本中需要关注的记号：引号、语句结束符和注释开头
+_SQL_TOKEN_RE = re.compile(r"['\"`;#]|--|/\*")
+# 引号内的转义序列或结束引号
+_QUOTE_END_RE = {q: re.compile(r"\\.|" + q, re.S) for q in ("'", '"', "`")}
+_TABLE_RE = re.compile(
+    r"^\s*(?:INSERT(?:\s+IGNORE)?\s+INTO|REPLACE\s+INTO|DROP\s+TABLE(?:\s+IF\s+EXISTS)?|CREATE\s+TABLE(?:\s+IF\s+NOT\s+EXISTS)?)\s+`?([\w$]+)`?",
+    re.I
+)
+_DATA_STATEMENT_RE = re.compile(r"^\s*(?:INSERT|REPLACE)\s", re.I)
+_TABLE_DDL_RE = re.compile(r"^\s*(?:DROP|CREATE)\s+TABLE\s", re.I)
+_SKIPPED_STATEMENT_RE = re.compile(r"^\s*(?:LOCK\s+TABLES|UNLOCK\s+TABLES)\b", re.I)
+_DEFERRED_DEFINITION_RE = re.compile(r"^\s*(?:(?:UNIQUE|FULLTEXT|SPATIAL)\s+)?(?:KEY|INDEX)\s|^\s*CONSTRAINT\s", re.I)
+
+
+def iter_sql_statements(lines):
+    """从文本行迭代器中逐条切分SQL语句
+
+    识别单引号、双引号、反引号字符串（含反斜杠转义和连续引号）以及
+    ``--``、``#``、``/* */`` 注释，字符串和注释中的分号不会被当作语句结束符。
+    ``/*! ... */`` 形式的MySQL可执行注释原样保留。返回的语句不含结尾分号。
+    """
+    parts = []
+    quote = None        # 当前所在的引号
+    comment = None      # 当前所在的块注释：'skip' 丢弃，'keep' 为可执行注释原样保留
+    for line in lines:
+        pos = 0
+        end = len(line)
+        while pos < end:
+            if comment is not None:
+                close = line.find("*/", pos)
+                stop = end if close < 0 else close + 2
+                if comment == "keep":
+                    parts.append(line[pos:stop])
+                if close >= 0:
+                    comment = None
+                pos = stop
+                continue
+
+            if quote is not None:
+                start = pos
+                pattern = _QUOTE_END_RE[quote]
+                while True:
+                    match = pattern.search(line, pos)
+                    if match is None:
+                        pos = end
+                        break
+                    pos = match.end()
+                    if match.group() == quote:
+                        quote = None
+                        break
+                parts.append(line[start:pos])
+                continue
+
+            match = _SQL_TOKEN_RE.search(line, pos)
+            if match is None:
+                parts.append(line[pos:])
+                break
+            token = match.group()
+            if token in ("'", '"', "`"):
+                parts.append(line[pos:match.end()])
+                quote = token
+                pos = match.end()
+            elif token == ";":
+                parts.append(line[pos:match.start()])
+                statement = "".join(parts).strip()
+                if statement:
+                    yield statement
+                parts = []
+                pos = match.end()
+            elif token == "/*":
+                parts.append(line[pos:match.start()])
+                comment = "keep" if line.startswith("!", match.end()) else "skip"
+                if comment == "keep":
+                    parts.append("/*")
+                pos = match.end()
+            elif token == "--" and match.end() < end and not line[match.end()].isspace():
+                # MySQL 要求 "--" 后跟空白才是注释，例如 "a--1" 是表达式
+                parts.append(line[pos:match.end()])
+                pos = match.end()
+            else:
+                # 行注释，保留换行以免前后内容粘连
+                parts.append(line[pos:match.start()] + "\n")
+                pos = end
+    statement = "".join(parts).strip()
+    if statement:
+        yield statement
+
+
+def split_deferred_indexes(create_statement):
+    """从 CREATE TABLE 语句中拆出二级索引和外键定义
+
+    只处理 SHOW CREATE TABLE 格式（每个定义单独一行）的语句，无法识别时原样返回。
+
+    返回:
+        (不含二级索引和外键的 CREATE TABLE 语句, 被拆出的定义列表)
+    """
+    lines = create_statement.split("\n")
+    if len(lines) < 3:
+        return create_statement, []
+    body, deferred = [], []
+    for line in lines[1:-1]:
+        if _DEFERRED_DEFINITION_RE.match(line):
+            deferred.append(line.strip().rstrip(","))
+        else:
+            body.append(line.rstrip().rstrip(","))
+    if not deferred or not body:
+        return create_statement, []
+    statement = "\n".join([lines[0], ",\n".join(body), lines[-1]])
+    return statement, deferred
+
+
+class SqlDumpLoader:
+    """并行、分批的SQL转储导入器
+
+    主线程流式切分语句并按顺序执行表结构等语句；INSERT 语句按批提交到线程池，
+    每个工作线程使用独立连接（关闭外键和唯一性检查），每批在一个事务中执行。
+    开启 defer_indexes 时，建表时先去掉二级索引和外键，数据全部导入后
+    每张表执行一次 ALTER TABLE 统一重建。
+    """
+
+    def __init__(self, connect_kwargs, workers=4, defer_indexes=True,
+                 batch_statements=LOAD_BATCH_STATEMENTS, batch_bytes=LOAD_BATCH_BYTES):
+        self.connect_kwargs = dict(connect_kwargs, autocommit=False)
+        self.workers = max(1, workers)
+        self.defer_indexes = defer_indexes
+        self.batch_statements = batch_statements
+        self.batch_bytes = batch_bytes
+        self.executed = 0
+        self.failed = 0
+        self._deferred = {}           # 表名 -> 延迟创建的索引/外键定义
+        self._pending = {}            # 表名 -> 未完成的批次
+        self._batch = []
+        self._batch_size = 0
+        self._batch_table = None
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        # 限制在途批次数量，避免切分速度快于执行速度时占用大量内存
+        self._slots = threading.BoundedSemaphore(self.workers * 2)
+
+    def _connect(self):
+        connection = pymysql.connect(**self.connect_kwargs)
         with connection.cursor() as cursor:
-            # 设置外键约束检查为0
+            cursor.execute("SET NAMES utf8mb4")
             cursor.execute("SET FOREIGN_KEY_CHECKS = 0")
-            
-            # 执行每个语句
-            count = 0
-            for statement in statements:
-                statement = statement.strip()
-                if statement:
+            cursor.execute("SET UNIQUE_CHECKS = 0")
+        return connection
+
+    def _worker_connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._local.connection = self._connect()
+            with self._lock:
+                self._connections.append(connection)
+        return connection
+
+    def _record(self, executed, failed):
+        with self._lock:
+            self.executed += executed
+            self.failed += failed
+
+    def _report_error(self, error, statement):
+        print(f"执行SQL语句错误: {error}")
+        print(f"问题语句: {statement[:100]}...")
+
+    def _run_batch(self, statements):
+        """在工作线程中以一个事务执行一批INSERT语句"""
+        try:
+            connection = self._worker_connection()
+            executed = failed = 0
+            with connection.cursor() as cursor:
+                for statement in statements:
                     try:
                         cursor.execute(statement)
-                        count += 1
+                        executed += 1
                     except Exception as e:
-                        print(f"执行SQL语句错误: {e}")
-                        print(f"问题语句: {statement[:100]}...")
-            
-            # 恢复外键约束检查
-            cursor.execute("SET FOREIGN_KEY_CHECKS = 1")
-            
+                        failed += 1
+                        self._report_error(e, statement)
             connection.commit()
-        
-        connection.close()
-        print(f"已成功执行 {count} 条SQL语句")
-        print(f"数据库已成功使用Python方法导入到 {database}")
+            self._record(executed, failed)
+        finally:
+            self._slots.release()
+
+    def _flush(self):
+        if not self._batch:
+            return
+        self._slots.acquire()
+        future = self._executor.submit(self._run_batch, self._batch)
+        self._pending.setdefault(self._batch_table, []).append(future)
+        self._batch, self._batch_size, self._batch_table = [], 0, None
+
+    def _wait(self, table=None):
+        """等待指定表（为空时为所有表）的在途批次完成"""
+        self._flush()
+        tables = [table] if table is not None else list(self._pending)
+        for name in tables:
+            for future in self._pending.pop(name, []):
+                future.result()
+
+    def _execute(self, cursor, statement):
+        try:
+            cursor.execute(statement)
+            self._record(1, 0)
+        except Exception as e:
+            self._record(0, 1)
+            self._report_error(e, statement)
+
+    def _handle(self, cursor, statement):
+        if _SKIPPED_STATEMENT_RE.match(statement):
+            # 并行导入时锁表会阻塞其他连接
+            return
+        match = _TABLE_RE.match(statement)
+        table = match.group(1) if match else None
+
+        if _DATA_STATEMENT_RE.match(statement):
+            if table != self._batch_table or len(self._batch) >= self.batch_statements \
+                    or self._batch_size >= self.batch_bytes:
+                self._flush()
+            self._batch.append(statement)
+            self._batch_size += len(statement)
+            self._batch_table = table
+            return
+
+        if table is not None and _TABLE_DDL_RE.match(statement):
+            # 只需等待同一张表的数据写完
+            self._wait(table)
+            if self.defer_indexes and statement.lstrip()[:6].upper() == "CREATE":
+                statement, deferred = split_deferred_indexes(statement)
+                if deferred:
+                    self._deferred[table] = deferred
+            elif statement.lstrip()[:4].upper() == "DROP":
+                self._deferred.pop(table, None)
+        else:
+            self._wait()
+        self._execute(cursor, statement)
+
+    def _rebuild_indexes(self, table, definitions):
+        connection = self._worker_connection()
+        statement = f"ALTER TABLE `{table}` " + ", ".join(f"ADD {definition}" for definition in definitions)
+        started = time.time()
+        with connection.cursor() as cursor:
+            self._execute(cursor, statement)
+        connection.commit()
+        print(f"  {table}: 已重建 {len(definitions)} 个索引/外键, {time.time() - started:.1f}s")
+
+    def load(self, paths):
+        """依次导入SQL文件（可为压缩文件），返回 (成功语句数, 失败语句数)"""
+        connection = self._connect()
+        connection.autocommit(True)
+        self._executor = ThreadPoolExecutor(max_workers=self.workers)
+        try:
+            with connection.cursor() as cursor:
+                for path in paths:
+                    with open_dump_file(path, "r") as f:
+                        for statement in iter_sql_statements(f):
+                            self._handle(cursor, statement)
+                self._wait()
+                if self._deferred:
+                    print(f"正在重建 {len(self._deferred)} 张表的索引...")
+                    futures = [
+                        self._executor.submit(self._rebuild_indexes, table, definitions)
+                        for table, definitions in self._deferred.items()
+                    ]
+                    for future in futures:
+                        future.result()
+                cursor.execute("SET FOREIGN_KEY_CHECKS = 1")
+        finally:
+            self._executor.shutdown()
+            connection.close()
+            for worker_connection in self._connections:
+                worker_connection.close()
+        return self.executed, self.failed
+
+
+def load_sql_dump(host, port, user, password, database, dump_path, workers=4, defer_indexes=True):
+    """导入SQL转储文件或纯Python导出的目录，返回 (成功语句数, 失败语句数)"""
+    loader = SqlDumpLoader(
+        dict(host=host, port=port, user=user, password=password, database=database, charset="utf8mb4"),
+        workers=workers, defer_indexes=defer_indexes,
+    )
+    return loader.load(dump_sql_files(dump_path))
+
+def import_database_python(host, port, user, password, database, dump_file, workers=4):
+    """使用纯Python方法从SQL文件（或纯Python导出的目录）导入数据库"""
+    try:
+        print("使用纯Python方法导入数据库...")
+        started = time.time()
+        count, failed = load_sql_dump(host, port, user, password, database, dump_file, workers=workers)
+        print(f"已成功执行 {count} 条SQL语句" + (f"，{failed} 条失败" if failed else ""))
+        print(f"数据库已成功使用Python方法导入到 {database}，耗时 {time.time() - started:.1f}s")
         return True
     except Exception as e:
         print(f"Python导入数据库错误: {e}")
@@ -347,7 +774,9 @@ def main():
     # 导出源数据库
     print("正在导出源数据库...")
     if pure_python:
-        dump_success = dump_database_python(args.source_host, args.source_port, args.source_user, args.source_password, args.source_db, args.dump_file)
+        dump_success = dump_database_python(args.source_host, args.source_port, args.source_user, args.source_password, args.source_db, args.dump_dir,
+                                            workers=args.workers, compression=args.compress, batch_rows=args.batch_rows,
+                                            incremental_from=args.incremental_from)
     else:
         dump_success = dump_database(args.source_host, args.source_port, args.source_user, args.source_password, args.source_db, args.dump_file)
     
@@ -358,7 +787,8 @@ def main():
     # 导入到目标数据库
     print("正在导入到目标数据库...")
     if pure_python:
-        import_success = import_database_python(args.target_host, args.target_port, args.target_user, args.target_password, args.target_db, args.dump_file)
+        import_success = import_database_python(args.target_host, args.target_port, args.target_user, args.target_password, args.target_db, args.dump_dir,
+                                                workers=args.workers or os.cpu_count() or 4)
     else:
         import_success = import_database(args.target_host, args.target_port, args.target_user, args.target_password, args.target_db, args.dump_file)
     
@@ -1,5 +1,9 @@
 import api from './api';
 
+// 流式回复连接中断后的续传次数和间隔（毫秒，按次数递增）
+const STREAM_RESUME_RETRIES = 5;
+const STREAM_RESUME_DELAY = 1000;
+
 /**
  * AI聊天服务 - 处理与AI聊天相关的API请求
  */
@@ -40,12 +44,12 @@ const aiChatService = {
   },
   
   /**
-   * 获取对话的消息
+   * 获取对话的消息，从最新的消息开始向前翻页
    * @param {Number} conversationId 对话ID
-   * @param {Object} params 分页参数，包括 page 和 page_size
+   * @param {Object} params 分页参数，包括 before（上一页返回的 next_before）和 limit
    * @returns {Promise} 包含消息列表的Promise
    */
-  getMessages(conversationId, params = { page: 1, page_size: 20 }) {
+  getMessages(conversationId, params = { limit: 20 }) {
     return api.get(`/ai/conversations/${conversationId}/messages/`, { params });
   },
   
@@ -67,87 +71,124 @@ const aiChatService = {
   
   /**
    * 发送消息到AI并获取流式响应 - 支持查看生成过程
+   * 响应为 SSE 格式，连接在回复结束前中断时携带 Last-Event-ID 自动续传，不会重新生成回复
    * @param {Number} conversationId 对话ID
    * @param {String} message 用户消息内容
-   * @param {Function} onChunk 处理每个响应块的回调函数
+   * @param {Function} onChunk 处理每个响应块的回调函数 (text, messageId, { reset })，reset 为 true 时 text 是已生成的全部内容
    * @param {String} serviceType AI服务类型
    * @param {String} useCase 使用场景
    * @returns {Promise} 包含完整AI响应的Promise
    */
-  sendMessageStream(conversationId, message, onChunk, serviceType = 'auto', useCase = 'general') {
-    return new Promise((resolve, reject) => {
-      // 创建请求对象
+  async sendMessageStream(conversationId, message, onChunk, serviceType = 'auto', useCase = 'general') {
+    let messageId = null;
+    let lastEventId = 0;
+    
+    // 发送一次流式请求，逐个解析 SSE 事件，返回是否收到了结束事件
+    const open = (method, url, body) => new Promise((resolve, reject) => {
       const xhr = new XMLHttpRequest();
-      xhr.open('POST', `${api.defaults.baseURL}/ai/conversations/${conversationId}/send_message_stream/`);
+      xhr.open(method, url);
       
       // 设置请求头
       xhr.setRequestHeader('Content-Type', 'application/json');
       xhr.setRequestHeader('Authorization', `Bearer ${localStorage.getItem('token')}`);
-      
-      // 设置为流式响应
+      if (lastEventId) {
+        xhr.setRequestHeader('Last-Event-ID', String(lastEventId));
+      }
       xhr.responseType = 'text';
       
-      // 处理正在传输的数据
-      let receivedText = '';
-      let messageId = null;
+      let parsed = 0;
+      let finished = false;
+      let error = null;
       
-      xhr.onprogress = function() {
-        // 获取新接收的文本部分
-        const newText = xhr.responseText.substring(receivedText.length);
-        receivedText = xhr.responseText;
-        
-        try {
-          // 尝试解析为JSON - 有可能收到部分数据
-          const lines = newText.split('\n');
+      // 只处理已完整接收的事件（以空行结尾），未接收完的部分留到下次处理
+      const consume = () => {
+        const text = xhr.responseText;
+        let end;
+        while ((end = text.indexOf('\n\n', parsed)) !== -1) {
+          const frame = text.substring(parsed, end);
+          parsed = end + 2;
           
-          for (const line of lines) {
-            if (!line.trim()) continue;
-            
-            try {
-              const chunk = JSON.parse(line);
-              
-              // 获取消息ID（仅第一个块）
-              if (chunk.message_id && !messageId) {
-                messageId = chunk.message_id;
-              }
-              
-              // 调用回调处理块
-              if (chunk.chunk) {
-                onChunk(chunk.chunk, messageId);
-              }
-            } catch (e) {
-              console.warn('解析流式响应块失败:', e, line);
+          let id = null;
+          let data = '';
+          for (const line of frame.split('\n')) {
+            if (line.startsWith('id: ')) {
+              id = Number(line.substring(4));
+            } else if (line.startsWith('data: ')) {
+              data += line.substring(6);
             }
           }
-        } catch (e) {
-          console.error('处理流式响应失败:', e);
+          if (!data) continue;
+          
+          try {
+            const event = JSON.parse(data);
+            if (id !== null) {
+              lastEventId = id;
+            }
+            // 获取消息ID（第一个事件）
+            if (event.message_id && !messageId) {
+              messageId = event.message_id;
+            }
+            if (event.reset) {
+              onChunk(event.content, messageId, { reset: true });
+            }
+            if (event.chunk) {
+              onChunk(event.chunk, messageId, { reset: false });
+            }
+            if (event.status === 'complete') {
+              finished = true;
+            }
+            if (event.error) {
+              finished = true;
+              error = event.error;
+            }
+          } catch (e) {
+            console.warn('解析流式响应事件失败:', e, data);
+          }
         }
       };
       
+      xhr.onprogress = consume;
+      
       xhr.onload = function() {
+        consume();
         if (xhr.status >= 200 && xhr.status < 300) {
-          // 成功完成，返回最后的完整响应
-          resolve({
-            status: 'success',
-            message_id: messageId,
-            completed: true
-          });
+          resolve({ finished, error });
         } else {
           reject(new Error(`请求失败 ${xhr.status}: ${xhr.statusText}`));
         }
       };
       
+      // 网络中断时交给调用方决定是否续传
       xhr.onerror = function() {
-        reject(new Error('网络请求失败'));
+        resolve({ finished: false, error: null });
       };
       
-      // 发送请求
-      xhr.send(JSON.stringify({
-        message,
-        service_type: serviceType,
-        use_case: useCase
-      }));
+      xhr.send(body ? JSON.stringify(body) : null);
     });
+    
+    let result = await open('POST', `${api.defaults.baseURL}/ai/conversations/${conversationId}/send_message_stream/`, {
+      message,
+      service_type: serviceType,
+      use_case: useCase
+    });
+    
+    // 回复结束前连接中断，从最后收到的事件之后续传
+    for (let retry = 1; !result.finished && messageId && retry <= STREAM_RESUME_RETRIES; retry++) {
+      await new Promise(resolve => setTimeout(resolve, STREAM_RESUME_DELAY * retry));
+      result = await open('GET', `${api.defaults.baseURL}/ai/conversations/${conversationId}/messages/${messageId}/stream/`);
+    }
+    
+    if (result.error) {
+      throw new Error(result.error);
+    }
+    if (!result.finished) {
+      throw new Error('网络请求失败');
+    }
+    return {
+      status: 'success',
+      message_id: messageId,
+      completed: true
+    };
   },
   
   /**
@@ -177,6 +218,16 @@ const aiChatService = {
    */
   deleteMessage(conversationId, messageId) {
     return api.delete(`/ai/conversations/${conversationId}/messages/${messageId}/`);
+  },
+  
+  /**
+   * 估算发送一条消息的 token 消耗，不保存消息也不调用AI服务
+   * @param {Number} conversationId 对话ID
+   * @param {String} message 用户消息内容
+   * @returns {Promise} 包含 prompt_tokens、context_messages、budget、used_today、daily_quota 等字段的Promise
+   */
+  estimateTokens(conversationId, message) {
+    return api.post(`/ai/conversations/${conversationId}/estimate_tokens/`, { message });
   }
 };
 
@@ -5,8 +5,7 @@ const state = {
   conversations: [],
   currentConversation: null,
   messages: [],
-  currentPage: 1,
-  totalPages: 0,
+  nextBefore: null,  // 加载更早消息的游标，为空表示没有更早的消息
   loading: false,
   loadingMore: false,  // 加载更多消息状态
   sendingMessage: false,
@@ -30,14 +29,8 @@ const getters = {
   // 是否正在加载更多消息
   isLoadingMore: state => state.loadingMore,
   
-  // 当前页码
-  currentPage: state => state.currentPage,
-  
-  // 总页数
-  totalPages: state => state.totalPages,
-  
   // 是否有更多消息可加载
-  hasMoreMessages: state => state.currentPage < state.totalPages,
+  hasMoreMessages: state => state.nextBefore !== null,
   
   // 是否正在发送消息
   isSendingMessage: state => state.sendingMessage,
@@ -91,7 +84,7 @@ const mutations = {
   // 设置消息列表
   SET_MESSAGES(state, messages) {
     state.messages = messages || [];
-    state.currentPage = 1;  // 重置当前页
+    state.nextBefore = null;  // 重置分页游标
   },
   
   // 添加更多消息到列表头部
@@ -112,9 +105,8 @@ const mutations = {
   },
   
   // 设置分页信息
-  SET_PAGINATION(state, { currentPage, totalPages }) {
-    state.currentPage = currentPage;
-    state.totalPages = totalPages;
+  SET_PAGINATION(state, { nextBefore }) {
+    state.nextBefore = nextBefore;
   },
   
   // 更新正在流式生成的消息内容
@@ -297,16 +289,13 @@ const actions = {
     commit('CLEAR_ERROR');
     
     try {
-      // 默认加载第一页，每页 20 条消息，最新的消息在前
-      const response = await aiChatService.getMessages(conversationId, { page: 1, page_size: 20 });
-      const { results, count, next, previous } = response.data;
-      
-      // 计算总页数 (每页 20 条)
-      const totalPages = Math.ceil(count / 20);
+      // 加载最新的 20 条消息
+      const response = await aiChatService.getMessages(conversationId, { limit: 20 });
+      const { results, next_before } = response.data;
       
-      // 更新消息列表和分页信息
+      // 更新消息列表和分页游标
       commit('SET_MESSAGES', results);
-      commit('SET_PAGINATION', { currentPage: 1, totalPages });
+      commit('SET_PAGINATION', { nextBefore: next_before });
       
       return results;
     } catch (error) {
@@ -320,8 +309,8 @@ const actions = {
   
   // 加载更多历史消息
   async loadMoreMessages({ commit, state }, conversationId) {
-    // 如果当前已经是最后一页或正在加载，则不再加载
-    if (state.currentPage >= state.totalPages || state.loadingMore) {
+    // 如果没有更早的消息或正在加载，则不再加载
+    if (state.nextBefore === null || state.loadingMore) {
       return;
     }
     
@@ -329,13 +318,12 @@ const actions = {
     commit('CLEAR_ERROR');
     
     try {
-      const nextPage = state.currentPage + 1;
-      const response = await aiChatService.getMessages(conversationId, { page: nextPage, page_size: 20 });
-      const { results, count, next, previous } = response.data;
+      const response = await aiChatService.getMessages(conversationId, { before: state.nextBefore, limit: 20 });
+      const { results, next_before } = response.data;
       
       // 将返回的消息添加到当前消息列表的前面
       commit('PREPEND_MESSAGES', results);
-      commit('SET_PAGINATION', { currentPage: nextPage, totalPages: Math.ceil(count / 20) });
+      commit('SET_PAGINATION', { nextBefore: next_before });
       
       return results;
     } catch (error) {
@@ -381,8 +369,9 @@ const actions = {
       let fullContent = ''; // 最终累积的完整内容
       
       // 定义处理每个响应块的回调函数
-      const handleChunk = (chunk, messageId) => {
-        fullContent += chunk; // 逐步累积完整内容
+      const handleChunk = (chunk, messageId, { reset } = {}) => {
+        // 续传时可能收到已生成的全部内容，替换而不是追加
+        fullContent = reset ? chunk : fullContent + chunk;
         
         // 更新当前消息的内容
         commit('UPDATE_STREAMING_MESSAGE', {
@@ -10,6 +10,7 @@ import time
 import re
 from pathlib import Path
 from dotenv import load_dotenv
+from db_migration import load_sql_dump
 
 # 加载环境变量（如果有）
 load_dotenv()
@@ -236,47 +237,11 @@ def import_from_sql_file(host, port, user, password, database, sql_file):
         print(f"使用mysql命令导入失败: {e}")
         print("尝试使用Python方法导入...")
     
-    # 如果MySQL命令行导入失败，使用Python方法
+    # 如果MySQL命令行导入失败，使用Python方法（流式切分语句，分批并行导入）
     try:
-        connection = pymysql.connect(
-            host=host,
-            port=port,
-            user=user,
-            password=password,
-            database=database,
-            charset='utf8mb4'
-        )
-        
-        # 读取SQL文件
-        with open(sql_file, 'r', encoding='utf8') as f:
-            sql_content = f.read()
-        
-        # 将SQL文件分割成单独的语句
-        statements = re.split(r';\s*\n', sql_content)
-        
-        with connection.cursor() as cursor:
-            # 设置外键约束检查为0
-            cursor.execute("SET FOREIGN_KEY_CHECKS = 0")
-            
-            # 执行每个语句
-            count = 0
-            for statement in statements:
-                statement = statement.strip()
-                if statement:
-                    try:
-                        cursor.execute(statement)
-                        count += 1
-                    except Exception as e:
-                        print(f"执行SQL语句错误: {e}")
-                        print(f"问题语句: {statement[:100]}...")
-            
-            # 恢复外键约束检查
-            cursor.execute("SET FOREIGN_KEY_CHECKS = 1")
-            
-            connection.commit()
-        
-        connection.close()
-        print(f"已成功执行 {count} 条SQL语句")
+        count, failed = load_sql_dump(host, port, user, password, database, str(sql_file),
+                                      workers=os.cpu_count() or 4)
+        print(f"已成功执行 {count} 条SQL语句" + (f"，{failed} 条失败" if failed else ""))
         print(f"数据已成功导入到 {database}")
         return True
     except Exception as e:
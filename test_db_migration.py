@@ -0,0 +1,76 @@
+"""db_migration 中SQL转储解析的单元测试
+
+运行: python -m unittest test_db_migration
+"""
+import unittest
+from db_migration import iter_sql_statements, split_deferred_indexes
+
+
+def statements(text):
+    return list(iter_sql_statements(text.splitlines(keepends=True)))
+
+
+class IterSqlStatementsTests(unittest.TestCase):
+    def test_semicolons_inside_strings_and_identifiers(self):
+        sql = (
+            "INSERT INTO `a;b` VALUES ('x;y', \"p;q\");\n"
+            "INSERT INTO t VALUES ('it''s;', 'back\\\\slash;', 'esc\\';aped');\n"
+        )
+        self.assertEqual(statements(sql), [
+            "INSERT INTO `a;b` VALUES ('x;y', \"p;q\")",
+            "INSERT INTO t VALUES ('it''s;', 'back\\\\slash;', 'esc\\';aped')",
+        ])
+
+    def test_string_spanning_lines(self):
+        sql = "INSERT INTO t VALUES ('第一行;\n第二行');\nSELECT 1;\n"
+        self.assertEqual(statements(sql), ["INSERT INTO t VALUES ('第一行;\n第二行')", "SELECT 1"])
+
+    def test_comments_are_dropped_and_executable_comments_kept(self):
+        sql = (
+            "-- 导出说明; 不是语句\n"
+            "# 另一种注释;\n"
+            "/* 多行\n注释; */\n"
+            "/*!40101 SET NAMES utf8mb4 */;\n"
+            "SELECT 1 -- 行尾注释;\n"
+            ", 2;\n"
+        )
+        self.assertEqual(statements(sql), ["/*!40101 SET NAMES utf8mb4 */", "SELECT 1 \n, 2"])
+
+    def test_double_dash_without_space_is_not_a_comment(self):
+        self.assertEqual(statements("SELECT 5--1;\n"), ["SELECT 5--1"])
+
+    def test_last_statement_without_semicolon(self):
+        self.assertEqual(statements("SELECT 1;\nSELECT 2\n"), ["SELECT 1", "SELECT 2"])
+
+
+class SplitDeferredIndexesTests(unittest.TestCase):
+    def test_moves_secondary_indexes_and_constraints(self):
+        create = (
+            "CREATE TABLE `t` (\n"
+            "  `id` int NOT NULL,\n"
+            "  `user_id` int NOT NULL,\n"
+            "  PRIMARY KEY (`id`),\n"
+            "  KEY `t_user_idx` (`user_id`),\n"
+            "  CONSTRAINT `t_user_fk` FOREIGN KEY (`user_id`) REFERENCES `u` (`id`)\n"
+            ") ENGINE=InnoDB"
+        )
+        statement, deferred = split_deferred_indexes(create)
+        self.assertEqual(statement, (
+            "CREATE TABLE `t` (\n"
+            "  `id` int NOT NULL,\n"
+            "  `user_id` int NOT NULL,\n"
+            "  PRIMARY KEY (`id`)\n"
+            ") ENGINE=InnoDB"
+        ))
+        self.assertEqual(deferred, [
+            "KEY `t_user_idx` (`user_id`)",
+            "CONSTRAINT `t_user_fk` FOREIGN KEY (`user_id`) REFERENCES `u` (`id`)",
+        ])
+
+    def test_single_line_statement_is_unchanged(self):
+        create = "CREATE TABLE t (id int, KEY k (id))"
+        self.assertEqual(split_deferred_indexes(create), (create, []))
+
+
+if __name__ == "__main__":
+    unittest.main()